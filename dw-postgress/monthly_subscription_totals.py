@@ -7,29 +7,27 @@ import os
 import sys
 import psycopg2
 from datetime import datetime, timedelta
+from pathlib import Path
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 
+# Repo root, for the shared database module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import td_db
+
 def get_monthly_subscription_totals():
     """Get subscription totals for the last completed month."""
     
     # Load environment variables
     load_dotenv()
     
-    # Database connection parameters
-    db_params = {
-        'host': os.getenv('DB_HOST'),
-        'port': os.getenv('DB_PORT'),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require'),
-        'sslrootcert': 'ca-certificate.crt'
-    }
+    # Database connection parameters (the certificate is found next to this script or in the working directory)
+    db_params = td_db.get_db_config(sslrootcert=os.getenv('DB_SSLROOTCERT', 'ca-certificate.crt'),
+                                    search_dirs=[Path(__file__).parent])
     
     try:
         # Establish connection
-        conn = psycopg2.connect(**db_params)
+        conn = td_db.connect(db_params)
         cursor = conn.cursor()
         
         # Calculate last completed month
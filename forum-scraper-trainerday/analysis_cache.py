@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of parsed LLM analyses.
+Keyed by sha256 of model + full chat messages (prompt template and cleaned topic
+JSON), so re-running an unchanged topic with the same prompt costs nothing, while
+any change to the prompt, model or topic content is a guaranteed miss.
+"""
+
+import hashlib
+import json
+import threading
+
+import psycopg2
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # total stored analysis JSON before LRU eviction
+EVICT_EVERY = 50  # run the eviction query every N stores
+
+
+class AnalysisCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.table_ready = False
+        self.stores_since_eviction = 0
+        self.stats_lock = threading.Lock()  # lookups run from worker threads in the async runner
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evicted': 0
+        }
+
+    @staticmethod
+    def make_key(model: str, messages: list) -> str:
+        payload = json.dumps({'model': model, 'messages': messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def ensure_table(self, connection):
+        if self.table_ready:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS forum_analysis_cache (
+                    cache_key CHAR(64) PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    analysis JSONB NOT NULL,
+                    payload_bytes INTEGER NOT NULL,
+                    hit_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    last_hit_at TIMESTAMP DEFAULT NOW()
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_forum_analysis_cache_last_hit ON forum_analysis_cache(last_hit_at);
+            """)
+        connection.commit()
+        self.table_ready = True
+
+    def get(self, cache_key: str, connection):
+        """Return the cached analysis dict, or None on a miss"""
+        try:
+            self.ensure_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE forum_analysis_cache
+                    SET hit_count = hit_count + 1, last_hit_at = NOW()
+                    WHERE cache_key = %s
+                    RETURNING analysis
+                """, (cache_key,))
+                result = cursor.fetchone()
+            connection.commit()
+        except psycopg2.Error as e:
+            connection.rollback()
+            print(f"  ⚠️  Analysis cache lookup failed: {e}")
+            result = None
+
+        with self.stats_lock:
+            self.stats['hits' if result else 'misses'] += 1
+        return result[0] if result else None
+
+    def put(self, cache_key: str, model: str, analysis: dict, connection):
+        """Store a parsed analysis; periodically evict least recently used entries"""
+        payload = json.dumps(analysis)
+        try:
+            self.ensure_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO forum_analysis_cache (cache_key, model, analysis, payload_bytes)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (cache_key) DO NOTHING
+                """, (cache_key, model, payload, len(payload.encode('utf-8'))))
+            connection.commit()
+        except psycopg2.Error as e:
+            connection.rollback()
+            print(f"  ⚠️  Analysis cache store failed: {e}")
+            return
+
+        with self.stats_lock:
+            self.stats['stores'] += 1
+            self.stores_since_eviction += 1
+            should_evict = self.stores_since_eviction >= EVICT_EVERY
+            if should_evict:
+                self.stores_since_eviction = 0
+        if should_evict:
+            self.evict(connection)
+
+    def evict(self, connection):
+        """Drop least recently used entries beyond max_bytes"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM forum_analysis_cache
+                    WHERE cache_key IN (
+                        SELECT cache_key FROM (
+                            SELECT cache_key,
+                                   SUM(payload_bytes) OVER (ORDER BY last_hit_at DESC, cache_key) AS running_bytes
+                            FROM forum_analysis_cache
+                        ) ranked
+                        WHERE running_bytes > %s
+                    )
+                """, (self.max_bytes,))
+                evicted = cursor.rowcount
+            connection.commit()
+            with self.stats_lock:
+                self.stats['evicted'] += evicted
+        except psycopg2.Error as e:
+            connection.rollback()
+            print(f"  ⚠️  Analysis cache eviction failed: {e}")
+
+    def summary(self) -> str:
+        lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] / lookups * 100) if lookups else 0
+        return (f"Cache hits: {self.stats['hits']}, misses: {self.stats['misses']} "
+                f"({hit_rate:.1f}% hit rate), stored: {self.stats['stores']}, evicted: {self.stats['evicted']}")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Work queue for topic analysis.
+The scraper enqueues every topic it stores with posts; analysis runners claim
+pending rows through a partial index instead of scanning forum_topics_raw and
+measuring JSONB post arrays on every poll.
+
+States: pending -> claimed -> done, or back to pending on failure until
+MAX_ATTEMPTS is reached, then failed. save_analysis_to_database marks topics
+done in the same transaction as the analysis rows.
+"""
+
+# New topics go ahead of re-analysis of topics whose content changed
+PRIORITY_NEW = 1
+PRIORITY_CHANGED = 0
+
+MAX_ATTEMPTS = 3
+STALE_CLAIM_MINUTES = 60
+# Batch API jobs hold their claims for up to the 24h completion window
+BATCH_WORKER_PREFIX = 'batch-'
+BATCH_CLAIM_HOURS = 25
+
+# DDL takes ACCESS EXCLUSIVE (ALTER) or SHARE (CREATE INDEX) locks before any
+# IF NOT EXISTS check, and would queue behind long readers of the table while
+# blocking everyone after them. ensure_queue_schema looks each object up in
+# the catalog first and only runs the statements for what is missing.
+
+# Post count kept next to the row so filters never detoast raw_content
+STORED_POST_COUNT_SQL = """
+ALTER TABLE forum_topics_raw ADD COLUMN IF NOT EXISTS stored_post_count INTEGER
+    GENERATED ALWAYS AS (GREATEST(
+        jsonb_array_length(COALESCE(raw_content -> 'posts', '[]'::jsonb)),
+        jsonb_array_length(COALESCE(raw_content -> 'post_stream' -> 'posts', '[]'::jsonb))
+    )) STORED
+"""
+
+QUEUE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS forum_analysis_queue (
+    topic_id INTEGER PRIMARY KEY REFERENCES forum_topics_raw(topic_id) ON DELETE CASCADE,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending | claimed | done | failed
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    requeue BOOLEAN NOT NULL DEFAULT FALSE,  -- content changed while claimed
+    claimed_by TEXT,
+    claimed_at TIMESTAMP,
+    last_error TEXT,
+    enqueued_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+)
+"""
+
+# claim_topics orders by priority DESC, then topic_id in either direction.
+# latest_first (topic_id DESC) scans the pending index backward; oldest-first
+# (topic_id ASC) needs the mixed-direction pending_oldest index.
+QUEUE_INDEXES = {
+    'idx_forum_topics_raw_with_posts':
+        "CREATE INDEX IF NOT EXISTS idx_forum_topics_raw_with_posts "
+        "ON forum_topics_raw(topic_id) WHERE stored_post_count > 0",
+    'idx_forum_analysis_queue_pending':
+        "CREATE INDEX IF NOT EXISTS idx_forum_analysis_queue_pending "
+        "ON forum_analysis_queue(priority, topic_id) WHERE state = 'pending'",
+    'idx_forum_analysis_queue_pending_oldest':
+        "CREATE INDEX IF NOT EXISTS idx_forum_analysis_queue_pending_oldest "
+        "ON forum_analysis_queue(priority DESC, topic_id ASC) WHERE state = 'pending'",
+    'idx_forum_analysis_queue_claimed':
+        "CREATE INDEX IF NOT EXISTS idx_forum_analysis_queue_claimed "
+        "ON forum_analysis_queue(claimed_at) WHERE state = 'claimed'",
+}
+
+
+def ensure_queue_schema(connection):
+    """Create the generated column, queue and indexes if missing, seeding the queue on first creation"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT to_regclass('forum_analysis_queue') IS NULL,
+                   to_regclass('forum_topics') IS NOT NULL,
+                   EXISTS (SELECT 1 FROM pg_attribute
+                           WHERE attrelid = to_regclass('forum_topics_raw')
+                             AND attname = 'stored_post_count' AND NOT attisdropped),
+                   ARRAY(SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL)
+        """, (list(QUEUE_INDEXES),))
+        is_new, has_analysis_table, has_post_count, missing_indexes = cursor.fetchone()
+        if not has_post_count:
+            cursor.execute(STORED_POST_COUNT_SQL)
+        if is_new:
+            cursor.execute(QUEUE_TABLE_SQL)
+        for name in missing_indexes:
+            cursor.execute(QUEUE_INDEXES[name])
+        if is_new:
+            # The scraper may create the queue before the analyzer has ever created forum_topics
+            analyzed = ("EXISTS (SELECT 1 FROM forum_topics t WHERE t.topic_id = r.topic_id)"
+                        if has_analysis_table else "FALSE")
+            cursor.execute(f"""
+                INSERT INTO forum_analysis_queue (topic_id, state, priority)
+                SELECT r.topic_id, CASE WHEN {analyzed} THEN 'done' ELSE 'pending' END, %s
+                FROM forum_topics_raw r
+                WHERE r.stored_post_count > 0
+                ON CONFLICT (topic_id) DO NOTHING
+            """, (PRIORITY_NEW,))
+            print(f"✓ Seeded forum_analysis_queue with {cursor.rowcount} topics")
+    connection.commit()
+
+
+def enqueue_topics(cursor, topic_priorities):
+    """
+    Mark topics pending (caller commits). topic_priorities is [(topic_id, priority)].
+    A topic claimed right now stays claimed but is flagged to run again once done.
+    """
+    if not topic_priorities:
+        return
+    cursor.execute("""
+        INSERT INTO forum_analysis_queue AS q (topic_id, priority)
+        SELECT * FROM unnest(%s::int[], %s::int[])
+        ON CONFLICT (topic_id) DO UPDATE SET
+            state = CASE WHEN q.state = 'claimed' THEN 'claimed' ELSE 'pending' END,
+            requeue = (q.state = 'claimed'),
+            priority = GREATEST(q.priority, EXCLUDED.priority),
+            attempts = 0,
+            last_error = NULL,
+            enqueued_at = NOW(),
+            updated_at = NOW()
+    """, ([topic_id for topic_id, _ in topic_priorities], [priority for _, priority in topic_priorities]))
+
+
+def claim_topics(connection, worker, limit=1, latest_first=True):
+    """Claim up to `limit` pending topics for `worker`; returns their ids"""
+    direction = "DESC" if latest_first else "ASC"
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE forum_analysis_queue q
+            SET state = 'claimed', claimed_by = %s, claimed_at = NOW(), updated_at = NOW()
+            FROM (
+                SELECT topic_id FROM forum_analysis_queue
+                WHERE state = 'pending'
+                ORDER BY priority DESC, topic_id {direction}
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) next_topics
+            WHERE q.topic_id = next_topics.topic_id
+            RETURNING q.topic_id
+        """, (worker, limit))
+        topic_ids = [row[0] for row in cursor.fetchall()]
+    connection.commit()
+    return sorted(topic_ids, reverse=latest_first)
+
+
+def mark_done(cursor, topic_ids):
+    """Finish topics inside the transaction that saved their analysis"""
+    cursor.execute("""
+        UPDATE forum_analysis_queue
+        SET state = CASE WHEN requeue THEN 'pending' ELSE 'done' END,
+            requeue = FALSE, claimed_by = NULL, last_error = NULL, updated_at = NOW()
+        WHERE topic_id = ANY(%s)
+    """, (list(topic_ids),))
+
+
+def mark_failed(connection, topic_id, error):
+    """Return a topic to pending, or park it as failed after MAX_ATTEMPTS"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE forum_analysis_queue
+                SET attempts = attempts + 1,
+                    state = CASE WHEN requeue OR attempts + 1 < %s THEN 'pending' ELSE 'failed' END,
+                    requeue = FALSE, claimed_by = NULL, last_error = %s, updated_at = NOW()
+                WHERE topic_id = %s
+            """, (MAX_ATTEMPTS, str(error)[:1000], topic_id))
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        print(f"⚠️ Could not record failure for topic {topic_id}: {e}")
+
+
+def reassign_claims(connection, topic_ids, worker):
+    """Hand claimed topics to another worker id, restarting their claim clock"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE forum_analysis_queue
+            SET claimed_by = %s, claimed_at = NOW(), updated_at = NOW()
+            WHERE topic_id = ANY(%s) AND state = 'claimed'
+        """, (worker, list(topic_ids)))
+    connection.commit()
+
+
+def release_claims(connection, worker):
+    """Return every topic still claimed by `worker` to pending, without counting an attempt"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE forum_analysis_queue
+            SET state = 'pending', requeue = FALSE, claimed_by = NULL, updated_at = NOW()
+            WHERE state = 'claimed' AND claimed_by = %s
+        """, (worker,))
+        released = cursor.rowcount
+    connection.commit()
+    return released
+
+
+def requeue_topics(cursor, topic_ids):
+    """Send topics back to pending (e.g. after deleting an incomplete analysis)"""
+    cursor.execute("""
+        UPDATE forum_analysis_queue
+        SET state = 'pending', attempts = 0, claimed_by = NULL, updated_at = NOW()
+        WHERE topic_id = ANY(%s)
+    """, (list(topic_ids),))
+
+
+def release_stale_claims(connection, minutes=STALE_CLAIM_MINUTES):
+    """
+    Recover topics claimed by workers that died; counts as a failed attempt.
+    Claims held by Batch API jobs only expire after BATCH_CLAIM_HOURS.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE forum_analysis_queue
+            SET attempts = attempts + 1,
+                state = CASE WHEN attempts + 1 < %s THEN 'pending' ELSE 'failed' END,
+                last_error = 'claim expired (' || COALESCE(claimed_by, '?') || ')',
+                claimed_by = NULL, updated_at = NOW()
+            WHERE state = 'claimed' AND claimed_at < NOW() - CASE
+                WHEN claimed_by LIKE %s THEN make_interval(hours => %s)
+                ELSE make_interval(mins => %s)
+            END
+        """, (MAX_ATTEMPTS, BATCH_WORKER_PREFIX + '%', BATCH_CLAIM_HOURS, minutes))
+        released = cursor.rowcount
+    connection.commit()
+    if released:
+        print(f"🧹 Released {released} stale queue claims")
+    return released
+
+
+def queue_counts(connection):
+    """Topic counts per queue state"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT state, COUNT(*) FROM forum_analysis_queue GROUP BY state")
+        return dict(cursor.fetchall())
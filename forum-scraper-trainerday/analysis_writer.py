@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Bulk persistence of topic analyses.
+One analysis used to cost a DELETE per child table, an INSERT per Q&A pair and
+three more INSERTs for patterns and insights, each a round trip under row locks.
+Here every table gets one statement per batch of topics: the old rows are
+deleted with topic_id = ANY(...), and the new rows go in with execute_values.
+
+Topic ids always come from the caller (the id that was claimed and analyzed),
+never from the model's JSON, so a hallucinated id can't overwrite or finish
+another topic.
+
+AnalysisWriter buffers analyses from many topics and flushes them in a single
+transaction. If a batch fails, it is retried topic by topic so one bad analysis
+doesn't take the rest of the batch down with it.
+"""
+
+import json
+from typing import Dict, List, Tuple
+
+from psycopg2.extras import execute_values
+
+from analysis_queue import mark_done
+
+DEFAULT_FLUSH_SIZE = 25
+
+TOPIC_COLUMNS = ('topic_id', 'title', 'category', 'analysis_category', 'date_created',
+                 'total_posts', 'is_announcement', 'views', 'like_count')
+QA_COLUMNS = ('topic_id', 'sequence', 'date_posted',
+              'question_username', 'question_content', 'question_context', 'pain_point', 'user_language',
+              'response_username', 'response_content', 'response_type', 'solution_offered', 'platform_language')
+# User and platform patterns share one statement; each row leaves the other kind's columns NULL
+VOICE_COLUMNS = ('topic_id', 'pattern_type',
+                 'main_pain_points', 'common_language', 'expectations_vs_reality',
+                 'user_workarounds', 'praise_points', 'confusion_areas',
+                 'explanation_style', 'common_solutions', 'feature_positioning',
+                 'development_transparency', 'methodology_mentions')
+INSIGHT_COLUMNS = ('topic_id', 'content_opportunities', 'messaging_gaps', 'success_indicators',
+                   'recurring_issues', 'feature_demand', 'recency_score', 'frequency_score', 'impact_score')
+
+# Children first, forum_topics last
+ANALYSIS_TABLES = ('forum_insights', 'forum_voice_patterns', 'forum_qa_pairs', 'forum_topics')
+
+
+def analysis_rows(topic_id: int, analysis: dict) -> Dict[str, List[tuple]]:
+    """Row tuples per table for one topic's analysis, in the column orders above"""
+    topic_summary = analysis['topic_summary']
+
+    topic_row = (
+        topic_id,
+        topic_summary['title'],
+        topic_summary.get('category', ''),
+        topic_summary.get('analysis_category', ''),
+        topic_summary.get('date_created'),
+        topic_summary.get('total_posts', 0),
+        topic_summary.get('is_announcement', False),
+        topic_summary.get('views', 0),
+        topic_summary.get('like_count', 0)
+    )
+
+    qa_rows = []
+    for qa_pair in analysis.get('qa_pairs', []):
+        question = qa_pair.get('question', {})
+        response = qa_pair.get('response', {})
+        qa_rows.append((
+            topic_id,
+            qa_pair.get('sequence'),
+            qa_pair.get('date'),
+            question.get('username'),
+            question.get('content'),
+            question.get('context'),
+            question.get('pain_point'),
+            question.get('user_language'),
+            response.get('username'),
+            response.get('content'),
+            response.get('response_type'),
+            response.get('solution_offered'),
+            response.get('platform_language')
+        ))
+
+    user_patterns = analysis.get('user_voice_patterns', {})
+    platform_patterns = analysis.get('platform_voice_patterns', {})
+    voice_rows = [
+        (
+            topic_id,
+            'user_voice',
+            json.dumps(user_patterns.get('main_pain_points', [])),
+            json.dumps(user_patterns.get('common_language', [])),
+            json.dumps(user_patterns.get('expectations_vs_reality', [])),
+            json.dumps(user_patterns.get('user_workarounds', [])),
+            json.dumps(user_patterns.get('praise_points', [])),
+            json.dumps(user_patterns.get('confusion_areas', [])),
+            None, None, None, None, None
+        ),
+        (
+            topic_id,
+            'platform_voice',
+            None, None, None, None, None, None,
+            platform_patterns.get('explanation_style'),
+            json.dumps(platform_patterns.get('common_solutions', [])),
+            json.dumps(platform_patterns.get('feature_positioning', [])),
+            json.dumps(platform_patterns.get('development_transparency', [])),
+            json.dumps(platform_patterns.get('methodology_mentions', []))
+        )
+    ]
+
+    insights = analysis.get('key_insights', {})
+    priority = analysis.get('priority_score', {})
+    insight_row = (
+        topic_id,
+        json.dumps(insights.get('content_opportunities', [])),
+        json.dumps(insights.get('messaging_gaps', [])),
+        json.dumps(insights.get('success_indicators', [])),
+        json.dumps(insights.get('recurring_issues', [])),
+        json.dumps(insights.get('feature_demand', [])),
+        priority.get('recency'),
+        priority.get('frequency'),
+        priority.get('impact')
+    )
+
+    return {
+        'forum_topics': [topic_row],
+        'forum_qa_pairs': qa_rows,
+        'forum_voice_patterns': voice_rows,
+        'forum_insights': [insight_row]
+    }
+
+
+def _insert(cursor, table: str, columns: tuple, rows: List[tuple], suffix: str = ''):
+    if rows:
+        execute_values(cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {suffix}",
+                       rows, page_size=1000)
+
+
+def write_analyses(cursor, analyses: List[Tuple[int, dict]]) -> List[int]:
+    """
+    Replace the stored analysis of every topic in `analyses`, a list of
+    (topic_id, analysis) pairs (caller commits).
+    Returns the topic ids written; a topic listed twice keeps its last analysis.
+    """
+    by_topic = dict(analyses)
+    topic_ids = list(by_topic)
+    if not topic_ids:
+        return []
+
+    rows = {table: [] for table in ANALYSIS_TABLES}
+    for topic_id, analysis in by_topic.items():
+        for table, table_rows in analysis_rows(topic_id, analysis).items():
+            rows[table].extend(table_rows)
+
+    for table in ANALYSIS_TABLES[:-1]:
+        cursor.execute(f"DELETE FROM {table} WHERE topic_id = ANY(%s)", (topic_ids,))
+
+    # forum_topics is upserted rather than deleted, so its serial id stays stable
+    _insert(cursor, 'forum_topics', TOPIC_COLUMNS, rows['forum_topics'], """
+        ON CONFLICT (topic_id) DO UPDATE SET
+            title = EXCLUDED.title,
+            category = EXCLUDED.category,
+            analysis_category = EXCLUDED.analysis_category,
+            date_created = EXCLUDED.date_created,
+            total_posts = EXCLUDED.total_posts,
+            is_announcement = EXCLUDED.is_announcement,
+            views = EXCLUDED.views,
+            like_count = EXCLUDED.like_count,
+            analyzed_at = NOW()
+    """)
+    _insert(cursor, 'forum_qa_pairs', QA_COLUMNS, rows['forum_qa_pairs'])
+    _insert(cursor, 'forum_voice_patterns', VOICE_COLUMNS, rows['forum_voice_patterns'])
+    _insert(cursor, 'forum_insights', INSIGHT_COLUMNS, rows['forum_insights'])
+
+    # Queue rows leave 'claimed' in the same transaction as the analysis rows
+    mark_done(cursor, topic_ids)
+    return topic_ids
+
+
+class AnalysisWriter:
+    def __init__(self, flush_size: int = DEFAULT_FLUSH_SIZE):
+        self.flush_size = flush_size
+        self.pending = []
+
+    def add(self, topic_id: int, analysis: dict) -> bool:
+        """Buffer a topic's analysis; returns True once the buffer should be flushed"""
+        self.pending.append((topic_id, analysis))
+        return len(self.pending) >= self.flush_size
+
+    def drain(self) -> List[Tuple[int, dict]]:
+        """Take the buffered (topic_id, analysis) pairs, leaving the buffer empty"""
+        analyses, self.pending = self.pending, []
+        return analyses
+
+    def flush(self, connection) -> Tuple[List[int], List[Tuple[int, str]]]:
+        return self.save(connection, self.drain())
+
+    def save(self, connection, analyses: List[Tuple[int, dict]]) -> Tuple[List[int], List[Tuple[int, str]]]:
+        """
+        Write (topic_id, analysis) pairs in one transaction.
+        Returns (saved topic ids, [(topic_id, error)]) after falling back to
+        one transaction per topic if the batch as a whole fails.
+        """
+        if not analyses:
+            return [], []
+
+        try:
+            with connection.cursor() as cursor:
+                saved = write_analyses(cursor, analyses)
+            connection.commit()
+            return saved, []
+        except Exception as e:
+            connection.rollback()
+            if len(analyses) == 1:
+                return [], [(analyses[0][0], str(e))]
+
+        saved, failed = [], []
+        for topic_id, analysis in analyses:
+            try:
+                with connection.cursor() as cursor:
+                    saved.extend(write_analyses(cursor, [(topic_id, analysis)]))
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                failed.append((topic_id, str(e)))
+        return saved, failed
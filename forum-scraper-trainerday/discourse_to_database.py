@@ -13,11 +13,16 @@ import argparse
 from datetime import datetime, timedelta
 from pathlib import Path
 import sys
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import hashlib
 from dotenv import load_dotenv
 
+# Repo root, for the shared database module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import td_db
+
+from analysis_queue import PRIORITY_CHANGED, PRIORITY_NEW, enqueue_topics, ensure_queue_schema
+
 # Load environment variables
 load_dotenv()
 
@@ -71,7 +76,7 @@ class DiscourseToDatabase:
             print("Connecting to PostgreSQL database...")
             print(f"Host: {self.db_config['host']}")
             print(f"Database: {self.db_config['database']}")
-            self.db_connection = psycopg2.connect(**self.db_config)
+            self.db_connection = td_db.get_connection(self.db_config)
             print("✓ Connected to PostgreSQL database")
         except Exception as e:
             raise Exception(f"Failed to connect to database: {e}")
@@ -101,7 +106,8 @@ class DiscourseToDatabase:
             with self.db_connection.cursor() as cursor:
                 cursor.execute(schema_sql)
                 self.db_connection.commit()
-                print("✓ Raw topics table ready")
+            ensure_queue_schema(self.db_connection)
+            print("✓ Raw topics table ready")
         except Exception as e:
             self.db_connection.rollback()
             raise Exception(f"Failed to create raw topics table: {e}")
@@ -195,6 +201,9 @@ class DiscourseToDatabase:
                     created_at
                 ))
                 
+                if raw_content.get('posts'):
+                    enqueue_topics(cursor, [(topic_id, PRIORITY_CHANGED if result else PRIORITY_NEW)])
+                
                 self.db_connection.commit()
                 
                 if result:
@@ -464,24 +473,10 @@ def main():
     args = parser.parse_args()
     
     # Database configuration from environment
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    # Add SSL certificate if specified
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent])
     
     # Validate database configuration
-    if not all([db_config['host'], db_config['database'], db_config['user'], db_config['password']]):
+    if not td_db.config_is_complete(db_config):
         print("❌ Database configuration incomplete. Please set environment variables:")
         print("   Required: DB_HOST, DB_DATABASE, DB_USERNAME, DB_PASSWORD")
         sys.exit(1)
@@ -4,6 +4,10 @@ Optimized Discourse Forum Scraper v3
 - Only fetches full posts when topic metadata indicates changes
 - Uses last_post_id and posts_count for efficient change detection
 - Dramatically reduces API calls and processing time
+- Optional concurrent topic fetching behind a shared token-bucket rate limiter
+- Incremental runs stop paging /latest once they pass the persisted bumped_at cursor
+- Known topics only download posts missing from storage (post_stream.stream diff)
+- Maintains a normalized forum_posts table; unchanged posts (same content hash) are never rewritten
 """
 
 import os
@@ -11,18 +15,73 @@ import json
 import requests
 import time
 import argparse
-from datetime import datetime, timedelta
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 import sys
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
 
+# Repo root, for the shared database module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import td_db
+
+from forum_html import clean_html_content, post_content_hash
+from analysis_queue import PRIORITY_CHANGED, PRIORITY_NEW, enqueue_topics, ensure_queue_schema
+
 # Load environment variables
 load_dotenv()
 
+class TokenBucketRateLimiter:
+    """
+    Thread-safe token bucket shared by all API workers.
+    Tokens refill at `rate` per second up to `capacity`; a 429 pauses the whole
+    bucket for the server-provided Retry-After instead of sleeping per thread.
+    """
+
+    def __init__(self, rate=1.0, capacity=None):
+        if rate <= 0:
+            raise ValueError("Rate limit must be greater than zero requests per second.")
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait_time = self.blocked_until - now
+                else:
+                    elapsed = max(0.0, now - self.updated_at)
+                    self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (used when the server says Retry-After)"""
+        with self.lock:
+            resume_at = time.monotonic() + max(0.0, seconds)
+            if resume_at > self.blocked_until:
+                self.blocked_until = resume_at
+                self.tokens = 0.0
+                self.updated_at = resume_at
+
+
 class OptimizedDiscourseToDatabase:
-    def __init__(self, base_url, api_key=None, api_username=None, db_config=None):
+    def __init__(self, base_url, api_key=None, api_username=None, db_config=None,
+                 max_workers=1, requests_per_second=1.0, burst=None, post_level_sync=True):
         self.base_url = base_url.rstrip('/')
         self.api_key = api_key or os.getenv("DISCOURSE_API_KEY")
         self.api_username = api_username or os.getenv("DISCOURSE_API_USERNAME") or "system"
@@ -33,6 +92,7 @@ class OptimizedDiscourseToDatabase:
         # Database configuration
         self.db_config = db_config
         self.db_connection = None
+        self.topic_buffer = {}  # topic_id -> prepared row, flushed once per page
         
         # API headers
         self.auth_headers = {
@@ -48,8 +108,24 @@ class OptimizedDiscourseToDatabase:
         }
         
         # Rate limiting and stats
-        self.last_request_time = 0
-        self.min_request_interval = 1.0  # 1 second between requests
+        # A single token bucket governs every request, so throughput scales with
+        # the configured budget regardless of how many fetch workers are running
+        self.max_workers = max(1, max_workers)
+        self.rate_limiter = TokenBucketRateLimiter(requests_per_second, burst)
+        self.max_retries = 5
+        self.default_retry_after = 60
+        
+        # Delta sync: /latest is ordered by bumped_at, so incremental runs can stop
+        # paging once topics are older than the last run's high-water mark.
+        # The overlap re-checks boundary topics via topic_needs_update.
+        self.sync_cursor_key = 'latest_bumped_at'
+        self.cursor_overlap = timedelta(minutes=5)
+        
+        # Post-level sync: diff post_stream.stream against stored post ids and
+        # fetch only the missing posts via /t/{id}/posts.json?post_ids[]=
+        self.post_level_sync = post_level_sync
+        self.post_batch_size = 20  # Discourse's default chunk size for posts.json
+        self.stats_lock = threading.Lock()
         self.stats = {
             'topics_processed': 0,
             'topics_stored': 0,
@@ -58,13 +134,16 @@ class OptimizedDiscourseToDatabase:
             'posts_total': 0,
             'errors': 0,
             'failed_topics': [],
-            'api_calls_saved': 0  # NEW: tracks efficiency gains
+            'api_calls_saved': 0,  # NEW: tracks efficiency gains
+            'posts_fetched': 0,  # posts downloaded via posts.json batches
+            'posts_reused': 0,  # posts merged from stored raw_content instead of refetched
+            'posts_written': 0  # forum_posts rows inserted or changed (unchanged hashes skipped)
         }
 
     def connect_db(self):
         """Connect to PostgreSQL database"""
         try:
-            self.db_connection = psycopg2.connect(**self.db_config)
+            self.db_connection = td_db.get_connection(self.db_config)
             print("✓ Connected to database")
             self.setup_optimized_tables()
         except Exception as e:
@@ -89,13 +168,42 @@ class OptimizedDiscourseToDatabase:
         
         CREATE INDEX IF NOT EXISTS idx_forum_topics_raw_updated ON forum_topics_raw(last_updated);
         CREATE INDEX IF NOT EXISTS idx_forum_topics_raw_last_post ON forum_topics_raw(last_post_id);
+        
+        -- Checksum of the raw_content whose posts are mirrored in forum_posts
+        ALTER TABLE forum_topics_raw ADD COLUMN IF NOT EXISTS checksum VARCHAR(32);
+        ALTER TABLE forum_topics_raw ADD COLUMN IF NOT EXISTS posts_checksum VARCHAR(32);
+        
+        -- One row per post so changes touch only the posts that changed
+        CREATE TABLE IF NOT EXISTS forum_posts (
+            post_id INTEGER PRIMARY KEY,
+            topic_id INTEGER NOT NULL REFERENCES forum_topics_raw(topic_id) ON DELETE CASCADE,
+            post_number INTEGER,
+            reply_to_post_number INTEGER,
+            username TEXT,
+            created_at TIMESTAMP,
+            cooked TEXT,
+            cleaned_text TEXT,
+            content_hash VARCHAR(32) NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_forum_posts_topic ON forum_posts(topic_id, post_number);
+        CREATE INDEX IF NOT EXISTS idx_forum_posts_updated ON forum_posts(updated_at);
+        
+        -- Persisted high-water marks for delta sync
+        CREATE TABLE IF NOT EXISTS forum_scrape_state (
+            state_key TEXT PRIMARY KEY,
+            cursor_value TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
         """
         
         try:
             with self.db_connection.cursor() as cursor:
                 cursor.execute(schema_sql)
                 self.db_connection.commit()
-                print("✓ Optimized raw topics table ready")
+            ensure_queue_schema(self.db_connection)
+            print("✓ Optimized raw topics table ready")
         except Exception as e:
             self.db_connection.rollback()
             raise Exception(f"Failed to create optimized raw topics table: {e}")
@@ -127,6 +235,54 @@ class OptimizedDiscourseToDatabase:
             print(f"Warning: Could not retrieve existing metadata: {e}")
             return {}
 
+    def get_sync_cursor(self):
+        """Load the bumped_at high-water mark saved by the last clean run (naive UTC)"""
+        if not self.db_connection:
+            return None
+        
+        try:
+            with self.db_connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT cursor_value FROM forum_scrape_state WHERE state_key = %s",
+                    (self.sync_cursor_key,)
+                )
+                result = cursor.fetchone()
+                return result[0] if result else None
+        except Exception as e:
+            self.db_connection.rollback()
+            print(f"Warning: Could not read sync cursor: {e}")
+            return None
+
+    def save_sync_cursor(self, cursor_value):
+        """Persist the bumped_at high-water mark for the next incremental run"""
+        try:
+            with self.db_connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO forum_scrape_state (state_key, cursor_value, updated_at)
+                    VALUES (%s, %s, NOW())
+                    ON CONFLICT (state_key) DO UPDATE SET
+                        cursor_value = GREATEST(forum_scrape_state.cursor_value, EXCLUDED.cursor_value),
+                        updated_at = NOW()
+                """, (self.sync_cursor_key, cursor_value))
+                self.db_connection.commit()
+                print(f"📍 Sync cursor saved: {cursor_value.isoformat()}")
+        except Exception as e:
+            self.db_connection.rollback()
+            print(f"Warning: Could not save sync cursor: {e}")
+
+    def get_topic_bumped_at(self, topic_from_list):
+        """bumped_at (falling back to last_posted_at) from a topic list entry, as naive UTC"""
+        value = topic_from_list.get('bumped_at') or topic_from_list.get('last_posted_at')
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+
     def topic_needs_update(self, topic_from_list, existing_metadata):
         """
         Efficiently check if topic needs updating using lightweight metadata comparison
@@ -166,50 +322,77 @@ class OptimizedDiscourseToDatabase:
         # Topic appears unchanged - can skip expensive API call!
         return False
 
-    def make_request(self, endpoint, params=None, use_auth=False):
-        """Make a rate-limited request to the Discourse API"""
-        # Rate limiting
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
+    def get_retry_after(self, response):
+        """Seconds to back off after a 429, from Retry-After or Discourse's wait_seconds"""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return max(0.0, retry_at.timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
         
-        if time_since_last_request < self.min_request_interval:
-            sleep_time = self.min_request_interval - time_since_last_request
-            time.sleep(sleep_time)
+        try:
+            wait_seconds = response.json().get('extras', {}).get('wait_seconds')
+            if wait_seconds is not None:
+                return max(0.0, float(wait_seconds))
+        except (ValueError, AttributeError):
+            pass
         
+        return self.default_retry_after
+
+    def make_request(self, endpoint, params=None, use_auth=False):
+        """Make a rate-limited request to the Discourse API"""
         url = f"{self.base_url}{endpoint}"
         if not url.endswith('.json'):
             url += '.json'
         
         headers = self.auth_headers if use_auth else self.public_headers
         
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            self.last_request_time = time.time()
+        for attempt in range(self.max_retries + 1):
+            # Rate limiting - shared across all worker threads
+            self.rate_limiter.acquire()
             
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 429:
-                print(f"  ⚠️  Rate limited, waiting 60 seconds...")
-                time.sleep(60)
-                return self.make_request(endpoint, params, use_auth)
-            else:
-                print(f"  ❌ API error {response.status_code}: {response.text[:200]}")
-                return None
+            try:
+                response = requests.get(url, headers=headers, params=params, timeout=30)
                 
-        except Exception as e:
-            print(f"  ❌ Request failed: {e}")
-            return None
+                if response.status_code == 200:
+                    return response.json()
+                elif response.status_code != 429:
+                    print(f"  ❌ API error {response.status_code}: {response.text[:200]}")
+                    return None
+            except Exception as e:
+                print(f"  ❌ Request failed: {e}")
+                return None
+            
+            if attempt == self.max_retries:
+                break
+            
+            retry_after = self.get_retry_after(response)
+            print(f"  ⚠️  Rate limited on {endpoint}, retrying in {retry_after:.0f} seconds "
+                  f"(retry {attempt + 1}/{self.max_retries})...")
+            self.rate_limiter.pause(retry_after)
+        
+        print(f"  ❌ Giving up on {endpoint} after {self.max_retries} rate-limited retries")
+        return None
 
     def get_latest_topics(self, page=0):
         """Get latest topics list (lightweight metadata only)"""
         response_data = self.make_request(f"/latest.json", {'page': page}, use_auth=True)
         
         if not response_data:
+            # Counted as an error so a failed page never advances the sync cursor
+            self.stats['errors'] += 1
             return [], False
         
         topic_list = response_data.get('topic_list', {})
         topics = topic_list.get('topics', [])
-        has_more = len(topics) > 0 and page < 50  # Reasonable limit
+        # No page cap here: --max-pages bounds a run, and the walk only ends on an
+        # empty page, so the sync cursor never skips topics past an arbitrary limit
+        has_more = len(topics) > 0
         
         return topics, has_more
 
@@ -218,122 +401,362 @@ class OptimizedDiscourseToDatabase:
         response_data = self.make_request(f"/t/{topic_id}.json", use_auth=True)
         return response_data
 
-    def store_topic_to_database(self, raw_content: dict) -> bool:
-        """Store optimized raw topic content in database"""
-        if not self.db_connection:
-            raise ValueError("Database connection required.")
+    def get_stored_posts(self, topic_ids):
+        """Load already-stored posts for the given topics, keyed by topic_id then post id"""
+        if not self.db_connection or not topic_ids:
+            return {}
         
         try:
-            # Handle both API response formats - try nested first, then root level
-            topic_data = raw_content.get('topic', raw_content)  # Fallback to root if no 'topic' key
-            topic_id = topic_data.get('id')
-            if not topic_id:
-                print(f"  ❌ FAILURE: Topic ID not found in content")
-                return False
-            
-            # Extract metadata for future optimization
-            title = topic_data.get('title', '')
-            posts_count = topic_data.get('posts_count', 0)
-            created_at_str = topic_data.get('created_at', '')
-            last_posted_at_str = topic_data.get('last_posted_at', '')
-            highest_post_number = topic_data.get('highest_post_number', 0)
-            scraped_at = datetime.now()
-            
-            # Find highest post ID for future comparison - handle both formats
-            posts = raw_content.get('posts', [])
-            if not posts and 'post_stream' in raw_content:
-                posts = raw_content.get('post_stream', {}).get('posts', [])
-            last_post_id = max([post.get('id', 0) for post in posts]) if posts else 0
-            
-            # Generate a simple checksum for database compatibility (still required by existing schema)
-            checksum = f"{topic_id}_{posts_count}_{last_post_id}_{last_posted_at_str}"
-            import hashlib
-            checksum = hashlib.md5(checksum.encode()).hexdigest()
-            
-            # Parse timestamps
-            created_at = None
-            last_posted_at = None
-            try:
-                if created_at_str:
-                    created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
-                if last_posted_at_str:
-                    last_posted_at = datetime.fromisoformat(last_posted_at_str.replace('Z', '+00:00'))
-            except ValueError:
-                pass
-            
             with self.db_connection.cursor() as cursor:
-                # Check if exists
-                cursor.execute("SELECT topic_id FROM forum_topics_raw WHERE topic_id = %s", (topic_id,))
-                exists = cursor.fetchone() is not None
-                
-                # Store or update with optimized metadata
                 cursor.execute("""
-                    INSERT INTO forum_topics_raw (
-                        topic_id, raw_content, checksum, scraped_at, 
-                        title, posts_count, created_at_original,
-                        last_post_id, last_posted_at, highest_post_number
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (topic_id) DO UPDATE SET
-                        raw_content = EXCLUDED.raw_content,
-                        checksum = EXCLUDED.checksum,
-                        last_updated = NOW(),
-                        title = EXCLUDED.title,
-                        posts_count = EXCLUDED.posts_count,
-                        scraped_at = EXCLUDED.scraped_at,
-                        created_at_original = EXCLUDED.created_at_original,
-                        last_post_id = EXCLUDED.last_post_id,
-                        last_posted_at = EXCLUDED.last_posted_at,
-                        highest_post_number = EXCLUDED.highest_post_number
-                """, (
-                    topic_id, json.dumps(raw_content), checksum, scraped_at,
-                    title, posts_count, created_at,
-                    last_post_id, last_posted_at, highest_post_number
-                ))
-                
-                self.db_connection.commit()
-                
-                if exists:
-                    print(f"  ✅ Updated topic {topic_id}: {title[:50]}...")
-                    self.stats['topics_updated'] += 1
-                else:
-                    print(f"  ✅ Stored new topic {topic_id}: {title[:50]}...")
-                    self.stats['topics_stored'] += 1
-                
-                self.stats['posts_total'] += len(posts)
-                return True
+                    SELECT topic_id,
+                           COALESCE(raw_content -> 'post_stream' -> 'posts', raw_content -> 'posts', '[]'::jsonb)
+                    FROM forum_topics_raw
+                    WHERE topic_id = ANY(%s)
+                """, (list(topic_ids),))
                 
+                stored_posts = {}
+                for topic_id, posts in cursor.fetchall():
+                    stored_posts[topic_id] = {post['id']: post for post in posts if post.get('id')}
+                return stored_posts
         except Exception as e:
             self.db_connection.rollback()
-            print(f"  ❌ FAILURE: Database error for topic {topic_id}: {e}")
+            print(f"Warning: Could not load stored posts, falling back to full fetch: {e}")
+            return {}
+
+    def get_posts_by_ids(self, topic_id, post_ids):
+        """Fetch specific posts of a topic in batches. Returns None if any batch fails."""
+        posts = []
+        for i in range(0, len(post_ids), self.post_batch_size):
+            batch = post_ids[i:i + self.post_batch_size]
+            response_data = self.make_request(
+                f"/t/{topic_id}/posts.json", {'post_ids[]': batch}, use_auth=True
+            )
+            if not response_data:
+                return None
+            posts.extend(response_data.get('post_stream', {}).get('posts', []))
+        return posts
+
+    def get_topic_incremental(self, topic_id, stored_posts=None):
+        """
+        Fetch a topic, then fill in every post listed in post_stream.stream.
+        Posts already in storage are reused; only the missing ids are downloaded.
+        Topics over 20 posts come back complete, which a bare /t/{id}.json does not.
+        """
+        topic_data = self.get_topic_with_posts(topic_id)
+        if not topic_data or 'post_stream' not in topic_data:
+            return topic_data
+        
+        post_stream = topic_data['post_stream']
+        stream = post_stream.get('stream') or []
+        
+        # Posts in this response are freshest, then stored ones, then fetch the rest
+        posts_by_id = dict(stored_posts or {})
+        posts_by_id.update({post['id']: post for post in post_stream.get('posts', []) if post.get('id')})
+        reused = sum(1 for post_id in stream if post_id in (stored_posts or {}))
+        
+        missing_ids = [post_id for post_id in stream if post_id not in posts_by_id]
+        if missing_ids:
+            fetched = self.get_posts_by_ids(topic_id, missing_ids)
+            if fetched is None:
+                print(f"  ❌ Could not fetch {len(missing_ids)} missing posts for topic {topic_id}")
+                return None
+            posts_by_id.update({post['id']: post for post in fetched if post.get('id')})
+        
+        # Keep stream order and drop posts that no longer exist (deleted/moved)
+        post_stream['posts'] = [posts_by_id[post_id] for post_id in stream if post_id in posts_by_id]
+        
+        with self.stats_lock:
+            self.stats['posts_fetched'] += len(missing_ids)
+            self.stats['posts_reused'] += reused
+        
+        return topic_data
+
+    def fetch_topics_concurrently(self, topic_ids, stored_posts=None):
+        """
+        Fetch several topics in parallel through the shared rate limiter.
+        Yields (topic_id, topic_data) as each fetch completes; topic_data is None on failure.
+        Database writes stay on the calling thread.
+        """
+        stored_posts = stored_posts or {}
+        
+        def fetch(topic_id):
+            if self.post_level_sync:
+                return self.get_topic_incremental(topic_id, stored_posts.get(topic_id))
+            return self.get_topic_with_posts(topic_id)
+        
+        if self.max_workers == 1 or len(topic_ids) <= 1:
+            for topic_id in topic_ids:
+                yield topic_id, fetch(topic_id)
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_topic = {
+                executor.submit(fetch, topic_id): topic_id
+                for topic_id in topic_ids
+            }
+            for future in as_completed(future_to_topic):
+                topic_id = future_to_topic[future]
+                try:
+                    yield topic_id, future.result()
+                except Exception as e:
+                    print(f"  ❌ Fetch worker error for topic {topic_id}: {e}")
+                    yield topic_id, None
+
+    def build_topic_row(self, raw_content: dict):
+        """Extract the forum_topics_raw column values for one topic, or None if it has no ID"""
+        # Handle both API response formats - try nested first, then root level
+        topic_data = raw_content.get('topic', raw_content)  # Fallback to root if no 'topic' key
+        topic_id = topic_data.get('id')
+        if not topic_id:
+            return None
+        
+        # Extract metadata for future optimization
+        title = topic_data.get('title', '')
+        posts_count = topic_data.get('posts_count', 0)
+        created_at_str = topic_data.get('created_at', '')
+        last_posted_at_str = topic_data.get('last_posted_at', '')
+        highest_post_number = topic_data.get('highest_post_number', 0)
+        scraped_at = datetime.now()
+        
+        # Find highest post ID for future comparison - handle both formats
+        posts = raw_content.get('posts', [])
+        if not posts and 'post_stream' in raw_content:
+            posts = raw_content.get('post_stream', {}).get('posts', [])
+        last_post_id = max([post.get('id', 0) for post in posts]) if posts else 0
+        
+        # Generate a simple checksum for database compatibility (still required by existing schema)
+        checksum = f"{topic_id}_{posts_count}_{last_post_id}_{last_posted_at_str}"
+        checksum = hashlib.md5(checksum.encode()).hexdigest()
+        
+        # Parse timestamps
+        created_at = None
+        last_posted_at = None
+        try:
+            if created_at_str:
+                created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
+            if last_posted_at_str:
+                last_posted_at = datetime.fromisoformat(last_posted_at_str.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+        
+        return {
+            'topic_id': topic_id,
+            'title': title,
+            'posts_count': len(posts),
+            'values': (
+                topic_id, json.dumps(raw_content), checksum, checksum, scraped_at,
+                title, posts_count, created_at,
+                last_post_id, last_posted_at, highest_post_number
+            ),
+            'post_rows': [self.build_post_row(topic_id, post) for post in posts if post.get('id')]
+        }
+
+    def build_post_row(self, topic_id, post):
+        """Column values for one forum_posts row"""
+        cooked = post.get('cooked', '')
+        return (
+            post['id'], topic_id, post.get('post_number'), post.get('reply_to_post_number'),
+            post.get('username'), post.get('created_at'),
+            cooked, clean_html_content(cooked), post_content_hash(cooked)
+        )
+
+    def queue_topic_for_storage(self, raw_content: dict) -> bool:
+        """Buffer a fetched topic; it is written on the next flush_topic_buffer() call"""
+        row = self.build_topic_row(raw_content)
+        if not row:
+            print(f"  ❌ FAILURE: Topic ID not found in content")
             self.stats['errors'] += 1
             return False
+        
+        # Keyed by topic_id: a single ON CONFLICT statement cannot touch the same row twice
+        self.topic_buffer[row['topic_id']] = row
+        return True
 
-    def scrape_topics_optimized(self, max_pages=None, incremental=True, skip_existing=False):
+    def flush_topic_buffer(self) -> int:
+        """
+        Upsert all buffered topics with one execute_values round trip and one commit.
+        RETURNING (xmax = 0) distinguishes fresh inserts from updates without a probe SELECT.
+        Falls back to row-by-row upserts if the batch fails so one bad topic can't sink a page.
+        """
+        if not self.db_connection:
+            raise ValueError("Database connection required.")
+        
+        if not self.topic_buffer:
+            return 0
+        
+        rows = list(self.topic_buffer.values())
+        self.topic_buffer = {}
+        
+        try:
+            stored = self.upsert_topic_rows(rows)
+            self.db_connection.commit()
+            print(f"  💾 Flushed {len(rows)} topics in one batch")
+            return stored
+        except Exception as e:
+            self.db_connection.rollback()
+            if len(rows) == 1:
+                print(f"  ❌ FAILURE: Database error for topic {rows[0]['topic_id']}: {e}")
+                self.stats['errors'] += 1
+                return 0
+            print(f"  ⚠️  Batch upsert of {len(rows)} topics failed ({e}), retrying one at a time...")
+        
+        stored = 0
+        for row in rows:
+            try:
+                stored += self.upsert_topic_rows([row])
+                self.db_connection.commit()
+            except Exception as e:
+                self.db_connection.rollback()
+                print(f"  ❌ FAILURE: Database error for topic {row['topic_id']}: {e}")
+                self.stats['errors'] += 1
+        return stored
+
+    def upsert_topic_rows(self, rows) -> int:
+        """Run the multi-row upsert for prepared topic rows (caller commits)"""
+        with self.db_connection.cursor() as cursor:
+            results = execute_values(cursor, """
+                INSERT INTO forum_topics_raw (
+                    topic_id, raw_content, checksum, posts_checksum, scraped_at, 
+                    title, posts_count, created_at_original,
+                    last_post_id, last_posted_at, highest_post_number
+                )
+                VALUES %s
+                ON CONFLICT (topic_id) DO UPDATE SET
+                    raw_content = EXCLUDED.raw_content,
+                    checksum = EXCLUDED.checksum,
+                    posts_checksum = EXCLUDED.posts_checksum,
+                    last_updated = NOW(),
+                    title = EXCLUDED.title,
+                    posts_count = EXCLUDED.posts_count,
+                    scraped_at = EXCLUDED.scraped_at,
+                    created_at_original = EXCLUDED.created_at_original,
+                    last_post_id = EXCLUDED.last_post_id,
+                    last_posted_at = EXCLUDED.last_posted_at,
+                    highest_post_number = EXCLUDED.highest_post_number
+                RETURNING topic_id, (xmax = 0) AS inserted
+            """, [row['values'] for row in rows], page_size=len(rows), fetch=True)
+            
+            self.upsert_post_rows(cursor, rows)
+            
+            # Every stored topic with posts needs (re-)analysis
+            inserted_by_id = dict(results)
+            enqueue_topics(cursor, [
+                (row['topic_id'], PRIORITY_NEW if inserted_by_id.get(row['topic_id']) else PRIORITY_CHANGED)
+                for row in rows if row['posts_count'] > 0
+            ])
+        
+        for row in rows:
+            topic_id = row['topic_id']
+            if inserted_by_id.get(topic_id):
+                print(f"  ✅ Stored new topic {topic_id}: {row['title'][:50]}...")
+                self.stats['topics_stored'] += 1
+            else:
+                print(f"  ✅ Updated topic {topic_id}: {row['title'][:50]}...")
+                self.stats['topics_updated'] += 1
+            self.stats['posts_total'] += row['posts_count']
+        
+        return len(results)
+
+    def upsert_post_rows(self, cursor, rows):
+        """
+        Mirror the topics' posts into forum_posts in the same transaction.
+        Rows whose content hash, topic and position are unchanged are left untouched,
+        and posts that vanished from a topic's stream are deleted.
+        """
+        post_rows = [post_row for row in rows for post_row in row['post_rows']]
+        
+        cursor.execute("""
+            DELETE FROM forum_posts
+            WHERE topic_id = ANY(%s) AND NOT (post_id = ANY(%s))
+        """, ([row['topic_id'] for row in rows], [post_row[0] for post_row in post_rows]))
+        
+        if not post_rows:
+            return
+        
+        changed = execute_values(cursor, """
+            INSERT INTO forum_posts (
+                post_id, topic_id, post_number, reply_to_post_number,
+                username, created_at, cooked, cleaned_text, content_hash
+            )
+            VALUES %s
+            ON CONFLICT (post_id) DO UPDATE SET
+                topic_id = EXCLUDED.topic_id,
+                post_number = EXCLUDED.post_number,
+                reply_to_post_number = EXCLUDED.reply_to_post_number,
+                username = EXCLUDED.username,
+                created_at = EXCLUDED.created_at,
+                cooked = EXCLUDED.cooked,
+                cleaned_text = EXCLUDED.cleaned_text,
+                content_hash = EXCLUDED.content_hash,
+                updated_at = NOW()
+            WHERE forum_posts.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+               OR forum_posts.topic_id IS DISTINCT FROM EXCLUDED.topic_id
+               OR forum_posts.post_number IS DISTINCT FROM EXCLUDED.post_number
+            RETURNING post_id
+        """, post_rows, page_size=len(post_rows), fetch=True)
+        
+        self.stats['posts_written'] += len(changed)
+
+    def store_topic_to_database(self, raw_content: dict) -> bool:
+        """Store optimized raw topic content in database immediately"""
+        if not self.queue_topic_for_storage(raw_content):
+            return False
+        return self.flush_topic_buffer() > 0
+
+    def scrape_topics_optimized(self, max_pages=None, incremental=True, skip_existing=False,
+                                use_cursor=True):
         """Main scraping method with optimization"""
         print(f"🚀 Starting OPTIMIZED forum scraping...")
         print(f"   Mode: {'incremental' if incremental else 'full'}")
         print(f"   Max pages: {max_pages or 'unlimited'}")
         print(f"   Skip existing: {skip_existing}")
+        print(f"   Fetch workers: {self.max_workers}")
+        print(f"   Request budget: {self.rate_limiter.rate:g} req/s (burst {self.rate_limiter.capacity:g})")
         
         start_time = time.time()
         
         # Get existing metadata for quick comparison OR skipping
         existing_metadata = self.get_existing_topic_metadata() if (incremental or skip_existing) else {}
         
+        # Delta sync cursor - only incremental runs stop early; skip-existing is a backfill
+        sync_cursor = self.get_sync_cursor() if (incremental and use_cursor and not skip_existing) else None
+        cursor_floor = sync_cursor - self.cursor_overlap if sync_cursor else None
+        if sync_cursor:
+            print(f"   Sync cursor: {sync_cursor.isoformat()} (stop once topics are older)")
+        
+        errors_at_start = self.stats['errors']
+        newest_bumped_at = None
+        reached_cursor = False
+        reached_end = False
+        
         page = 0
         while max_pages is None or page < max_pages:
             print(f"\n📄 Processing page {page}...")
-            topics, has_more = self.get_latest_topics(page=page)
+            errors_before_page = self.stats['errors']
+            topics, _ = self.get_latest_topics(page=page)
             
             if not topics:
-                print("📄 No more topics found")
+                # Only an empty page the API actually returned ends the walk
+                if self.stats['errors'] == errors_before_page:
+                    print("📄 No more topics found")
+                    reached_end = True
                 break
             
+            topics_to_fetch = {}
             for topic in topics:
                 topic_id = topic['id']
                 topic_title = topic.get('title', '')
                 
+                # Track the high-water mark and detect when we've paged past the cursor.
+                # Pinned topics sit at the top regardless of activity, so they never end the walk.
+                bumped_at = self.get_topic_bumped_at(topic)
+                if bumped_at:
+                    if newest_bumped_at is None or bumped_at > newest_bumped_at:
+                        newest_bumped_at = bumped_at
+                    if cursor_floor and bumped_at < cursor_floor and not topic.get('pinned'):
+                        reached_cursor = True
+                
                 print(f"\n[{self.stats['topics_processed'] + 1}] Topic {topic_id}: {topic_title[:50]}...")
                 
                 # 🚀 SKIP EXISTING: Skip topics we already have entirely
@@ -353,29 +776,49 @@ class OptimizedDiscourseToDatabase:
                     self.stats['topics_processed'] += 1
                     continue
                 
-                # Only now make the expensive API call to get all posts
-                print(f"  📥 Fetching full topic data...")
-                topic_data = self.get_topic_with_posts(topic_id)
-                
+                print(f"  📥 Queued for full fetch")
+                topics_to_fetch[topic_id] = topic_title
+            
+            # Only now make the expensive API calls to get all posts
+            if topics_to_fetch:
+                print(f"\n📥 Fetching {len(topics_to_fetch)} topics with {self.max_workers} worker(s)...")
+            
+            # Stored posts let known topics download only what's new
+            stored_posts = self.get_stored_posts(list(topics_to_fetch)) if self.post_level_sync else {}
+            
+            for topic_id, topic_data in self.fetch_topics_concurrently(list(topics_to_fetch), stored_posts):
                 if topic_data:
-                    stored = self.store_topic_to_database(topic_data)
+                    self.queue_topic_for_storage(topic_data)
                     self.stats['topics_processed'] += 1
-                    time.sleep(0.5)  # Rate limiting
                 else:
                     print(f"  ❌ FAILURE: Could not fetch topic {topic_id}")
                     self.stats['errors'] += 1
                     self.stats['failed_topics'].append({
                         'topic_id': topic_id,
-                        'title': topic_title,
+                        'title': topics_to_fetch[topic_id],
                         'error': 'Could not fetch topic data'
                     })
             
-            if not has_more:
-                print("📄 Reached end of topics")
+            # One round trip and one commit for everything fetched on this page
+            self.flush_topic_buffer()
+            
+            if reached_cursor:
+                print(f"📍 Reached topics older than sync cursor - stopping after page {page}")
                 break
             
             page += 1
         
+        # Advance the cursor only when this run covered everything newer than it,
+        # and nothing failed (failed topics must be picked up again next time).
+        # Without a cursor that means walking to the end: a --max-pages run that
+        # stopped early would otherwise hide every topic it never reached.
+        covered_gap = reached_cursor or reached_end
+        if (newest_bumped_at and covered_gap and not skip_existing
+                and self.stats['errors'] == errors_at_start):
+            self.save_sync_cursor(newest_bumped_at)
+        elif newest_bumped_at and not skip_existing:
+            print("📍 Sync cursor not advanced (errors or incomplete walk) - next run will re-check")
+        
         # Print optimization results
         elapsed_time = time.time() - start_time
         print(f"\n🎯 OPTIMIZATION RESULTS")
@@ -386,6 +829,10 @@ class OptimizedDiscourseToDatabase:
         print(f"Topics stored: {self.stats['topics_stored']}")
         print(f"Topics updated: {self.stats['topics_updated']}")
         print(f"Total posts: {self.stats['posts_total']}")
+        print(f"Post rows written (new/changed): {self.stats['posts_written']}")
+        if self.post_level_sync:
+            print(f"Posts fetched individually: {self.stats['posts_fetched']}")
+            print(f"Posts reused from storage: {self.stats['posts_reused']}")
         print(f"Errors: {self.stats['errors']}")
         print(f"Time elapsed: {elapsed_time:.1f} seconds")
         
@@ -411,21 +858,24 @@ def main():
     parser.add_argument("--api-username", help="Discourse API username (or set DISCOURSE_API_USERNAME env var)")
     parser.add_argument("--skip-existing", action="store_true", 
                        help="Skip topics that already exist in database (to reach older topics)")
+    parser.add_argument("--ignore-cursor", action="store_true",
+                       help="Incremental mode: walk all /latest pages instead of stopping at the saved bumped_at cursor")
+    parser.add_argument("--full-topic-fetch", action="store_true",
+                       help="Store /t/{id}.json as returned instead of diffing post_stream.stream against stored posts")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Concurrent topic fetch workers (default: 1)")
+    parser.add_argument("--requests-per-second", type=float, default=1.0,
+                       help="Shared Discourse API request budget across all workers (default: 1.0)")
+    parser.add_argument("--burst", type=float,
+                       help="Token bucket capacity, i.e. max requests sent back-to-back (default: max(1, rate))")
     
     args = parser.parse_args()
     
     # Database configuration from environment
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent])
     
     # Validate database configuration
-    if not all([db_config['host'], db_config['database'], db_config['user'], db_config['password']]):
+    if not td_db.config_is_complete(db_config):
         print("❌ Database configuration incomplete. Please set environment variables:")
         print("   Required: DB_HOST, DB_DATABASE, DB_USERNAME, DB_PASSWORD")
         sys.exit(1)
@@ -435,7 +885,11 @@ def main():
             base_url=args.base_url,
             api_key=args.api_key,
             api_username=args.api_username,
-            db_config=db_config
+            db_config=db_config,
+            max_workers=args.workers,
+            requests_per_second=args.requests_per_second,
+            burst=args.burst,
+            post_level_sync=not args.full_topic_fetch
         )
         
         scraper.connect_db()
@@ -444,7 +898,8 @@ def main():
         scraper.scrape_topics_optimized(
             max_pages=args.max_pages,
             incremental=incremental,
-            skip_existing=args.skip_existing
+            skip_existing=args.skip_existing,
+            use_cursor=not args.ignore_cursor
         )
         
         print("✅ Scraping completed successfully!")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Discourse cooked-HTML cleaning shared by the scraper and the analyzer.
+The scraper stores cleaned_text per post in forum_posts, so analysis
+reads it back instead of re-cleaning every post on every run.
+
+Cleaning runs once per post over compiled module-level patterns:
+- quoted replies (<aside class="quote">) collapse to "[quote @user]", since the
+  quoted text is already in the earlier post
+- onebox link previews collapse to "[link: url]" / "[video: url]"
+- <pre><code> blocks become a single ``` fenced span, truncated when long
+- image lightbox metadata (filename, dimensions, size) is dropped
+- block tags become spaces so words on either side don't run together
+- HTML entities are decoded (common ones by str.replace, the rest by html.unescape)
+
+When lxml is installed and FORUM_HTML_PARSER=lxml, the same rules run on a
+parsed tree instead (see script-testing/benchmark_html_cleaner.py).
+"""
+
+import hashlib
+import html
+import os
+import re
+
+try:
+    import lxml.html
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# Bump when cleaning output changes so the scraper rewrites forum_posts.cleaned_text
+CLEANER_VERSION = 2
+MAX_CODE_CHARS = 500
+
+# Quotes, oneboxes, lightbox metadata and code blocks in one alternation behind a
+# literal '<', rewritten by a single callback. A quote body may not contain another
+# <aside>, so nested quotes are peeled one level per pass.
+BLOCK_PATTERN = re.compile(
+    r'<(?:(?P<quote>aside\b[^>]*\bclass="[^"]*\bquote\b[^"]*"[^>]*>[^<]*(?:<(?!/?aside\b)[^<]*)*</aside>)'
+    r'|(?P<onebox>aside\b[^>]*\bclass="[^"]*\bonebox\b[^"]*"[^>]*>.*?</aside>)'
+    r'|(?P<video>div\b[^>]*\bclass="[^"]*\blazy-video-container\b[^"]*"[^>]*>.*?</div>)'
+    r'|(?P<meta>div class="meta">.*?</div>)'
+    r'|pre\b[^>]*>\s*(?:<code\b[^>]*>)?(?P<code>.*?)(?:</code>)?\s*</pre>)',
+    re.DOTALL
+)
+QUOTE_USERNAME_PATTERN = re.compile(r'\bdata-username="([^"]*)"')
+ONEBOX_SRC_PATTERN = re.compile(r'\bdata-onebox-src="([^"]*)"|\bhref="([^"]*)"')
+VIDEO_ID_PATTERN = re.compile(r'\bdata-video-id="([^"]*)"')
+
+# Discourse emits lowercase tags; IGNORECASE would disable the literal-prefix scan
+BLOCK_TAG_PATTERN = re.compile(
+    r'</?(?:p|div|br|hr|li|ul|ol|h[1-6]|blockquote|aside|table|thead|tbody|tr|td|th|pre|details|summary)\b[^>]*>'
+)
+TAG_PATTERN = re.compile(r'<[^<]+?>')
+
+# Entities Discourse emits in nearly every post; anything else goes through html.unescape
+COMMON_ENTITIES = (('&quot;', '"'), ('&#39;', "'"), ('&lt;', '<'), ('&gt;', '>'), ('&nbsp;', ' '))
+
+BLOCK_TAGS = {'p', 'div', 'br', 'hr', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote',
+              'aside', 'table', 'thead', 'tbody', 'tr', 'td', 'th', 'pre', 'details', 'summary'}
+
+
+def unescape_entities(text: str) -> str:
+    if '&' not in text:
+        return text
+    decoded = text
+    for entity, char in COMMON_ENTITIES:
+        decoded = decoded.replace(entity, char)
+    # &amp; last, so "&amp;lt;" stays a literal "&lt;"
+    if decoded.count('&') == decoded.count('&amp;'):
+        return decoded.replace('&amp;', '&')
+    return html.unescape(text)
+
+
+def quote_marker(username: str) -> str:
+    return f" [quote @{username}] " if username else " [quote] "
+
+
+def collapse_whitespace(text: str) -> str:
+    # str.split() treats the same characters as whitespace as \s, without the regex overhead
+    return ' '.join(text.split())
+
+
+def code_marker(code: str) -> str:
+    code = collapse_whitespace(code)
+    if len(code) > MAX_CODE_CHARS:
+        code = code[:MAX_CODE_CHARS] + '...'
+    return f" ```{code}``` "
+
+
+def video_marker(video_id: str) -> str:
+    return f" [video: https://youtu.be/{video_id}] " if video_id else " [video] "
+
+
+def link_marker(url: str) -> str:
+    return f" [link: {url}] " if url else " "
+
+
+def _replace_block(match) -> str:
+    if match.group('quote'):
+        username = QUOTE_USERNAME_PATTERN.search(match.group('quote')[:500])
+        return quote_marker(username.group(1) if username else '')
+    if match.group('onebox'):
+        src = ONEBOX_SRC_PATTERN.search(match.group('onebox'))
+        return link_marker(src.group(1) or src.group(2) if src else '')
+    if match.group('video'):
+        video_id = VIDEO_ID_PATTERN.search(match.group('video'))
+        return video_marker(video_id.group(1) if video_id else '')
+    if match.group('meta'):
+        return ' '
+    # Code keeps its text (still entity-escaped until the final unescape); highlight spans are dropped
+    return code_marker(TAG_PATTERN.sub('', match.group('code')))
+
+
+def clean_html_regex(html_text: str) -> str:
+    text = html_text
+    if '<aside' in text or '<div' in text or '<pre' in text:
+        text, count = BLOCK_PATTERN.subn(_replace_block, text)
+        # Only nested quotes leave an <aside> behind for another pass
+        while count and '<aside' in text:
+            text, count = BLOCK_PATTERN.subn(_replace_block, text)
+    text = BLOCK_TAG_PATTERN.sub(' ', text)
+    text = TAG_PATTERN.sub('', text)
+    return collapse_whitespace(unescape_entities(text))
+
+
+def _replace_element(element, marker: str):
+    """Swap an element for plain text, keeping its tail"""
+    parent = element.getparent()
+    text = marker + (element.tail or '')
+    previous = element.getprevious()
+    if previous is not None:
+        previous.tail = (previous.tail or '') + text
+    else:
+        parent.text = (parent.text or '') + text
+    parent.remove(element)
+
+
+def clean_html_lxml(html_text: str) -> str:
+    root = lxml.html.fragment_fromstring(html_text, create_parent='div')
+
+    # Deepest quotes first so nested quotes collapse with their parent
+    for aside in reversed(root.xpath('.//aside[contains(concat(" ", @class, " "), " quote ")]')):
+        if aside.getparent() is not None:
+            _replace_element(aside, quote_marker(aside.get('data-username', '')))
+    for aside in root.xpath('.//aside[contains(concat(" ", @class, " "), " onebox ")]'):
+        src = aside.get('data-onebox-src')
+        if not src:
+            links = aside.xpath('.//a/@href')
+            src = links[0] if links else ''
+        _replace_element(aside, link_marker(src))
+    for div in root.xpath('.//div[contains(concat(" ", @class, " "), " lazy-video-container ")]'):
+        _replace_element(div, video_marker(div.get('data-video-id', '')))
+    for div in root.xpath('.//div[@class="meta"]'):
+        _replace_element(div, ' ')
+    for pre in list(root.iter('pre')):
+        pre.text = code_marker(pre.text_content())
+        for child in list(pre):
+            pre.remove(child)
+
+    for element in root.iter():
+        if isinstance(element.tag, str) and element.tag in BLOCK_TAGS:
+            element.text = ' ' + (element.text or '')
+            element.tail = ' ' + (element.tail or '')
+
+    return collapse_whitespace(root.text_content())
+
+
+USE_LXML = HAS_LXML and os.getenv('FORUM_HTML_PARSER', 'regex') == 'lxml'
+
+
+def clean_html_content(html_text: str) -> str:
+    """Clean HTML tags and convert to readable text."""
+    if not html_text:
+        return ''
+    if USE_LXML:
+        return clean_html_lxml(html_text)
+    return clean_html_regex(html_text)
+
+
+def post_content_hash(cooked: str) -> str:
+    """MD5 of a post's cooked HTML (and cleaner version), used to skip rewriting unchanged forum_posts rows."""
+    return hashlib.md5(f"{CLEANER_VERSION}:{cooked or ''}".encode()).hexdigest()
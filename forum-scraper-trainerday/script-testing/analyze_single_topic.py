@@ -103,7 +103,7 @@ def analyze_single_topic(topic_id):
         if analysis:
             # Step 4: Save to database
             step4_start = time.time()
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(topic_id, analysis)
             step4_time = time.time() - step4_start
             print(f"  ✓ Analysis saved to database in {step4_time:.2f}s")
             
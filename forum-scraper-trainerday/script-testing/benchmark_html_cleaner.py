@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the cooked-HTML cleaners over the stored forum_topics_raw corpus.
+Times the previous per-call cleaner against forum_html's regex engine and,
+when installed, the lxml path, and reports where regex and lxml output differ.
+
+Usage:
+    python script-testing/benchmark_html_cleaner.py --max-topics 2000 --repeat 3
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import psycopg2
+from dotenv import load_dotenv
+
+import forum_html
+from scripts.fixed_parallel import get_db_config
+
+load_dotenv()
+
+
+def legacy_clean_html_content(html_text: str) -> str:
+    """The cleaner as it was in ForumTopicAnalyzerV2 before forum_html"""
+    import re
+    if not html_text:
+        return ""
+
+    text = re.sub(r'<[^<]+?>', '', html_text)
+    text = text.replace('&quot;', '"')
+    text = text.replace('&amp;', '&')
+    text = text.replace('&lt;', '<')
+    text = text.replace('&gt;', '>')
+    text = text.replace('&nbsp;', ' ')
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def load_cooked_posts(max_topics):
+    connection = psycopg2.connect(**get_db_config())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT post ->> 'cooked'
+                FROM (SELECT raw_content FROM forum_topics_raw ORDER BY topic_id DESC LIMIT %s) r,
+                     jsonb_array_elements(COALESCE(r.raw_content -> 'post_stream' -> 'posts',
+                                                   r.raw_content -> 'posts', '[]'::jsonb)) AS post
+            """, (max_topics,))
+            return [row[0] for row in cursor.fetchall() if row[0]]
+    finally:
+        connection.close()
+
+
+def time_cleaner(cleaner, posts, repeat):
+    best = None
+    output_chars = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output_chars = sum(len(cleaner(post)) for post in posts)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output_chars
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cooked-HTML cleaners on forum_topics_raw")
+    parser.add_argument("--max-topics", type=int, help="Newest N topics to load (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per cleaner; best time is reported (default: 3)")
+    parser.add_argument("--show-diffs", type=int, default=3, help="Regex/lxml mismatches to print (default: 3)")
+    args = parser.parse_args()
+
+    print("🔍 Loading cooked posts from forum_topics_raw...")
+    posts = load_cooked_posts(args.max_topics)
+    input_chars = sum(len(post) for post in posts)
+    print(f"   {len(posts):,} posts, {input_chars / 1024 / 1024:.1f} MB of cooked HTML\n")
+    if not posts:
+        return
+
+    cleaners = [
+        ('legacy (re per call)', legacy_clean_html_content),
+        ('forum_html regex', forum_html.clean_html_regex),
+    ]
+    if forum_html.HAS_LXML:
+        cleaners.append(('forum_html lxml', forum_html.clean_html_lxml))
+    else:
+        print("ℹ️  lxml not installed - skipping the lxml path\n")
+
+    baseline = None
+    print(f"{'Cleaner':<24}{'Best time':>12}{'Posts/sec':>14}{'Output':>12}{'Speedup':>10}")
+    for name, cleaner in cleaners:
+        elapsed, output_chars = time_cleaner(cleaner, posts, args.repeat)
+        baseline = baseline or elapsed
+        print(f"{name:<24}{elapsed:>11.3f}s{len(posts) / elapsed:>14,.0f}"
+              f"{output_chars / input_chars:>11.0%}{baseline / elapsed:>9.2f}x")
+
+    if forum_html.HAS_LXML:
+        mismatches = [post for post in posts
+                      if forum_html.clean_html_regex(post) != forum_html.clean_html_lxml(post)]
+        print(f"\n🔎 regex vs lxml output differs on {len(mismatches):,} of {len(posts):,} posts")
+        for post in mismatches[:args.show_diffs]:
+            print(f"\n   regex: {forum_html.clean_html_regex(post)[:200]}")
+            print(f"   lxml:  {forum_html.clean_html_lxml(post)[:200]}")
+
+if __name__ == "__main__":
+    main()
@@ -116,7 +116,7 @@ def main():
         analysis = analyzer.analyze_stored_topic(topic_id, model="gpt-4o-mini")  # ⚡ FAST MODEL
         
         if analysis:
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(topic_id, analysis)
             qa_count = len(analysis.get('qa_pairs', []))
             category = analysis.get('topic_summary', {}).get('analysis_category', 'Unknown')
             
@@ -122,7 +122,7 @@ def analyze_single_topic(topic_id, title):
         
         if analysis:
             # Save to database
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(topic_id, analysis)
             
             # Extract results
             qa_count = len(analysis.get('qa_pairs', []))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Local stub of the OpenAI Files + Batches API for testing batch analysis.
+Batches complete immediately with a canned analysis per topic, so the whole
+--batch flow (write JSONL, submit, poll, ingest) runs without API cost.
+
+Usage:
+    python script-testing/openai_batch_stub.py --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python scripts/analyze_forum_topics.py --batch --max-topics 5
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILES = {}
+BATCHES = {}
+LOCK = threading.Lock()
+
+
+def new_id(prefix):
+    return f"{prefix}-{uuid.uuid4().hex[:24]}"
+
+
+def canned_analysis(request_body):
+    """A minimal analysis in the shape get_analysis_prompt asks for"""
+    # The topic JSON follows the prompt's closing "Here is the forum topic data:" line
+    content = request_body['messages'][-1]['content']
+    try:
+        topic = json.loads(content.rsplit('Here is the forum topic data:', 1)[-1]).get('topic', {})
+    except ValueError:
+        topic = {}
+    return {
+        'topic_summary': {
+            'topic_id': topic.get('id'),
+            'title': topic.get('title') or 'Stub topic',
+            'category': 'stub',
+            'analysis_category': 'Technical Issues',
+            'date_created': (topic.get('created_at') or '2025-01-01')[:10],
+            'total_posts': topic.get('posts_count') or 0,
+            'is_announcement': False
+        },
+        'qa_pairs': [],
+        'user_voice_patterns': {},
+        'platform_voice_patterns': {},
+        'key_insights': {},
+        'priority_score': {'recency': 'low', 'frequency': 'low', 'impact': 'low'}
+    }
+
+
+def run_batch(batch):
+    """Produce the output file for a batch straight away"""
+    lines = []
+    for line in FILES[batch['input_file_id']]['content'].decode().splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        body = {
+            'id': new_id('chatcmpl'),
+            'object': 'chat.completion',
+            'model': request['body']['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': json.dumps(canned_analysis(request['body']))},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        }
+        lines.append(json.dumps({
+            'id': new_id('batch_req'),
+            'custom_id': request['custom_id'],
+            'response': {'status_code': 200, 'request_id': new_id('req'), 'body': body},
+            'error': None
+        }))
+
+    output_id = new_id('file')
+    FILES[output_id] = {'content': ('\n'.join(lines) + '\n').encode(), 'filename': 'output.jsonl', 'purpose': 'batch_output'}
+    batch.update({
+        'status': 'completed',
+        'output_file_id': output_id,
+        'completed_at': int(time.time()),
+        'request_counts': {'total': len(lines), 'completed': len(lines), 'failed': 0}
+    })
+
+
+def file_object(file_id):
+    stored = FILES[file_id]
+    return {
+        'id': file_id, 'object': 'file', 'bytes': len(stored['content']),
+        'created_at': int(time.time()), 'filename': stored['filename'], 'purpose': stored['purpose']
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        body = self.read_body()
+        with LOCK:
+            path = self.path.split('?')[0]
+            if path == '/v1/files':
+                # Parse multipart/form-data with the stdlib email parser
+                header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                message = BytesParser(policy=HTTP).parsebytes(header + body)
+                fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+                file_part = fields['file']
+                file_id = new_id('file')
+                FILES[file_id] = {
+                    'content': file_part.get_payload(decode=True),
+                    'filename': file_part.get_filename() or 'input.jsonl',
+                    'purpose': fields['purpose'].get_payload(decode=True).decode() if 'purpose' in fields else 'batch'
+                }
+                return self.send_json(file_object(file_id))
+
+            if path == '/v1/batches':
+                request = json.loads(body)
+                batch_id = new_id('batch')
+                batch = {
+                    'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'],
+                    'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+                    'status': 'in_progress', 'created_at': int(time.time()), 'metadata': request.get('metadata'),
+                    'output_file_id': None, 'error_file_id': None, 'errors': None,
+                    'request_counts': {'total': 0, 'completed': 0, 'failed': 0}
+                }
+                run_batch(batch)
+                BATCHES[batch_id] = batch
+                return self.send_json(batch)
+
+        self.send_json({'error': {'message': f"Unknown path {self.path}"}}, status=404)
+
+    def do_GET(self):
+        with LOCK:
+            parts = self.path.split('?')[0].strip('/').split('/')
+            if parts[:2] == ['v1', 'batches'] and len(parts) == 3 and parts[2] in BATCHES:
+                return self.send_json(BATCHES[parts[2]])
+
+            if parts[:2] == ['v1', 'files'] and len(parts) >= 3 and parts[2] in FILES:
+                if len(parts) == 4 and parts[3] == 'content':
+                    data = FILES[parts[2]]['content']
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                return self.send_json(file_object(parts[2]))
+
+        self.send_json({'error': {'message': f"Unknown path {self.path}"}}, status=404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI Batch API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"🧪 OpenAI batch stub listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStub stopped")
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,12 @@ Forum Topic Analysis v2 with Raw Content Storage
 Stores complete raw forum data in database, then analyzes for insights.
 """
 
+import argparse
 import json
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
@@ -16,6 +18,21 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import hashlib
 
+# Add parent directory (and the repo root, for td_db) to path for shared modules
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+import td_db
+
+from forum_html import clean_html_content
+from analysis_cache import AnalysisCache
+from analysis_queue import PRIORITY_CHANGED, PRIORITY_NEW, enqueue_topics, ensure_queue_schema, mark_failed
+from analysis_writer import write_analyses
+from topic_windows import TopicWindowPlanner, merge_window_analyses, window_instructions
+
+# Windows of one oversized topic analyzed at the same time
+MAX_CONCURRENT_WINDOWS = 4
+
 # Load environment variables from .env file
 try:
     from dotenv import load_dotenv
@@ -29,8 +46,9 @@ except ImportError:
     print("python-dotenv not installed, using system environment variables")
 
 class ForumTopicAnalyzerV2:
-    def __init__(self, openai_api_key: str = None, db_config: dict = None):
-        """Initialize the analyzer with OpenAI API key and database config."""
+    def __init__(self, openai_api_key: str = None, db_config: dict = None, use_cache: bool = True):
+        """Initialize the analyzer with OpenAI API key and database config.
+        use_cache reuses stored analyses for byte-identical model + prompt + topic input."""
         if openai_api_key:
             self.openai_client = OpenAI(api_key=openai_api_key)
         elif os.getenv('OPENAI_API_KEY'):
@@ -40,6 +58,8 @@ class ForumTopicAnalyzerV2:
         
         self.db_config = db_config
         self.db_connection = None
+        self.analysis_cache = AnalysisCache() if use_cache else None
+        self.window_planners = {}
     
     def connect_to_database(self):
         """Connect to PostgreSQL database."""
@@ -51,7 +71,8 @@ class ForumTopicAnalyzerV2:
             print(f"Host: {self.db_config['host']}")
             print(f"Database: {self.db_config['database']}")
             print(f"SSL mode: {self.db_config.get('sslmode', 'none')}")
-            self.db_connection = psycopg2.connect(**self.db_config)
+            # Pooled: close_database_connection() hands it back for the next analyzer
+            self.db_connection = td_db.get_connection(self.db_config)
             print("✓ Connected to PostgreSQL database")
         except Exception as e:
             raise Exception(f"Failed to connect to database: {e}")
@@ -167,7 +188,8 @@ class ForumTopicAnalyzerV2:
             with self.db_connection.cursor() as cursor:
                 cursor.execute(schema_sql)
                 self.db_connection.commit()
-                print("✓ Database schema created successfully")
+            ensure_queue_schema(self.db_connection)
+            print("✓ Database schema created successfully")
         except Exception as e:
             self.db_connection.rollback()
             raise Exception(f"Failed to create database schema: {e}")
@@ -263,6 +285,9 @@ class ForumTopicAnalyzerV2:
                     created_at
                 ))
                 
+                if raw_content.get('posts') or raw_content.get('post_stream', {}).get('posts'):
+                    enqueue_topics(cursor, [(topic_id, PRIORITY_CHANGED if result else PRIORITY_NEW)])
+                
                 self.db_connection.commit()
                 
                 action = "Updated" if result else "Stored"
@@ -273,21 +298,22 @@ class ForumTopicAnalyzerV2:
             self.db_connection.rollback()
             raise Exception(f"Failed to store raw topic content: {e}")
     
-    def delete_existing_analysis(self, topic_id: int):
+    def delete_existing_analysis(self, topic_id: int, connection=None):
         """Delete existing analysis for a topic before re-analyzing."""
+        connection = connection or self.db_connection
         try:
-            with self.db_connection.cursor() as cursor:
+            with connection.cursor() as cursor:
                 # Delete in reverse dependency order
                 cursor.execute("DELETE FROM forum_insights WHERE topic_id = %s", (topic_id,))
                 cursor.execute("DELETE FROM forum_voice_patterns WHERE topic_id = %s", (topic_id,))
                 cursor.execute("DELETE FROM forum_qa_pairs WHERE topic_id = %s", (topic_id,))
                 cursor.execute("DELETE FROM forum_topics WHERE topic_id = %s", (topic_id,))
                 
-                self.db_connection.commit()
+                connection.commit()
                 print(f"  Cleared existing analysis for topic {topic_id}")
         except Exception as e:
             print(f"Error deleting existing analysis for topic {topic_id}: {e}")
-            self.db_connection.rollback()
+            connection.rollback()
     
     def get_analysis_prompt(self) -> str:
         """Return the LLM prompt for analyzing forum topics."""
@@ -364,41 +390,45 @@ Here is the forum topic data:
 
     def clean_html_content(self, html_text: str) -> str:
         """Clean HTML tags and convert to readable text."""
-        import re
-        
-        # Remove HTML tags
-        text = re.sub('<[^<]+?>', '', html_text)
-        
-        # Convert HTML entities
-        text = text.replace('&quot;', '"')
-        text = text.replace('&amp;', '&')
-        text = text.replace('&lt;', '<')
-        text = text.replace('&gt;', '>')
-        text = text.replace('&nbsp;', ' ')
-        
-        # Clean up whitespace
-        text = re.sub(r'\s+', ' ', text)
-        text = text.strip()
-        
-        return text
+        return clean_html_content(html_text)
 
-    def prepare_topic_for_analysis(self, topic_data: dict) -> dict:
-        """Prepare topic data for LLM analysis by cleaning and structuring it."""
+    def get_cleaned_posts_from_table(self, topic_id: int, connection=None) -> Optional[List[dict]]:
+        """
+        Read already-cleaned posts from forum_posts.
+        Returns None unless the scraper mirrored this exact raw_content version
+        (posts_checksum = checksum), so callers fall back to the JSONB.
+        """
+        connection = connection or self.db_connection
+        try:
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT p.post_id, p.username, p.created_at, p.cleaned_text,
+                           p.post_number, p.reply_to_post_number
+                    FROM forum_topics_raw r
+                    JOIN forum_posts p ON p.topic_id = r.topic_id
+                    WHERE r.topic_id = %s AND r.posts_checksum = r.checksum
+                    ORDER BY p.post_number
+                """, (topic_id,))
+                rows = cursor.fetchall()
+        except psycopg2.Error:
+            # forum_posts not created yet (older scraper) - use the raw JSONB
+            connection.rollback()
+            return None
         
-        # Clean topic info - handle both raw API format and stored format
-        if 'topic' in topic_data:
-            topic_info = topic_data.get('topic', {})
-        else:
-            topic_info = topic_data  # Direct topic data
-            
-        # Get posts from the correct location - handle both formats
-        posts = []
-        if 'posts' in topic_data:
-            posts = topic_data.get('posts', [])
-        elif 'post_stream' in topic_data and 'posts' in topic_data['post_stream']:
-            posts = topic_data['post_stream']['posts']
+        if not rows:
+            return None
         
-        # Clean posts - only include essential fields
+        return [{
+            'id': row['post_id'],
+            'username': row['username'],
+            'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+            'content': row['cleaned_text'],
+            'post_number': row['post_number'],
+            'reply_to_post_number': row['reply_to_post_number']
+        } for row in rows]
+
+    def clean_posts(self, posts: List[dict]) -> List[dict]:
+        """Clean posts - only include essential fields."""
         cleaned_posts = []
         for post in posts:
             cleaned_post = {
@@ -410,6 +440,27 @@ Here is the forum topic data:
                 'reply_to_post_number': post.get('reply_to_post_number')
             }
             cleaned_posts.append(cleaned_post)
+        return cleaned_posts
+
+    def prepare_topic_for_analysis(self, topic_data: dict, cleaned_posts: List[dict] = None) -> dict:
+        """Prepare topic data for LLM analysis by cleaning and structuring it.
+        Pass cleaned_posts (from forum_posts) to skip re-cleaning the raw posts."""
+        
+        # Clean topic info - handle both raw API format and stored format
+        if 'topic' in topic_data:
+            topic_info = topic_data.get('topic', {})
+        else:
+            topic_info = topic_data  # Direct topic data
+            
+        # Get posts from the correct location - handle both formats
+        if cleaned_posts is None:
+            posts = []
+            if 'posts' in topic_data:
+                posts = topic_data.get('posts', [])
+            elif 'post_stream' in topic_data and 'posts' in topic_data['post_stream']:
+                posts = topic_data['post_stream']['posts']
+            
+            cleaned_posts = self.clean_posts(posts)
         
         return {
             'topic': {
@@ -424,217 +475,179 @@ Here is the forum topic data:
             'posts': cleaned_posts
         }
 
-    def analyze_stored_topic(self, topic_id: int, model: str = "gpt-4o-mini") -> Optional[dict]:
-        """Analyze a topic from stored raw content."""
+    def load_topic_for_analysis(self, topic_id: int, connection=None) -> Optional[dict]:
+        """Load a stored topic and return it cleaned for analysis, or None if missing."""
+        connection = connection or self.db_connection
         
-        if not self.db_connection:
-            raise ValueError("Database connection required.")
+        # Prefer posts already cleaned by the scraper; only then is the
+        # post payload left out of the raw_content fetch
+        cleaned_posts = self.get_cleaned_posts_from_table(topic_id, connection)
         
-        try:
-            # Get raw content from database
-            with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        # Get raw content from database
+        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            if cleaned_posts is not None:
+                cursor.execute("""
+                    SELECT raw_content - 'post_stream' - 'posts' AS raw_content
+                    FROM forum_topics_raw WHERE topic_id = %s
+                """, (topic_id,))
+            else:
                 cursor.execute("""
                     SELECT raw_content FROM forum_topics_raw WHERE topic_id = %s
                 """, (topic_id,))
-                
-                result = cursor.fetchone()
-                if not result:
-                    print(f"  ❌ FAILURE: Topic {topic_id} not found in raw content table")
-                    return None
-                
-                raw_content = result['raw_content']
-            
-            # Prepare cleaned data for analysis
-            cleaned_data = self.prepare_topic_for_analysis(raw_content)
             
-            # Create the full prompt
-            prompt = self.get_analysis_prompt()
-            topic_json = json.dumps(cleaned_data, indent=2)
+            result = cursor.fetchone()
+            if not result:
+                print(f"  ❌ FAILURE: Topic {topic_id} not found in raw content table")
+                return None
             
-            # Check if topic is too large (rough estimate)
-            if len(topic_json) > 15000:  # Roughly 3-4k tokens
-                print(f"  ⚠️  WARNING: Topic {topic_id} is large ({len(topic_json)} chars) - may hit token limits")
+            raw_content = result['raw_content']
+        
+        # Prepare cleaned data for analysis
+        return self.prepare_topic_for_analysis(raw_content, cleaned_posts)
+
+    def build_analysis_messages(self, topic_id: int, cleaned_data: dict) -> List[dict]:
+        """Build the chat messages for one cleaned topic (or one window of it)."""
+        # Create the full prompt
+        prompt = self.get_analysis_prompt()
+        topic_json = json.dumps(cleaned_data, indent=2)
+        
+        if 'window' in cleaned_data:
+            # Window note goes just above the topic data so the JSON still ends the message
+            head, marker, tail = prompt.rpartition("Here is the forum topic data:")
+            prompt = head + window_instructions(cleaned_data) + marker + tail
+        
+        return [
+            {"role": "system", "content": "You are an expert at analyzing forum discussions for content strategy insights."},
+            {"role": "user", "content": prompt + topic_json}
+        ]
+
+    def plan_analysis_messages(self, topic_id: int, cleaned_data: dict, model: str = "gpt-4o-mini") -> List[List[dict]]:
+        """Chat messages for each request a topic needs - one unless it exceeds the token budget."""
+        if model not in self.window_planners:
+            self.window_planners[model] = TopicWindowPlanner(model)
+        planner = self.window_planners[model]
+        
+        # Prompt plus system message and the window note
+        prompt_tokens = planner.count_tokens(self.get_analysis_prompt()) + 300
+        windows = planner.plan(cleaned_data, prompt_tokens)
+        if len(windows) > 1:
+            print(f"  ✂️  Topic {topic_id} is {len(cleaned_data.get('posts', []))} posts - "
+                  f"splitting into {len(windows)} windows")
+        
+        return [self.build_analysis_messages(topic_id, window) for window in windows]
+
+    def parse_analysis_response(self, topic_id: int, analysis_text: str) -> Optional[dict]:
+        """Extract the analysis JSON from a completion, or None if it can't be parsed."""
+        analysis_text = analysis_text.strip()
+        
+        # Try to extract JSON from response
+        try:
+            # Look for JSON block
+            if "```json" in analysis_text:
+                json_start = analysis_text.find("```json") + 7
+                json_end = analysis_text.find("```", json_start)
+                json_text = analysis_text[json_start:json_end].strip()
+            else:
+                json_text = analysis_text
             
-            print(f"  → Making OpenAI API call for topic {topic_id}...")
+            analysis = json.loads(json_text)
+            # The model echoes a topic id back; the id we asked about is the one that counts
+            analysis.setdefault('topic_summary', {})['topic_id'] = topic_id
+            print(f"  ✓ OpenAI analysis successful for topic {topic_id}")
+            return analysis
             
-            # Make API call
-            try:
-                response = self.openai_client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "You are an expert at analyzing forum discussions for content strategy insights."},
-                        {"role": "user", "content": prompt + topic_json}
-                    ],
-                    temperature=0.1  # Low temperature for consistent analysis
-                )
-            except Exception as api_error:
-                print(f"  ❌ FAILURE: OpenAI API error for topic {topic_id}: {api_error}")
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"  ❌ FAILURE: JSON parsing error for topic {topic_id}")
+            print(f"     Error: {e}")
+            print(f"     Raw response preview: {analysis_text[:300]}...")
+            return None
+
+    def get_cached_analysis(self, topic_id: int, model: str, messages: List[dict], connection=None):
+        """Return (cache_key, analysis) - analysis is None on a miss or with caching disabled."""
+        if not self.analysis_cache:
+            return None, None
+        
+        cache_key = self.analysis_cache.make_key(model, messages)
+        analysis = self.analysis_cache.get(cache_key, connection or self.db_connection)
+        if analysis is not None:
+            print(f"  ⚡ Cache hit for topic {topic_id} - reusing stored analysis")
+        return cache_key, analysis
+
+    def cache_analysis(self, cache_key: Optional[str], model: str, analysis: dict, connection=None):
+        """Store a freshly parsed analysis under its content key."""
+        if self.analysis_cache and cache_key:
+            self.analysis_cache.put(cache_key, model, analysis, connection or self.db_connection)
+
+    def request_analysis(self, topic_id: int, model: str, messages: List[dict]) -> Optional[dict]:
+        """One chat completion call, parsed - None on API or parsing errors."""
+        try:
+            response = self.openai_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.1  # Low temperature for consistent analysis
+            )
+        except Exception as api_error:
+            print(f"  ❌ FAILURE: OpenAI API error for topic {topic_id}: {api_error}")
+            return None
+        
+        return self.parse_analysis_response(topic_id, response.choices[0].message.content)
+
+    def analyze_stored_topic(self, topic_id: int, model: str = "gpt-4o-mini") -> Optional[dict]:
+        """Analyze a topic from stored raw content."""
+        
+        if not self.db_connection:
+            raise ValueError("Database connection required.")
+        
+        try:
+            cleaned_data = self.load_topic_for_analysis(topic_id)
+            if cleaned_data is None:
                 return None
             
-            # Parse response
-            analysis_text = response.choices[0].message.content.strip()
+            message_sets = self.plan_analysis_messages(topic_id, cleaned_data, model)
             
-            # Try to extract JSON from response
-            try:
-                # Look for JSON block
-                if "```json" in analysis_text:
-                    json_start = analysis_text.find("```json") + 7
-                    json_end = analysis_text.find("```", json_start)
-                    json_text = analysis_text[json_start:json_end].strip()
-                else:
-                    json_text = analysis_text
+            cache_keys = []
+            analyses = []
+            for messages in message_sets:
+                cache_key, cached = self.get_cached_analysis(topic_id, model, messages)
+                cache_keys.append(cache_key)
+                analyses.append(cached)
+            
+            missing = [index for index, analysis in enumerate(analyses) if analysis is None]
+            if missing:
+                print(f"  → Making {len(missing)} OpenAI API call(s) for topic {topic_id}...")
                 
-                analysis = json.loads(json_text)
-                print(f"  ✓ OpenAI analysis successful for topic {topic_id}")
-                return analysis
+                # Windows go out concurrently; cache writes stay on this thread's connection
+                with ThreadPoolExecutor(max_workers=min(len(missing), MAX_CONCURRENT_WINDOWS)) as executor:
+                    results = executor.map(lambda index: self.request_analysis(topic_id, model, message_sets[index]), missing)
+                    for index, analysis in zip(missing, results):
+                        if analysis is not None:
+                            analyses[index] = analysis
+                            self.cache_analysis(cache_keys[index], model, analysis)
                 
-            except json.JSONDecodeError as e:
-                print(f"  ❌ FAILURE: JSON parsing error for topic {topic_id}")
-                print(f"     Error: {e}")
-                print(f"     Raw response preview: {analysis_text[:300]}...")
-                return None
+                # Windows that did succeed stay cached, so a retry only repeats the failed ones
+                if any(analysis is None for analysis in analyses):
+                    return None
+            
+            return merge_window_analyses(topic_id, analyses)
                 
         except Exception as e:
             print(f"  ❌ FAILURE: Unexpected error analyzing topic {topic_id}: {e}")
             return None
 
-    def save_analysis_to_database(self, analysis: dict):
-        """Save analysis results to PostgreSQL database."""
-        if not self.db_connection:
+    def save_analysis_to_database(self, topic_id: int, analysis: dict, connection=None):
+        """Save analysis results to PostgreSQL database, replacing any earlier analysis of the topic."""
+        connection = connection or self.db_connection
+        if not connection:
             raise ValueError("Database connection required.")
         
         try:
-            with self.db_connection.cursor() as cursor:
-                topic_summary = analysis['topic_summary']
-                
-                # Insert topic summary
-                topic_sql = """
-                INSERT INTO forum_topics (
-                    topic_id, title, category, analysis_category, date_created, 
-                    total_posts, is_announcement, views, like_count
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (topic_id) DO UPDATE SET
-                    title = EXCLUDED.title,
-                    category = EXCLUDED.category,
-                    analysis_category = EXCLUDED.analysis_category,
-                    date_created = EXCLUDED.date_created,
-                    total_posts = EXCLUDED.total_posts,
-                    is_announcement = EXCLUDED.is_announcement,
-                    views = EXCLUDED.views,
-                    like_count = EXCLUDED.like_count,
-                    analyzed_at = NOW()
-                """
-                
-                cursor.execute(topic_sql, (
-                    topic_summary['topic_id'],
-                    topic_summary['title'],
-                    topic_summary.get('category', ''),
-                    topic_summary.get('analysis_category', ''),
-                    topic_summary.get('date_created'),
-                    topic_summary.get('total_posts', 0),
-                    topic_summary.get('is_announcement', False),
-                    topic_summary.get('views', 0),
-                    topic_summary.get('like_count', 0)
-                ))
-                
-                # Insert Q&A pairs
-                for qa_pair in analysis.get('qa_pairs', []):
-                    qa_sql = """
-                    INSERT INTO forum_qa_pairs (
-                        topic_id, sequence, date_posted,
-                        question_username, question_content, question_context, pain_point, user_language,
-                        response_username, response_content, response_type, solution_offered, platform_language
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    
-                    question = qa_pair.get('question', {})
-                    response = qa_pair.get('response', {})
-                    
-                    cursor.execute(qa_sql, (
-                        topic_summary['topic_id'],
-                        qa_pair.get('sequence'),
-                        qa_pair.get('date'),
-                        question.get('username'),
-                        question.get('content'),
-                        question.get('context'),
-                        question.get('pain_point'),
-                        question.get('user_language'),
-                        response.get('username'),
-                        response.get('content'),
-                        response.get('response_type'),
-                        response.get('solution_offered'),
-                        response.get('platform_language')
-                    ))
-                
-                # Insert voice patterns
-                user_patterns = analysis.get('user_voice_patterns', {})
-                platform_patterns = analysis.get('platform_voice_patterns', {})
-                
-                # User voice patterns
-                voice_sql = """
-                INSERT INTO forum_voice_patterns (
-                    topic_id, pattern_type, main_pain_points, common_language, 
-                    expectations_vs_reality, user_workarounds, praise_points, confusion_areas
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cursor.execute(voice_sql, (
-                    topic_summary['topic_id'],
-                    'user_voice',
-                    json.dumps(user_patterns.get('main_pain_points', [])),
-                    json.dumps(user_patterns.get('common_language', [])),
-                    json.dumps(user_patterns.get('expectations_vs_reality', [])),
-                    json.dumps(user_patterns.get('user_workarounds', [])),
-                    json.dumps(user_patterns.get('praise_points', [])),
-                    json.dumps(user_patterns.get('confusion_areas', []))
-                ))
-                
-                # Platform voice patterns
-                platform_sql = """
-                INSERT INTO forum_voice_patterns (
-                    topic_id, pattern_type, explanation_style, common_solutions,
-                    feature_positioning, development_transparency, methodology_mentions
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cursor.execute(platform_sql, (
-                    topic_summary['topic_id'],
-                    'platform_voice',
-                    platform_patterns.get('explanation_style'),
-                    json.dumps(platform_patterns.get('common_solutions', [])),
-                    json.dumps(platform_patterns.get('feature_positioning', [])),
-                    json.dumps(platform_patterns.get('development_transparency', [])),
-                    json.dumps(platform_patterns.get('methodology_mentions', []))
-                ))
-                
-                # Insert insights
-                insights = analysis.get('key_insights', {})
-                priority = analysis.get('priority_score', {})
-                
-                insights_sql = """
-                INSERT INTO forum_insights (
-                    topic_id, content_opportunities, messaging_gaps, success_indicators,
-                    recurring_issues, feature_demand, recency_score, frequency_score, impact_score
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cursor.execute(insights_sql, (
-                    topic_summary['topic_id'],
-                    json.dumps(insights.get('content_opportunities', [])),
-                    json.dumps(insights.get('messaging_gaps', [])),
-                    json.dumps(insights.get('success_indicators', [])),
-                    json.dumps(insights.get('recurring_issues', [])),
-                    json.dumps(insights.get('feature_demand', [])),
-                    priority.get('recency'),
-                    priority.get('frequency'),
-                    priority.get('impact')
-                ))
-                
-                self.db_connection.commit()
-                print(f"  ✓ Saved analysis for topic {topic_summary['topic_id']} to database")
+            with connection.cursor() as cursor:
+                write_analyses(cursor, [(topic_id, analysis)])
+            connection.commit()
+            print(f"  ✓ Saved analysis for topic {topic_id} to database")
                 
         except Exception as e:
-            self.db_connection.rollback()
+            connection.rollback()
             raise Exception(f"Failed to save analysis to database: {e}")
     
     def close_database_connection(self):
@@ -655,25 +668,24 @@ Here is the forum topic data:
         print("Getting topics from database raw storage...")
         
         with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            if max_topics:
+            if force_reanalyze:
                 cursor.execute("""
                     SELECT topic_id, title, posts_count 
                     FROM forum_topics_raw 
-                    WHERE (jsonb_array_length(COALESCE(raw_content -> 'posts', '[]'::jsonb)) > 0
-                           OR jsonb_array_length(COALESCE(raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
-                    AND topic_id NOT IN (SELECT topic_id FROM forum_topics)
+                    WHERE stored_post_count > 0
                     ORDER BY topic_id
                     LIMIT %s OFFSET %s
                 """, (max_topics, start_from))
             else:
+                # Pending queue rows are exactly the unanalyzed or changed topics with posts
                 cursor.execute("""
-                    SELECT topic_id, title, posts_count 
-                    FROM forum_topics_raw 
-                    WHERE (jsonb_array_length(COALESCE(raw_content -> 'posts', '[]'::jsonb)) > 0
-                           OR jsonb_array_length(COALESCE(raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
-                    AND topic_id NOT IN (SELECT topic_id FROM forum_topics)
-                    ORDER BY topic_id
-                """)
+                    SELECT r.topic_id, r.title, r.posts_count 
+                    FROM forum_analysis_queue q
+                    JOIN forum_topics_raw r ON r.topic_id = q.topic_id
+                    WHERE q.state = 'pending'
+                    ORDER BY q.priority DESC, q.topic_id
+                    LIMIT %s OFFSET %s
+                """, (max_topics, start_from))
             
             db_topics = cursor.fetchall()
         
@@ -723,17 +735,15 @@ Here is the forum topic data:
                 else:
                     print(f"  → Running analysis (content {'changed' if content_changed else 'forced reanalysis'})")
                     
-                    # Clear existing analysis if this is an update
-                    if content_changed:
-                        self.delete_existing_analysis(topic_id)
-                    
+                    # Existing analysis is replaced when the new one is saved, so a failed
+                    # run leaves the previous analysis in place
                     # Step 3: Analyze from stored raw content
                     analysis = self.analyze_stored_topic(topic_id)
                     
                     if analysis:
                         # Step 4: Save analysis results
                         try:
-                            self.save_analysis_to_database(analysis)
+                            self.save_analysis_to_database(topic_id, analysis)
                             results["analysis_metadata"]["successful_analyses"] += 1
                             
                             # Track categories
@@ -744,6 +754,7 @@ Here is the forum topic data:
                             print(f"  ✅ SUCCESS: Complete analysis for {title[:50]}...")
                         except Exception as save_error:
                             print(f"  ❌ FAILURE: Database save error for topic {topic_id}: {save_error}")
+                            mark_failed(self.db_connection, topic_id, f"Database save error: {save_error}")
                             results["analysis_metadata"]["failed_analyses"] += 1
                             results["analysis_metadata"]["failed_topics"].append({
                                 "topic_id": topic_id,
@@ -752,6 +763,7 @@ Here is the forum topic data:
                                 "failure_stage": "save_analysis"
                             })
                     else:
+                        mark_failed(self.db_connection, topic_id, "OpenAI analysis returned None")
                         results["analysis_metadata"]["failed_analyses"] += 1
                         results["analysis_metadata"]["failed_topics"].append({
                             "topic_id": topic_id,
@@ -770,6 +782,7 @@ Here is the forum topic data:
                 
             except Exception as e:
                 print(f"  Error processing topic {topic_id}: {e}")
+                mark_failed(self.db_connection, topic_id, f"Processing error: {e}")
                 results["analysis_metadata"]["failed_analyses"] += 1
                 results["analysis_metadata"]["failed_topics"].append({
                     "topic_id": topic_id,
@@ -792,6 +805,8 @@ Here is the forum topic data:
         print(f"  ❌ Failed analyses: {results['analysis_metadata']['failed_analyses']}")
         print(f"  ⏭️  Unchanged (skipped): {results['analysis_metadata']['unchanged_topics']}")
         print(f"  📁 Categories found: {results['analysis_metadata']['topics_by_category']}")
+        if self.analysis_cache:
+            print(f"  ⚡ {self.analysis_cache.summary()}")
         
         # Show detailed failure information
         if results['analysis_metadata']['failed_analyses'] > 0:
@@ -811,10 +826,19 @@ Here is the forum topic data:
 
 def main():
     """Main function to run the analysis."""
+    parser = argparse.ArgumentParser(description="TrainerDay Forum Analysis Tool v2")
+    parser.add_argument("--batch", action="store_true",
+                       help="Submit all prompts through the OpenAI Batch API (half price, async) instead of one call per topic")
+    parser.add_argument("--batch-id", help="Resume polling/ingesting an already submitted batch")
+    parser.add_argument("--max-topics", type=int, help="Max topics to analyze (default: all remaining)")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Model used in batch mode (default: gpt-4o-mini)")
+    parser.add_argument("--poll-interval", type=int, default=60, help="Seconds between batch status checks (default: 60)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the LLM, ignoring forum_analysis_cache")
+    args = parser.parse_args()
     
     # Configuration
     FORUM_DATA_DIR = "../forum_data"
-    MAX_TOPICS = None  # Process ALL remaining topics 
+    MAX_TOPICS = args.max_topics  # None processes ALL remaining topics
     START_FROM = 0  # Will skip already analyzed ones automatically
     FORCE_REANALYZE = False  # Set to True to reanalyze all topics regardless of changes
     
@@ -828,34 +852,31 @@ def main():
     else:
         print("Using OpenAI API key from environment variable.")
     
-    # Database configuration from environment variables
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    # Add SSL certificate if specified
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
-            print(f"Using SSL certificate: {ssl_cert_path}")
-        else:
-            print(f"Warning: SSL certificate file not found: {ssl_cert_path}")
+    # Database configuration from environment variables (DB_SSLROOTCERT is resolved against this project)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
+    if db_config.get('sslrootcert'):
+        print(f"Using SSL certificate: {db_config['sslrootcert']}")
     
-    if not all([db_config['host'], db_config['database'], db_config['user'], db_config['password']]):
+    if not td_db.config_is_complete(db_config):
         print("Database configuration incomplete. Please check environment variables:")
         print("Required: DB_HOST, DB_DATABASE, DB_USERNAME, DB_PASSWORD")
         return
     
     try:
         # Initialize analyzer
-        analyzer = ForumTopicAnalyzerV2(db_config=db_config)
+        analyzer = ForumTopicAnalyzerV2(db_config=db_config, use_cache=not args.no_cache)
+        
+        if args.batch or args.batch_id:
+            from scripts.batch_analysis import BatchAnalysisRunner
+            
+            analyzer.connect_to_database()
+            analyzer.create_database_schema()
+            try:
+                runner = BatchAnalysisRunner(analyzer, model=args.model, poll_interval=args.poll_interval)
+                runner.run(max_topics=MAX_TOPICS, batch_id=args.batch_id)
+            finally:
+                analyzer.close_database_connection()
+            return
         
         # Run analysis with raw content storage
         results = analyzer.process_topics_with_raw_storage(
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Async Parallel Processor
+Saturates the OpenAI rate limit from a single process:
+- Claims topics from forum_analysis_queue with FOR UPDATE SKIP LOCKED (safe to run several copies)
+- Runs many analyses concurrently through AsyncOpenAI, bounded by a semaphore
+  and a tokens-per-minute budget
+- Reads and writes through the shared td_db connection pool, saving
+  finished analyses in batches through AnalysisWriter
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+# Add parent directory (and the repo root, for td_db) to path
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from scripts.analyze_forum_topics import ForumTopicAnalyzerV2
+from scripts.fixed_parallel import get_db_config, cleanup_incomplete_topics
+from topic_windows import merge_window_analyses
+from analysis_queue import claim_topics, ensure_queue_schema, mark_failed, release_stale_claims
+from analysis_writer import DEFAULT_FLUSH_SIZE, AnalysisWriter
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+import td_db
+
+# Load environment variables
+load_dotenv()
+
+# Rough chars-per-token ratio for budget reservations
+CHARS_PER_TOKEN = 4
+
+
+class TokensPerMinuteBudget:
+    """
+    Async token bucket for the OpenAI tokens-per-minute limit.
+    Callers reserve an estimate before the request and settle with the real usage after.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = float(tokens_per_minute)
+        self.available = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens):
+        """Wait until `tokens` fit in the budget (waiters are served in order)"""
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                await asyncio.sleep((tokens - self.available) / self.rate)
+
+    def settle(self, reserved, actual):
+        """Refund (or charge) the difference between the estimate and real usage"""
+        self.refill()
+        self.available = min(self.capacity, self.available + reserved - actual)
+
+
+class AsyncAnalysisRunner:
+    def __init__(self, db_config, model="gpt-4o-mini", concurrency=16, tokens_per_minute=200000,
+                 claim_batch_size=None, db_connections=4, max_topics=None, save_batch_size=DEFAULT_FLUSH_SIZE):
+        # The analyzer supplies prompt building, parsing and persistence helpers;
+        # it never opens its own connection here
+        self.analyzer = ForumTopicAnalyzerV2(db_config=db_config)
+        self.client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=5)
+        self.model = model
+        self.max_topics = max_topics
+        self.claim_batch_size = claim_batch_size or concurrency * 2
+        self.completion_token_estimate = 2000
+
+        # Two claim loops keep the pipeline full while the other batch drains its slowest topics.
+        # Claims are committed queue rows, so no connection is held while a batch runs.
+        self.claim_loops = 2
+        self.worker_name = f"async-{socket.gethostname()}-{os.getpid()}"
+        self.pool = td_db.get_pool(db_config, maxconn=db_connections)
+        self.db_slots = asyncio.Semaphore(db_connections)  # pool raises instead of blocking when exhausted
+        self.llm_slots = asyncio.Semaphore(concurrency)
+        self.budget = TokensPerMinuteBudget(tokens_per_minute)
+
+        self.writer = AnalysisWriter(flush_size=save_batch_size)
+        self.finished = {}  # topic_id -> (analysis, start_time) awaiting the next flush
+
+        self.claimed = 0
+        self.stats = {
+            'successful': 0,
+            'failed': 0,
+            'qa_pairs': 0,
+            'tokens_used': 0,
+            'categories': {},
+            'durations': []
+        }
+
+    def with_connection(self, func, *args):
+        """Run func(*args, connection=conn) on a pooled connection"""
+        connection = self.pool.getconn()
+        try:
+            return func(*args, connection=connection)
+        finally:
+            # Ends read transactions and clears any session state before reuse
+            self.pool.putconn(connection, close=not td_db.reset_session(connection))
+
+    async def run_db(self, func, *args):
+        async with self.db_slots:
+            return await asyncio.to_thread(self.with_connection, func, *args)
+
+    def claim_next_topics(self, limit, connection=None):
+        return claim_topics(connection, self.worker_name, limit)
+
+    def mark_failed(self, topic_id, error, connection=None):
+        mark_failed(connection, topic_id, error)
+
+    def save_analyses(self, analyses, connection=None):
+        return self.writer.save(connection, analyses)
+
+    async def record_failure(self, topic_id, error, start_time):
+        # Back to pending for another attempt, or parked as failed after MAX_ATTEMPTS
+        await self.run_db(self.mark_failed, topic_id, str(error))
+        self.stats['failed'] += 1
+        print(f"❌ Topic {topic_id}: {str(error)[:60]} ({time.time() - start_time:.1f}s)")
+
+    async def process_topic(self, topic_id):
+        start_time = time.time()
+        try:
+            cleaned_data = await self.run_db(self.analyzer.load_topic_for_analysis, topic_id)
+            if cleaned_data is None:
+                await self.record_failure(topic_id, 'Topic not found', start_time)
+                return
+
+            # Oversized topics become several windows that share the same slots and budget
+            message_sets = await asyncio.to_thread(
+                self.analyzer.plan_analysis_messages, topic_id, cleaned_data, self.model
+            )
+            results = await asyncio.gather(
+                *(self.analyze_window(topic_id, messages) for messages in message_sets),
+                return_exceptions=True
+            )
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                await self.record_failure(topic_id, errors[0], start_time)
+                return
+
+            await self.finish_topic(topic_id, merge_window_analyses(topic_id, results), start_time)
+
+        except Exception as e:
+            await self.record_failure(topic_id, e, start_time)
+
+    async def analyze_window(self, topic_id, messages):
+        """Analysis for one request's messages, from the cache or the API"""
+        cache_key, analysis = await self.run_db(self.analyzer.get_cached_analysis, topic_id, self.model, messages)
+        if analysis is not None:
+            return analysis
+
+        estimate = sum(len(m['content']) for m in messages) // CHARS_PER_TOKEN + self.completion_token_estimate
+
+        async with self.llm_slots:
+            await self.budget.acquire(estimate)
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.1  # Low temperature for consistent analysis
+                )
+            except Exception:
+                self.budget.settle(estimate, estimate)
+                raise
+            used = response.usage.total_tokens if response.usage else estimate
+            self.budget.settle(estimate, used)
+            self.stats['tokens_used'] += used
+
+        analysis = self.analyzer.parse_analysis_response(topic_id, response.choices[0].message.content)
+        if not analysis:
+            raise ValueError('Analysis returned None')
+
+        await self.run_db(self.analyzer.cache_analysis, cache_key, self.model, analysis)
+        return analysis
+
+    async def finish_topic(self, topic_id, analysis, start_time):
+        self.finished[topic_id] = (analysis, start_time)
+        if self.writer.add(topic_id, analysis):
+            await self.flush_analyses()
+
+    async def flush_analyses(self):
+        """Save every buffered analysis in one transaction"""
+        analyses = self.writer.drain()
+        if not analyses:
+            return
+        # Taken before awaiting so topics finishing meanwhile go into the next flush.
+        # finish_topic fills both buffers together, so this is exactly the drained topics.
+        finished, self.finished = self.finished, {}
+        saved, failed = await self.run_db(self.save_analyses, analyses)
+
+        for topic_id in saved:
+            analysis, start_time = finished[topic_id]
+            duration = time.time() - start_time
+            qa_count = len(analysis.get('qa_pairs', []))
+            category = analysis.get('topic_summary', {}).get('analysis_category', 'Unknown')
+            self.stats['successful'] += 1
+            self.stats['qa_pairs'] += qa_count
+            self.stats['categories'][category] = self.stats['categories'].get(category, 0) + 1
+            self.stats['durations'].append(duration)
+            print(f"✅ Topic {topic_id}: {qa_count} Q&A, {category}, {duration:.1f}s")
+
+        for topic_id, error in failed:
+            await self.record_failure(topic_id, f"Database save error: {error}", finished[topic_id][1])
+
+    async def claim_loop(self, loop_id):
+        while self.max_topics is None or self.claimed < self.max_topics:
+            limit = self.claim_batch_size
+            if self.max_topics is not None:
+                limit = min(limit, self.max_topics - self.claimed)
+
+            try:
+                topic_ids = await self.run_db(self.claim_next_topics, limit)
+            except Exception as e:
+                print(f"❌ Claim loop {loop_id} error: {e}")
+                return
+            if not topic_ids:
+                return
+
+            self.claimed += len(topic_ids)
+            print(f"🔒 Claim loop {loop_id}: claimed {len(topic_ids)} topics")
+
+            # Each topic leaves 'claimed' as it is saved (done) or fails (pending/failed)
+            await asyncio.gather(*(self.process_topic(topic_id) for topic_id in topic_ids))
+            await self.flush_analyses()
+
+    def prepare_queue(self, connection=None):
+        ensure_queue_schema(connection)
+        release_stale_claims(connection)
+
+    async def run(self):
+        start_time = time.time()
+        try:
+            await self.run_db(self.prepare_queue)
+            await asyncio.gather(*(self.claim_loop(i + 1) for i in range(self.claim_loops)))
+        finally:
+            await self.client.close()
+            td_db.close_pools()
+        return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async parallel forum topic analysis")
+    parser.add_argument("--model", default="gpt-4o-mini", help="OpenAI model (default: gpt-4o-mini)")
+    parser.add_argument("--concurrency", type=int, default=16,
+                       help="Max in-flight OpenAI requests (default: 16)")
+    parser.add_argument("--tokens-per-minute", type=int, default=200000,
+                       help="OpenAI TPM budget to stay under (default: 200000)")
+    parser.add_argument("--claim-batch-size", type=int,
+                       help="Topics locked per claim (default: 2 x concurrency)")
+    parser.add_argument("--db-connections", type=int, default=4,
+                       help="Pooled connections for reads/writes (default: 4)")
+    parser.add_argument("--max-topics", type=int, help="Stop after claiming this many topics")
+    parser.add_argument("--save-batch-size", type=int, default=DEFAULT_FLUSH_SIZE,
+                       help=f"Finished analyses saved per transaction (default: {DEFAULT_FLUSH_SIZE})")
+    args = parser.parse_args()
+
+    print("🚀 Async Parallel Processor with SKIP LOCKED claims")
+    print("=" * 50)
+    print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    if not os.getenv('OPENAI_API_KEY'):
+        print("❌ OpenAI API key required")
+        return
+
+    print(f"Model: {args.model}")
+    print(f"Concurrency: {args.concurrency}")
+    print(f"TPM budget: {args.tokens_per_minute:,}")
+    print("=" * 50)
+
+    # Cleanup incomplete topics first
+    cleanup_incomplete_topics()
+
+    runner = AsyncAnalysisRunner(
+        db_config=get_db_config(),
+        model=args.model,
+        concurrency=args.concurrency,
+        tokens_per_minute=args.tokens_per_minute,
+        claim_batch_size=args.claim_batch_size,
+        db_connections=args.db_connections,
+        max_topics=args.max_topics,
+        save_batch_size=args.save_batch_size
+    )
+    total_time = asyncio.run(runner.run())
+
+    stats = runner.stats
+    total_processed = stats['successful'] + stats['failed']
+
+    print(f"\n🎯 ASYNC PARALLEL PROCESSING COMPLETE")
+    print("=" * 45)
+    print(f"Duration: {total_time/60:.1f} minutes")
+    print(f"Topics processed: {total_processed:,}")
+    print(f"Successful: {stats['successful']:,}")
+    print(f"Failed: {stats['failed']:,}")
+    print(f"Q&A pairs extracted: {stats['qa_pairs']:,}")
+    print(f"Tokens used: {stats['tokens_used']:,} ({stats['tokens_used'] / max(total_time / 60, 1e-9):,.0f}/min)")
+    if runner.analyzer.analysis_cache:
+        print(runner.analyzer.analysis_cache.summary())
+
+    if stats['durations']:
+        print(f"Average latency per topic: {sum(stats['durations']) / len(stats['durations']):.1f}s")
+        print(f"Overall rate: {stats['successful'] / total_time:.2f} topics/sec")
+
+    if stats['categories']:
+        print(f"\n📂 Categories Processed:")
+        for cat, count in sorted(stats['categories'].items(), key=lambda x: x[1], reverse=True):
+            print(f"   {cat}: {count:,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+OpenAI Batch API mode for bulk forum topic analysis
+Writes one chat completion request per topic to a JSONL file, submits it to the
+Batch API (half price, 24h window), polls until done, then ingests the results
+through AnalysisWriter, many topics per transaction.
+
+Topics are claimed in forum_analysis_queue before their requests are written
+and stay claimed by batch-<batch id> until ingest marks them done or failed, so
+other runners don't analyze them again while the batch is running.
+
+Point OPENAI_BASE_URL at script-testing/openai_batch_stub.py to run end to end
+without touching the real API.
+"""
+
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.analyze_forum_topics import ForumTopicAnalyzerV2
+from topic_windows import merge_window_analyses
+from analysis_queue import BATCH_WORKER_PREFIX, claim_topics, mark_failed, reassign_claims, release_claims
+from analysis_writer import AnalysisWriter
+
+# Batch API limits per input file
+MAX_REQUESTS_PER_BATCH = 50000
+MAX_BYTES_PER_BATCH = 190 * 1024 * 1024  # API limit is 200 MB
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+# Ingested analyses saved per transaction
+SAVE_BATCH_SIZE = 100
+
+
+def make_custom_id(topic_id: int, part: int, total: int) -> str:
+    """topic-<id> for whole topics, topic-<id>-part-<n>-of-<total> for windows"""
+    if total == 1:
+        return f"topic-{topic_id}"
+    return f"topic-{topic_id}-part-{part}-of-{total}"
+
+
+def parse_custom_id(custom_id: str):
+    """Return (topic_id, part, total) from a custom_id"""
+    fields = custom_id.split('-')
+    if len(fields) == 6:
+        return int(fields[1]), int(fields[3]), int(fields[5])
+    return int(fields[1]), 1, 1
+
+
+class BatchAnalysisRunner:
+    def __init__(self, analyzer: ForumTopicAnalyzerV2, model: str = "gpt-4o-mini",
+                 output_dir: str = None, poll_interval: int = 60):
+        self.analyzer = analyzer
+        self.client = analyzer.openai_client
+        self.model = model
+        self.poll_interval = poll_interval
+        self.output_dir = Path(output_dir or Path(__file__).parent.parent / 'batch_jobs')
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.writer = AnalysisWriter(flush_size=SAVE_BATCH_SIZE)
+        # Claims are re-tagged with the batch id once each file is submitted
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.claim_worker = f"{BATCH_WORKER_PREFIX}{self.run_id}"
+        self.file_topics = {}  # request file -> topic ids written to it
+        self.stats = {
+            'requests_written': 0,
+            'cache_hits': 0,
+            'successful': 0,
+            'failed': 0,
+            'failed_topics': []
+        }
+
+    def get_topics_to_analyze(self, max_topics: int = None) -> List[int]:
+        """Claim pending topics from forum_analysis_queue, oldest first within a priority"""
+        return claim_topics(self.analyzer.db_connection, self.claim_worker,
+                            limit=max_topics, latest_first=False)
+
+    def write_request_files(self, topic_ids: List[int]) -> List[Path]:
+        """Write JSONL request files, splitting at the Batch API count/size limits"""
+        files = []
+        handle = None
+        count = size = 0
+
+        for topic_id in topic_ids:
+            try:
+                cleaned_data = self.analyzer.load_topic_for_analysis(topic_id)
+                if cleaned_data is None:
+                    self.record_failure(topic_id, "Topic not found in raw content table")
+                    continue
+
+                message_sets = self.analyzer.plan_analysis_messages(topic_id, cleaned_data, self.model)
+
+                # Unchanged topics already analyzed with this prompt/model never reach the batch
+                cached = [self.analyzer.get_cached_analysis(topic_id, self.model, messages)[1]
+                          for messages in message_sets]
+            except Exception as e:
+                # One bad topic goes back to the queue; the rest still make the batch
+                self.analyzer.db_connection.rollback()
+                self.record_failure(topic_id, f"Request build error: {e}")
+                continue
+
+            if all(analysis is not None for analysis in cached):
+                self.save_analysis(topic_id, merge_window_analyses(topic_id, cached))
+                self.stats['cache_hits'] += 1
+                continue
+
+            # All windows of a topic go in the same file so ingest can merge them
+            lines = [json.dumps({
+                'custom_id': make_custom_id(topic_id, part, len(message_sets)),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': self.model,
+                    'messages': messages,
+                    'temperature': 0.1
+                }
+            }) + '\n' for part, messages in enumerate(message_sets, 1)]
+            lines_bytes = sum(len(line.encode()) for line in lines)
+
+            if (handle is None or count + len(lines) > MAX_REQUESTS_PER_BATCH
+                    or size + lines_bytes > MAX_BYTES_PER_BATCH):
+                if handle:
+                    handle.close()
+                path = self.output_dir / f"forum_analysis_requests_{self.run_id}_{len(files) + 1}.jsonl"
+                handle = open(path, 'w', encoding='utf-8')
+                files.append(path)
+                self.file_topics[path] = []
+                count = size = 0
+
+            handle.writelines(lines)
+            self.file_topics[files[-1]].append(topic_id)
+            count += len(lines)
+            size += lines_bytes
+            self.stats['requests_written'] += len(lines)
+
+        if handle:
+            handle.close()
+        self.flush_saves()
+        return files
+
+    def submit(self, request_file: Path) -> str:
+        """Upload a request file and create the batch; returns the batch id"""
+        with open(request_file, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose='batch')
+
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+            metadata={'description': f"forum topic analysis ({request_file.name})"}
+        )
+        print(f"📤 Submitted {request_file.name} as batch {batch.id}")
+        reassign_claims(self.analyzer.db_connection, self.file_topics.get(request_file, []),
+                        f"{BATCH_WORKER_PREFIX}{batch.id}")
+        return batch.id
+
+    def wait_for_batch(self, batch_id: str):
+        """Poll until the batch reaches a terminal status"""
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            progress = f"{counts.completed}/{counts.total} done, {counts.failed} failed" if counts else ""
+            print(f"⏳ Batch {batch_id}: {batch.status} {progress}")
+
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            time.sleep(self.poll_interval)
+
+    def record_failure(self, topic_id, reason: str):
+        mark_failed(self.analyzer.db_connection, topic_id, reason)
+        self.stats['failed'] += 1
+        self.stats['failed_topics'].append({'topic_id': topic_id, 'failure_reason': reason})
+        print(f"  ❌ FAILURE: Topic {topic_id}: {reason}")
+
+    def save_analysis(self, topic_id, analysis: dict):
+        """Buffer an analysis; existing analysis of the topic is replaced on flush"""
+        if self.writer.add(topic_id, analysis):
+            self.flush_saves()
+
+    def flush_saves(self):
+        saved, failed = self.writer.flush(self.analyzer.db_connection)
+        self.stats['successful'] += len(saved)
+        for topic_id, error in failed:
+            self.record_failure(topic_id, f"Database save error: {error}")
+
+    def get_requests(self, batch) -> List[dict]:
+        """The batch's input requests (works when resuming too)"""
+        text = self.client.files.content(batch.input_file_id).text
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def get_request_cache_keys(self, requests: List[dict]) -> Dict[str, str]:
+        """custom_id -> cache key for every request"""
+        if not self.analyzer.analysis_cache:
+            return {}
+        return {
+            request['custom_id']: self.analyzer.analysis_cache.make_key(
+                request['body']['model'], request['body']['messages']
+            )
+            for request in requests
+        }
+
+    def ingest_results(self, batch) -> Dict:
+        """
+        Parse the batch output file, merge windows per topic, and save every analysis.
+        Saved topics are marked done; topics that errored or got no result
+        (expired or cancelled batch) go back to the queue through mark_failed.
+        """
+        requests = self.get_requests(batch)
+        requested = {parse_custom_id(request['custom_id'])[0] for request in requests}
+        windows = {}  # topic_id -> {part: analysis}
+        totals = {}
+        failed = set()
+
+        def fail(topic_id, reason):
+            if topic_id not in failed:
+                failed.add(topic_id)
+                self.record_failure(topic_id, reason)
+
+        if batch.output_file_id:
+            cache_keys = self.get_request_cache_keys(requests)
+
+            output = self.client.files.content(batch.output_file_id).text
+            (self.output_dir / f"{batch.id}_output.jsonl").write_text(output, encoding='utf-8')
+
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                topic_id, part, total = parse_custom_id(result['custom_id'])
+                totals[topic_id] = total
+                response = result.get('response') or {}
+
+                if result.get('error') or response.get('status_code') != 200:
+                    fail(topic_id, f"Batch request error: {result.get('error') or response.get('body')}")
+                    continue
+
+                content = response['body']['choices'][0]['message']['content']
+                analysis = self.analyzer.parse_analysis_response(topic_id, content)
+                if not analysis:
+                    fail(topic_id, "JSON parsing error")
+                    continue
+
+                self.analyzer.cache_analysis(cache_keys.get(result['custom_id']), self.model, analysis)
+                windows.setdefault(topic_id, {})[part] = analysis
+
+        if batch.error_file_id:
+            errors = self.client.files.content(batch.error_file_id).text
+            for line in errors.splitlines():
+                if line.strip():
+                    result = json.loads(line)
+                    topic_id, _, _ = parse_custom_id(result['custom_id'])
+                    fail(topic_id, f"Batch request error: {result.get('error') or result.get('response')}")
+
+        for topic_id, parts in windows.items():
+            if topic_id in failed:
+                continue
+            if len(parts) < totals[topic_id]:
+                fail(topic_id, f"Only {len(parts)}/{totals[topic_id]} windows returned")
+                continue
+            self.save_analysis(topic_id, merge_window_analyses(topic_id, [parts[part] for part in sorted(parts)]))
+
+        for topic_id in sorted(requested - set(windows)):
+            fail(topic_id, f"No result returned (batch {batch.status})")
+
+        self.flush_saves()
+        return self.stats
+
+    def run(self, max_topics: int = None, batch_id: Optional[str] = None) -> Dict:
+        """Submit a new batch (or resume an existing one by id), wait, and ingest"""
+        if batch_id:
+            batch_ids = [batch_id]
+        else:
+            topic_ids = self.get_topics_to_analyze(max_topics)
+            print(f"Found {len(topic_ids)} topics to analyze")
+            if not topic_ids:
+                return self.stats
+
+            try:
+                request_files = self.write_request_files(topic_ids)
+            except Exception:
+                # Nothing was submitted; don't leave topics held for BATCH_CLAIM_HOURS
+                self.analyzer.db_connection.rollback()
+                released = release_claims(self.analyzer.db_connection, self.claim_worker)
+                print(f"❌ Writing batch requests failed - released {released} claimed topics")
+                raise
+            print(f"⚡ {self.stats['cache_hits']} topics served from the analysis cache")
+            print(f"📝 Wrote {self.stats['requests_written']} requests to {len(request_files)} file(s)")
+            batch_ids = []
+            for path in request_files:
+                try:
+                    batch_ids.append(self.submit(path))
+                except Exception as e:
+                    for topic_id in self.file_topics[path]:
+                        self.record_failure(topic_id, f"Batch submit error: {e}")
+            if not batch_ids:
+                return self.stats
+            print(f"   Resume later with: --batch-id <id>  ({', '.join(batch_ids)})")
+
+        for current_id in batch_ids:
+            batch = self.wait_for_batch(current_id)
+            if batch.status != 'completed':
+                print(f"⚠️  Batch {current_id} ended with status {batch.status} - ingesting any partial output")
+            self.ingest_results(batch)
+
+        print(f"\n🏁 BATCH ANALYSIS COMPLETE")
+        print(f"  ✅ Successful analyses: {self.stats['successful']}")
+        print(f"  ❌ Failed analyses: {self.stats['failed']}")
+        if self.analyzer.analysis_cache:
+            print(f"  ⚡ {self.analyzer.analysis_cache.summary()}")
+        return self.stats
@@ -2,35 +2,64 @@
 """
 Forum Analysis Pipeline - Step 3: Create Embeddings
 Creates vector embeddings from Q&A pairs for similarity search
+
+Q&A pairs stream from a server-side cursor into multi-input embeddings
+requests (bounded by input count and estimated tokens), several requests run at
+once, and each batch is stored with one multi-row upsert. Texts embedded before
+(by this or any other producer) come from the shared embedding_cache instead of the API.
+The forum_embeddings ANN index is checked once a run has stored embeddings;
+--build-index checks content_embeddings and forum_embeddings on demand.
 """
 
 import os
 import sys
 import time
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
 import openai
-from typing import List, Dict, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Optional
 import argparse
+from pathlib import Path
+
+# Add parent directory (and the repo root, for td_db and td_embeddings) to path for shared modules
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from vector_index import HNSW_EF_SEARCH, IVFFLAT_PROBES, VectorIndexManager
+from td_embeddings import EmbeddingClient, PostgresEmbeddingCache
+import td_db
 
 # Load environment variables
 load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Per-request limits: the API takes up to 2048 inputs and 300k tokens per call
+DEFAULT_BATCH_SIZE = 256
+MAX_BATCH_TOKENS = 200000
+MAX_INPUT_TOKENS = 8000
+DEFAULT_CONCURRENCY = 4
+
+# Rows fetched per round trip from the server-side cursor
+STREAM_CHUNK_ROWS = 2000
+
+# Rough chars-per-token ratio for batch sizing (same estimate as the async analyzer)
+CHARS_PER_TOKEN = 4
+
 class ForumEmbeddingsCreator:
     def __init__(self, db_config: Dict, openai_api_key: Optional[str] = None):
         self.db_config = db_config
         self.db_connection = None
+        self.embedder = None
         
-        # OpenAI setup
+        # OpenAI setup; the client backs off and retries on 429s itself
         self.openai_client = openai.OpenAI(
-            api_key=openai_api_key or os.getenv('OPENAI_API_KEY')
+            api_key=openai_api_key or os.getenv('OPENAI_API_KEY'),
+            max_retries=5
         )
         
-        # Rate limiting
-        self.last_api_call = 0
-        self.min_api_interval = 0.1  # 10 requests per second max
-        
         # Statistics
         self.stats = {
             'embeddings_created': 0,
@@ -42,9 +71,15 @@ class ForumEmbeddingsCreator:
     def connect_db(self):
         """Connect to PostgreSQL database"""
         try:
-            self.db_connection = psycopg2.connect(**self.db_config)
+            self.db_connection = td_db.get_connection(self.db_config)
             print("✓ Connected to database")
             self.setup_embeddings_table()
+            # The cache commits on its own connection, shared by the embedding threads
+            self.embedder = EmbeddingClient(
+                EMBEDDING_MODEL,
+                cache=PostgresEmbeddingCache(td_db.get_connection(self.db_config)),
+                openai_client=self.openai_client
+            )
         except Exception as e:
             raise Exception(f"Failed to connect to database: {e}")
 
@@ -68,10 +103,6 @@ class ForumEmbeddingsCreator:
             UNIQUE(source, source_id, chunk_index)
         );
         
-        -- Create index for fast similarity search
-        CREATE INDEX IF NOT EXISTS idx_content_embeddings_similarity 
-        ON content_embeddings USING ivfflat (embedding vector_cosine_ops);
-        
         -- Create indexes for lookups
         CREATE INDEX IF NOT EXISTS idx_content_embeddings_source 
         ON content_embeddings(source, source_id);
@@ -84,18 +115,25 @@ class ForumEmbeddingsCreator:
             with self.db_connection.cursor() as cursor:
                 cursor.execute(schema_sql)
                 self.db_connection.commit()
-                print("✓ Embeddings table and indexes ready")
+            print("✓ Embeddings table and indexes ready")
         except Exception as e:
             self.db_connection.rollback()
             raise Exception(f"Failed to create embeddings table: {e}")
 
-    def get_qa_pairs_needing_embeddings(self) -> List[Dict]:
-        """Get Q&A pairs that don't have embeddings yet"""
+    def get_qa_pairs_needing_embeddings(self, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[Dict]:
+        """
+        Stream Q&A pairs that don't have embeddings yet through a named (server-side) cursor.
+        Runs on its own connection: committing stored embeddings on the main
+        connection would otherwise close the cursor mid-stream.
+        """
         if not self.db_connection:
-            return []
+            return
 
+        read_connection = None
         try:
-            with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            read_connection = td_db.get_connection(self.db_config)
+            with read_connection.cursor(name='qa_pairs_needing_embeddings', cursor_factory=RealDictCursor) as cursor:
+                cursor.itersize = chunk_rows
                 cursor.execute("""
                     SELECT fa.id, fa.question, fa.answer, fa.category
                     FROM forum_analysis fa
@@ -108,13 +146,13 @@ class ForumEmbeddingsCreator:
                     ORDER BY fa.id
                 """)
                 
-                qa_pairs = cursor.fetchall()
-                print(f"✓ Found {len(qa_pairs)} Q&A pairs needing embeddings")
-                return qa_pairs
+                yield from cursor
                 
         except Exception as e:
             print(f"Error fetching Q&A pairs: {e}")
-            return []
+        finally:
+            if read_connection:
+                read_connection.close()
 
     def format_qa_text(self, question: str, answer: str) -> str:
         """Format Q&A pair for embedding"""
@@ -122,111 +160,135 @@ class ForumEmbeddingsCreator:
         question = question.strip()
         answer = answer.strip()
         
-        # Format for embedding
+        # Format for embedding, cut to what one input may hold
         qa_text = f"Question: {question}\nAnswer: {answer}"
-        return qa_text
+        return qa_text[:MAX_INPUT_TOKENS * CHARS_PER_TOKEN]
 
-    def create_embedding(self, text: str) -> Optional[List[float]]:
-        """Create embedding using OpenAI API with rate limiting"""
-        # Rate limiting
-        current_time = time.time()
-        time_since_last_call = current_time - self.last_api_call
-        
-        if time_since_last_call < self.min_api_interval:
-            sleep_time = self.min_api_interval - time_since_last_call
-            time.sleep(sleep_time)
+    def iter_batches(self, qa_pairs: Iterable[Dict], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict]]:
+        """Group Q&A pairs into request-sized batches of {'analysis_id', 'qa_text'}"""
+        batch = []
+        batch_tokens = 0
+        for qa_pair in qa_pairs:
+            qa_text = self.format_qa_text(qa_pair['question'], qa_pair['answer'])
+            tokens = len(qa_text) // CHARS_PER_TOKEN + 1
+            if batch and (len(batch) >= batch_size or batch_tokens + tokens > MAX_BATCH_TOKENS):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append({'analysis_id': qa_pair['id'], 'qa_text': qa_text})
+            batch_tokens += tokens
+        if batch:
+            yield batch
 
+    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts (cache misses in one API call); results come back in input order"""
+        return self.embedder.embed_many(texts)
+
+    def create_embedding(self, text: str) -> Optional[List[float]]:
+        """Create embedding for a single text using OpenAI API"""
         try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
-            )
-            
-            self.last_api_call = time.time()
-            embedding = response.data[0].embedding
-            return embedding
-            
+            return self.create_embeddings([text])[0]
         except Exception as e:
             print(f"  ❌ OpenAI API error: {e}")
             self.stats['errors'] += 1
             return None
 
-    def store_embedding(self, analysis_id: int, qa_text: str, embedding: List[float]) -> bool:
-        """Store embedding in database"""
+    def store_embeddings(self, batch: List[Dict], embeddings: List[List[float]]) -> bool:
+        """Store a batch of embeddings with one multi-row upsert"""
         if not self.db_connection:
             return False
 
         try:
             with self.db_connection.cursor() as cursor:
-                cursor.execute("""
+                execute_values(cursor, """
                     INSERT INTO forum_embeddings (analysis_id, qa_text, embedding)
-                    VALUES (%s, %s, %s)
+                    VALUES %s
                     ON CONFLICT (analysis_id) DO UPDATE SET
                         qa_text = EXCLUDED.qa_text,
                         embedding = EXCLUDED.embedding,
                         created_at = NOW()
-                """, (analysis_id, qa_text, embedding))
+                """, [(item['analysis_id'], item['qa_text'], embedding)
+                      for item, embedding in zip(batch, embeddings)],
+                    template="(%s, %s, %s::vector)", page_size=len(batch))
                 
-                self.db_connection.commit()
-                return True
+            self.db_connection.commit()
+            return True
                 
         except Exception as e:
             self.db_connection.rollback()
             print(f"  ❌ Database error: {e}")
-            self.stats['errors'] += 1
+            self.stats['errors'] += len(batch)
             return False
 
-    def process_embeddings(self, max_items: Optional[int] = None):
+    def build_indexes(self):
+        """Build missing ANN indexes and rebuild IVFFlat indexes sized for a much smaller table"""
+        VectorIndexManager(self.db_connection, 'content_embeddings').ensure_index()
+        VectorIndexManager(self.db_connection, 'forum_embeddings', key_column='analysis_id').ensure_index()
+        print("✓ Vector indexes ready")
+
+    def process_embeddings(self, max_items: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                           concurrency: int = DEFAULT_CONCURRENCY):
         """Main processing method"""
         print("🚀 Starting embedding creation process...")
         
         start_time = time.time()
         
-        # Get Q&A pairs that need embeddings
-        qa_pairs = self.get_qa_pairs_needing_embeddings()
-        
-        if not qa_pairs:
-            print("✅ No Q&A pairs need embeddings - all done!")
-            return
-
-        self.stats['total_qa_pairs'] = len(qa_pairs)
+        # Q&A pairs that need embeddings, streamed so the first batch goes out immediately
+        qa_pair_stream = self.get_qa_pairs_needing_embeddings()
+        qa_pairs = qa_pair_stream
         
         # Limit processing if requested
-        if max_items and max_items < len(qa_pairs):
-            qa_pairs = qa_pairs[:max_items]
+        if max_items:
+            qa_pairs = islice(qa_pair_stream, max_items)
             print(f"🎯 Processing first {max_items} items (limited)")
 
-        # Process each Q&A pair
-        for i, qa_pair in enumerate(qa_pairs, 1):
-            analysis_id = qa_pair['id']
-            question = qa_pair['question']
-            answer = qa_pair['answer']
-            category = qa_pair['category'] or 'general'
-            
-            print(f"\n[{i}/{len(qa_pairs)}] Processing Q&A {analysis_id} ({category})")
-            print(f"  Q: {question[:80]}...")
-            
-            # Format text for embedding
-            qa_text = self.format_qa_text(question, answer)
-            
-            # Create embedding
-            embedding = self.create_embedding(qa_text)
+        print(f"⚡ Up to {batch_size} Q&A pairs per request, {concurrency} requests in flight")
+
+        # API calls run in worker threads; the single DB connection stays on this thread
+        processed = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = {}
+            batches = self.iter_batches(qa_pairs, batch_size)
             
-            if embedding:
-                # Store embedding
-                if self.store_embedding(analysis_id, qa_text, embedding):
-                    print(f"  ✅ Embedding created and stored")
-                    self.stats['embeddings_created'] += 1
-                else:
-                    print(f"  ❌ Failed to store embedding")
-            else:
-                print(f"  ❌ Failed to create embedding")
+            while True:
+                for batch in batches:
+                    in_flight[executor.submit(self.create_embeddings, [item['qa_text'] for item in batch])] = batch
+                    if len(in_flight) >= concurrency * 2:
+                        break
+                if not in_flight:
+                    break
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    processed += len(batch)
+                    try:
+                        embeddings = future.result()
+                    except Exception as e:
+                        print(f"  ❌ OpenAI API error for {len(batch)} Q&A pairs "
+                              f"(ids {batch[0]['analysis_id']}-{batch[-1]['analysis_id']}): {e}")
+                        self.stats['errors'] += len(batch)
+                        continue
+                    
+                    if self.store_embeddings(batch, embeddings):
+                        self.stats['embeddings_created'] += len(batch)
                 
-            # Progress update every 10 items
-            if i % 10 == 0:
                 elapsed = time.time() - start_time
-                rate = i / elapsed if elapsed > 0 else 0
-                print(f"\n📊 Progress: {i}/{len(qa_pairs)} ({(i/len(qa_pairs))*100:.1f}%) - {rate:.1f} embeddings/sec")
+                rate = processed / elapsed if elapsed > 0 else 0
+                print(f"📊 Progress: {processed} Q&A pairs - {rate:.1f} embeddings/sec")
+
+        # Ends the read transaction when --max-items stopped the stream early
+        qa_pair_stream.close()
+
+        # Only after a load: builds are slow and the new rows decide IVFFlat's lists
+        if self.stats['embeddings_created']:
+            VectorIndexManager(self.db_connection, 'forum_embeddings', key_column='analysis_id').ensure_index()
+
+        self.stats['total_qa_pairs'] = processed
+        if not processed:
+            print("✅ No Q&A pairs need embeddings - all done!")
+            self.db_connection.close()
+            return
 
         # Final statistics
         elapsed_time = time.time() - start_time
@@ -236,14 +298,15 @@ class ForumEmbeddingsCreator:
         print(f"Embeddings created: {self.stats['embeddings_created']}")
         print(f"Embeddings skipped: {self.stats['embeddings_skipped']}")
         print(f"Errors: {self.stats['errors']}")
+        print(f"Embedding cache: {self.embedder.summary()}")
         print(f"Time elapsed: {elapsed_time:.1f} seconds")
         
         if self.stats['embeddings_created'] > 0:
             rate = self.stats['embeddings_created'] / elapsed_time
             print(f"Processing rate: {rate:.2f} embeddings/second")
             
-            # Estimate OpenAI cost (rough estimate)
-            estimated_cost = self.stats['embeddings_created'] * 0.0001  # $0.0001 per 1K tokens
+            # Estimate OpenAI cost (rough estimate, cache hits are free)
+            estimated_cost = self.embedder.stats['tokens'] / 1000 * 0.0001  # $0.0001 per 1K tokens
             print(f"Estimated OpenAI cost: ${estimated_cost:.4f}")
 
         # Close database connection
@@ -251,8 +314,9 @@ class ForumEmbeddingsCreator:
             self.db_connection.close()
             print("Database connection closed")
 
-    def similarity_search_example(self, query_text: str, limit: int = 5):
-        """Example of how to perform similarity search"""
+    def similarity_search_example(self, query_text: str, limit: int = 5, ef_search: Optional[int] = None,
+                                  probes: Optional[int] = None):
+        """Example of how to perform similarity search (ef_search/probes trade speed for recall)"""
         print(f"\n🔍 Similarity search example for: '{query_text}'")
         
         # Create embedding for query
@@ -263,17 +327,18 @@ class ForumEmbeddingsCreator:
 
         try:
             with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                VectorIndexManager.apply_search_settings(cursor, ef_search=ef_search, probes=probes)
                 cursor.execute("""
                     SELECT 
                         fe.analysis_id,
                         fe.qa_text,
                         fa.category,
-                        1 - (fe.embedding <=> %s) AS similarity_score
+                        1 - (fe.embedding <=> %s::vector) AS similarity_score
                     FROM forum_embeddings fe
                     JOIN forum_analysis fa ON fe.analysis_id = fa.id
-                    ORDER BY fe.embedding <=> %s
+                    ORDER BY fe.embedding <=> %s::vector
                     LIMIT %s
-                """, (query_embedding, query_embedding, limit))
+                """, (str(query_embedding), str(query_embedding), limit))
                 
                 results = cursor.fetchall()
                 
@@ -290,21 +355,24 @@ def main():
     parser = argparse.ArgumentParser(description="Create embeddings for forum Q&A pairs")
     parser.add_argument("--max-items", type=int, help="Maximum number of items to process (for testing)")
     parser.add_argument("--test-search", help="Test similarity search with this query")
+    parser.add_argument("--ef-search", type=int,
+                       help=f"hnsw.ef_search for --test-search (pgvector default: {HNSW_EF_SEARCH})")
+    parser.add_argument("--probes", type=int,
+                       help=f"ivfflat.probes for --test-search (pgvector default: {IVFFLAT_PROBES})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                       help=f"Q&A pairs per embeddings request (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                       help=f"Embeddings requests in flight (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--build-index", action="store_true",
+                       help="Only build/refresh the vector indexes on content_embeddings and forum_embeddings")
     
     args = parser.parse_args()
     
     # Database configuration from environment
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
     # Validate configuration
-    if not all([db_config['host'], db_config['database'], db_config['user'], db_config['password']]):
+    if not td_db.config_is_complete(db_config):
         print("❌ Database configuration incomplete. Please set environment variables:")
         print("   Required: DB_HOST, DB_DATABASE, DB_USERNAME, DB_PASSWORD")
         sys.exit(1)
@@ -319,10 +387,13 @@ def main():
         
         if args.test_search:
             # Test similarity search
-            creator.similarity_search_example(args.test_search)
+            creator.similarity_search_example(args.test_search, ef_search=args.ef_search, probes=args.probes)
+        elif args.build_index:
+            creator.build_indexes()
         else:
             # Create embeddings
-            creator.process_embeddings(max_items=args.max_items)
+            creator.process_embeddings(max_items=args.max_items, batch_size=args.batch_size,
+                                       concurrency=args.concurrency)
         
         print("✅ Process completed successfully!")
         
@@ -346,6 +417,9 @@ if __name__ == "__main__":
 # Process only first 10 items (for testing):
 # python scripts/create_embeddings.py --max-items 10
 #
+# Build or refresh the vector indexes without embedding anything:
+# python scripts/create_embeddings.py --build-index
+#
 # Test similarity search:
 # python scripts/create_embeddings.py --test-search "How do I sync to Garmin?"
 #
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """
 Fixed Parallel Processor with Proper Database Locking
-Uses PostgreSQL advisory locks to ensure no race conditions
+Workers claim topics from forum_analysis_queue (FOR UPDATE SKIP LOCKED),
+so no two workers ever analyze the same topic
+Connections come from the shared td_db pool, so claiming, analyzing and
+releasing a topic reuses open connections instead of reconnecting each time
 """
 
 import os
@@ -13,83 +16,51 @@ from pathlib import Path
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Add parent directory to path
+# Add parent directory (and the repo root, for td_db) to path
 sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from scripts.analyze_forum_topics import ForumTopicAnalyzerV2
+from analysis_queue import (claim_topics, ensure_queue_schema, mark_failed, queue_counts,
+                            release_stale_claims, requeue_topics)
 from dotenv import load_dotenv
-import psycopg2
+import td_db
 from psycopg2.extras import RealDictCursor
 
 # Load environment variables
 load_dotenv()
 
 def get_db_config():
-    """Get database configuration"""
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
-    
-    return db_config
+    """Get database configuration (DB_SSLROOTCERT is resolved against this project)"""
+    return td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
 
 def get_and_lock_next_topic(worker_id):
     """
-    Get next unprocessed topic with PostgreSQL advisory lock
-    This ensures only one worker can process each topic
+    Claim the next pending topic from the analysis queue
+    The claim is committed immediately, so no connection is held during analysis
     """
     connection = None
     try:
-        connection = psycopg2.connect(**get_db_config())
-        connection.autocommit = True  # Important for advisory locks
+        connection = td_db.get_connection(get_db_config())
+        topic_ids = claim_topics(connection, f"fixed-worker-{worker_id}", limit=1)
+        if not topic_ids:
+            connection.close()
+            return None
         
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            # Use advisory lock with topic selection in one atomic operation
             cursor.execute("""
-                WITH candidate AS (
-                    SELECT r.topic_id, r.title, r.posts_count, r.created_at_original
-                    FROM forum_topics_raw r
-                    WHERE r.topic_id NOT IN (SELECT topic_id FROM forum_topics)
-                    AND (jsonb_array_length(COALESCE(r.raw_content -> 'posts', '[]'::jsonb)) > 0
-                         OR jsonb_array_length(COALESCE(r.raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
-                    ORDER BY r.topic_id DESC
-                    LIMIT 20
-                ),
-                locked_topic AS (
-                    SELECT c.*, pg_try_advisory_lock(c.topic_id) as got_lock
-                    FROM candidate c
-                    ORDER BY c.topic_id DESC
-                )
                 SELECT topic_id, title, posts_count, created_at_original
-                FROM locked_topic 
-                WHERE got_lock = true
-                LIMIT 1
-            """)
-            
+                FROM forum_topics_raw
+                WHERE topic_id = %s
+            """, (topic_ids[0],))
             result = cursor.fetchone()
-            
-            if result:
-                topic_id = result['topic_id']
-                print(f"Worker {worker_id}: 🔒 Locked topic {topic_id}")
-                
-                return {
-                    'topic': dict(result),
-                    'connection': connection,
-                    'locked_topic_id': topic_id
-                }
-            else:
-                connection.close()
-                return None
+        
+        print(f"Worker {worker_id}: 🔒 Claimed topic {topic_ids[0]}")
+        return {
+            'topic': dict(result),
+            'connection': connection,
+            'locked_topic_id': topic_ids[0]
+        }
                 
     except Exception as e:
         if connection:
@@ -97,17 +68,17 @@ def get_and_lock_next_topic(worker_id):
         print(f"Worker {worker_id}: ❌ Error getting topic: {e}")
         return None
 
-def release_topic_lock(connection, topic_id):
-    """Release the advisory lock for a topic"""
+def release_topic_lock(connection, topic_id, error=None):
+    """Return the claim connection to the pool; failed topics go back to the queue"""
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT pg_advisory_unlock(%s)", (topic_id,))
+        if error:
+            mark_failed(connection, topic_id, error)
         connection.close()
     except Exception as e:
-        print(f"⚠️ Error releasing lock for topic {topic_id}: {e}")
+        print(f"⚠️ Error releasing claim for topic {topic_id}: {e}")
 
 def process_locked_topic(worker_id, locked_data):
-    """Process a topic that has an advisory lock"""
+    """Process a topic claimed from the analysis queue"""
     if not locked_data:
         return {'success': False, 'error': 'No locked topic data', 'worker_id': worker_id}
     
@@ -120,36 +91,16 @@ def process_locked_topic(worker_id, locked_data):
     try:
         start_time = time.time()
         
-        # Double-check topic isn't already processed (final safety check)
-        check_connection = psycopg2.connect(**get_db_config())
-        with check_connection.cursor() as cursor:
-            cursor.execute("SELECT topic_id FROM forum_topics WHERE topic_id = %s", (topic_id,))
-            if cursor.fetchone():
-                check_connection.close()
-                release_topic_lock(lock_connection, topic_id)
-                return {
-                    'success': False,
-                    'topic_id': topic_id,
-                    'title': title,
-                    'error': 'Already processed (final check)',
-                    'duration': time.time() - start_time,
-                    'worker_id': worker_id
-                }
-        check_connection.close()
-        
         # Create analyzer for processing
         analyzer = ForumTopicAnalyzerV2(db_config=get_db_config())
         analyzer.connect_to_database()
         
-        # Clean any existing partial data
-        analyzer.delete_existing_analysis(topic_id)
-        
         # Perform analysis with fast model
         analysis = analyzer.analyze_stored_topic(topic_id, model="gpt-4o-mini")
         
         if analysis:
             # Save all analysis data atomically
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(topic_id, analysis)
             
             qa_count = len(analysis.get('qa_pairs', []))
             category = analysis.get('topic_summary', {}).get('analysis_category', 'Unknown')
@@ -175,9 +126,9 @@ def process_locked_topic(worker_id, locked_data):
                 'worker_id': worker_id
             }
         
-        # Cleanup
+        # Cleanup (save_analysis_to_database already marked successful topics done)
         analyzer.close_database_connection()
-        release_topic_lock(lock_connection, topic_id)
+        release_topic_lock(lock_connection, topic_id, result.get('error'))
         
         return result
         
@@ -191,13 +142,7 @@ def process_locked_topic(worker_id, locked_data):
             except:
                 pass
         
-        if 'check_connection' in locals():
-            try:
-                check_connection.close()
-            except:
-                pass
-        
-        release_topic_lock(lock_connection, topic_id)
+        release_topic_lock(lock_connection, topic_id, str(e))
         
         return {
             'success': False,
@@ -219,7 +164,7 @@ def worker_task(worker_id):
 def cleanup_incomplete_topics():
     """Clean up any incomplete topics before starting"""
     try:
-        connection = psycopg2.connect(**get_db_config())
+        connection = td_db.get_connection(get_db_config())
         with connection.cursor() as cursor:
             # Find incomplete topics
             cursor.execute("""
@@ -240,6 +185,7 @@ def cleanup_incomplete_topics():
                     cursor.execute("DELETE FROM forum_qa_pairs WHERE topic_id = %s", (topic_id,))
                     cursor.execute("DELETE FROM forum_topics WHERE topic_id = %s", (topic_id,))
                 
+                requeue_topics(cursor, [topic_id for topic_id, _ in incomplete])
                 connection.commit()
                 print(f"✅ Cleaned up {len(incomplete)} incomplete topics")
             else:
@@ -251,7 +197,7 @@ def cleanup_incomplete_topics():
         print(f"❌ Error during cleanup: {e}")
 
 def main():
-    print("🚀 Fixed Parallel Processor with Advisory Locks")
+    print("🚀 Fixed Parallel Processor with Queue Claims")
     print("=" * 50)
     print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
@@ -265,7 +211,7 @@ def main():
     
     print(f"Workers: {NUM_WORKERS}")
     print(f"Batch size: {BATCH_SIZE}")
-    print("Using PostgreSQL advisory locks for coordination")
+    print("Using forum_analysis_queue claims for coordination")
     print("=" * 50)
     
     # Cleanup incomplete topics first
@@ -273,19 +219,16 @@ def main():
     
     # Check status
     try:
-        connection = psycopg2.connect(**get_db_config())
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM forum_topics_raw")
-            total_raw = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM forum_topics")
-            processed = cursor.fetchone()[0]
-            
-            remaining = total_raw - processed
+        connection = td_db.get_connection(get_db_config())
+        ensure_queue_schema(connection)
+        release_stale_claims(connection)
+        counts = queue_counts(connection)
         connection.close()
         
-        print(f"Total topics: {total_raw:,}")
-        print(f"Already processed: {processed:,}")
+        remaining = counts.get('pending', 0)
+        print(f"Total topics: {sum(counts.values()):,}")
+        print(f"Already processed: {counts.get('done', 0):,}")
+        print(f"Failed after retries: {counts.get('failed', 0):,}")
         print(f"Remaining: {remaining:,}")
         
         if remaining == 0:
@@ -379,15 +322,8 @@ def main():
         
         # Update remaining count
         try:
-            connection = psycopg2.connect(**get_db_config())
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) FROM forum_topics_raw")
-                total_raw = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM forum_topics")
-                current_processed = cursor.fetchone()[0]
-                
-                remaining = total_raw - current_processed
+            connection = td_db.get_connection(get_db_config())
+            remaining = queue_counts(connection).get('pending', 0)
             connection.close()
         except Exception as e:
             print(f"Error updating count: {e}")
@@ -12,7 +12,6 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
 from openai import OpenAI
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
 # Load environment variables from .env file
@@ -29,6 +28,8 @@ except ImportError:
 
 # Import the main analyzer class
 sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+import td_db
 from analyze_forum_topics_v2 import ForumTopicAnalyzerV2
 
 class IncrementalForumAnalyzerV2(ForumTopicAnalyzerV2):
@@ -228,17 +229,13 @@ class IncrementalForumAnalyzerV2(ForumTopicAnalyzerV2):
                 content_changed = self.store_raw_topic(raw_content)
                 results["analysis_metadata"]["topics_stored_raw"] += 1
                 
-                # Step 2: If this is an update, delete existing analysis first
-                if reason in ['content_changed', 'force_reanalyze']:
-                    self.delete_existing_analysis(topic_id)
-                
-                # Step 3: Analyze from stored raw content
+                # Step 2-3: Analyze from stored raw content (saving replaces any existing analysis)
                 analysis = self.analyze_stored_topic(topic_id)
                 
                 if analysis:
                     # Step 4: Save analysis results
                     try:
-                        self.save_analysis_to_database(analysis)
+                        self.save_analysis_to_database(topic_id, analysis)
                         results["analysis_metadata"]["successful_analyses"] += 1
                         
                         # Track categories
@@ -321,21 +318,7 @@ def main():
         return
     
     # Database configuration
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    # Add SSL certificate if specified
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
     if not all([db_config['host'], db_config['database'], db_config['user'], db_config['password']]):
         print("Database configuration incomplete. Please check .env file.")
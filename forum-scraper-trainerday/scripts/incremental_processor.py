@@ -11,12 +11,14 @@ import argparse
 from pathlib import Path
 from datetime import datetime
 
-# Add parent directory to path
+# Add parent directory (and the repo root, for td_db) to path
 sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from scripts.analyze_forum_topics import ForumTopicAnalyzerV2
+from analysis_queue import ensure_queue_schema, mark_failed
 from dotenv import load_dotenv
-import psycopg2
+import td_db
 from psycopg2.extras import RealDictCursor
 
 # Load environment variables
@@ -25,23 +27,11 @@ load_dotenv()
 def get_topics_to_process(limit=100, latest_first=False, force_refresh=False):
     """Get topics that need processing"""
     
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
     try:
-        connection = psycopg2.connect(**db_config)
+        connection = td_db.get_connection(db_config)
+        ensure_queue_schema(connection)
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
             
             if force_refresh:
@@ -50,21 +40,18 @@ def get_topics_to_process(limit=100, latest_first=False, force_refresh=False):
                 cursor.execute(f"""
                     SELECT r.topic_id, r.title, r.posts_count, r.created_at_original
                     FROM forum_topics_raw r
-                    WHERE (jsonb_array_length(COALESCE(r.raw_content -> 'posts', '[]'::jsonb)) > 0
-                           OR jsonb_array_length(COALESCE(r.raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
+                    WHERE r.stored_post_count > 0
                     {order_clause}
                     LIMIT %s
                 """, (limit,))
             else:
-                # Get only unprocessed topics
-                order_clause = "ORDER BY r.topic_id DESC" if latest_first else "ORDER BY r.topic_id ASC"
+                # Get only unprocessed (or changed) topics from the analysis queue
+                order_clause = "ORDER BY q.priority DESC, q.topic_id DESC" if latest_first else "ORDER BY q.priority DESC, q.topic_id ASC"
                 cursor.execute(f"""
                     SELECT r.topic_id, r.title, r.posts_count, r.created_at_original
-                    FROM forum_topics_raw r
-                    LEFT JOIN forum_topics t ON r.topic_id = t.topic_id
-                    WHERE t.topic_id IS NULL
-                    AND (jsonb_array_length(COALESCE(r.raw_content -> 'posts', '[]'::jsonb)) > 0
-                         OR jsonb_array_length(COALESCE(r.raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
+                    FROM forum_analysis_queue q
+                    JOIN forum_topics_raw r ON r.topic_id = q.topic_id
+                    WHERE q.state = 'pending'
                     {order_clause}
                     LIMIT %s
                 """, (limit,))
@@ -76,9 +63,7 @@ def get_topics_to_process(limit=100, latest_first=False, force_refresh=False):
             analyzed = cursor.fetchone()['analyzed']
             
             cursor.execute("""
-                SELECT COUNT(*) as total FROM forum_topics_raw 
-                WHERE (jsonb_array_length(COALESCE(raw_content -> 'posts', '[]'::jsonb)) > 0
-                       OR jsonb_array_length(COALESCE(raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
+                SELECT COUNT(*) as total FROM forum_topics_raw WHERE stored_post_count > 0
             """)
             total = cursor.fetchone()['total']
             
@@ -92,20 +77,7 @@ def get_topics_to_process(limit=100, latest_first=False, force_refresh=False):
 def analyze_single_topic(topic_id, title):
     """Analyze a single topic and return results"""
     
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
     try:
         start_time = time.time()
@@ -114,15 +86,12 @@ def analyze_single_topic(topic_id, title):
         analyzer = ForumTopicAnalyzerV2(db_config=db_config)
         analyzer.connect_to_database()
         
-        # Clear existing analysis (important for force refresh)
-        analyzer.delete_existing_analysis(topic_id)
-        
         # Analyze topic
         analysis = analyzer.analyze_stored_topic(topic_id)
         
         if analysis:
             # Save to database
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(topic_id, analysis)
             
             # Extract results
             qa_count = len(analysis.get('qa_pairs', []))
@@ -139,6 +108,7 @@ def analyze_single_topic(topic_id, title):
                 'error': None
             }
         else:
+            mark_failed(analyzer.db_connection, topic_id, 'Analysis returned None')
             duration = time.time() - start_time
             analyzer.close_database_connection()
             return {
@@ -153,6 +123,7 @@ def analyze_single_topic(topic_id, title):
         duration = time.time() - start_time
         if 'analyzer' in locals():
             try:
+                mark_failed(analyzer.db_connection, topic_id, e)
                 analyzer.close_database_connection()
             except:
                 pass
@@ -8,12 +8,13 @@ import os
 import sys
 from pathlib import Path
 
-# Add parent directory to path
+# Add parent directory (and the repo root, for td_db) to path
 sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from scripts.analyze_forum_topics import ForumTopicAnalyzerV2
 from dotenv import load_dotenv
-import psycopg2
+import td_db
 from psycopg2.extras import RealDictCursor
 
 # Load environment variables
@@ -22,32 +23,17 @@ load_dotenv()
 def get_latest_unprocessed_topic():
     """Get the latest unprocessed topic"""
     
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
     try:
-        connection = psycopg2.connect(**db_config)
+        connection = td_db.get_connection(db_config)
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute("""
                 SELECT r.topic_id, r.title, r.posts_count, r.created_at_original
-                FROM forum_topics_raw r
-                LEFT JOIN forum_topics t ON r.topic_id = t.topic_id
-                WHERE t.topic_id IS NULL
-                AND (jsonb_array_length(COALESCE(r.raw_content -> 'posts', '[]'::jsonb)) > 0
-                     OR jsonb_array_length(COALESCE(r.raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
-                ORDER BY r.topic_id DESC
+                FROM forum_analysis_queue q
+                JOIN forum_topics_raw r ON r.topic_id = q.topic_id
+                WHERE q.state = 'pending'
+                ORDER BY q.priority DESC, q.topic_id DESC
                 LIMIT 1
             """)
             
@@ -88,20 +74,7 @@ def main():
     print()
     
     # Use the same analysis approach as the working single topic analyzer
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
     try:
         import time
@@ -111,12 +84,10 @@ def main():
         
         analyzer = ForumTopicAnalyzerV2(db_config=db_config)
         analyzer.connect_to_database()
-        analyzer.delete_existing_analysis(topic_id)
-        
         analysis = analyzer.analyze_stored_topic(topic_id)
         
         if analysis:
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(topic_id, analysis)
             qa_count = len(analysis.get('qa_pairs', []))
             category = analysis.get('topic_summary', {}).get('analysis_category', 'Unknown')
             
@@ -5,11 +5,15 @@ View analysis results and raw content stored in PostgreSQL.
 """
 
 import os
+import sys
 import json
 from pathlib import Path
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# Repo root, for the shared database module
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+import td_db
+
 # Load environment variables
 try:
     from dotenv import load_dotenv
@@ -22,23 +26,9 @@ except ImportError:
 
 def connect_to_database():
     """Connect to PostgreSQL database."""
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    # Add SSL certificate if specified
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
+    db_config = td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
     
-    return psycopg2.connect(**db_config)
+    return td_db.get_connection(db_config)
 
 def safe_json_parse(data):
     """Safely parse JSON data that might be string or already parsed."""
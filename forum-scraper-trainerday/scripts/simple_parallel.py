@@ -10,48 +10,33 @@ from pathlib import Path
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Add parent directory to path
+# Add parent directory (and the repo root, for td_db) to path
 sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from scripts.analyze_forum_topics import ForumTopicAnalyzerV2
 from dotenv import load_dotenv
-import psycopg2
+import td_db
 from psycopg2.extras import RealDictCursor
 
 # Load environment variables
 load_dotenv()
 
 def get_db_config():
-    """Get database configuration"""
-    db_config = {
-        'host': os.getenv('DB_HOST'),
-        'port': int(os.getenv('DB_PORT', 5432)),
-        'database': os.getenv('DB_DATABASE'),
-        'user': os.getenv('DB_USERNAME'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': os.getenv('DB_SSLMODE', 'require')
-    }
-    
-    if os.getenv('DB_SSLROOTCERT'):
-        ssl_cert_filename = os.getenv('DB_SSLROOTCERT')
-        ssl_cert_path = Path(__file__).parent.parent / ssl_cert_filename
-        if ssl_cert_path.exists():
-            db_config['sslrootcert'] = str(ssl_cert_path)
-    
-    return db_config
+    """Get database configuration (DB_SSLROOTCERT is resolved against this project)"""
+    return td_db.get_db_config(search_dirs=[Path(__file__).parent.parent])
 
 def get_next_unprocessed_topic():
     """Get next unprocessed topic"""
     try:
-        connection = psycopg2.connect(**get_db_config())
+        connection = td_db.get_connection(get_db_config())
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute("""
                 SELECT r.topic_id, r.title, r.posts_count, r.created_at_original
-                FROM forum_topics_raw r
-                WHERE r.topic_id NOT IN (SELECT topic_id FROM forum_topics)
-                AND (jsonb_array_length(COALESCE(r.raw_content -> 'posts', '[]'::jsonb)) > 0
-                     OR jsonb_array_length(COALESCE(r.raw_content -> 'post_stream' -> 'posts', '[]'::jsonb)) > 0)
-                ORDER BY r.topic_id DESC
+                FROM forum_analysis_queue q
+                JOIN forum_topics_raw r ON r.topic_id = q.topic_id
+                WHERE q.state = 'pending'
+                ORDER BY q.priority DESC, q.topic_id DESC
                 LIMIT 1
             """)
             
@@ -127,7 +112,7 @@ def main():
     
     # Check current status
     try:
-        connection = psycopg2.connect(**get_db_config())
+        connection = td_db.get_connection(get_db_config())
         with connection.cursor() as cursor:
             cursor.execute("SELECT COUNT(*) FROM forum_topics_raw")
             total_raw = cursor.fetchone()[0]
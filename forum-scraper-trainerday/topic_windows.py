@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Token-aware splitting of long forum topics for LLM analysis.
+Topics that fit the per-request budget go out as a single request, exactly as
+before. Longer threads are split into overlapping windows of whole posts, each
+analyzed on its own, and the window analyses are merged back into one result
+in the shape save_analysis_to_database expects.
+"""
+
+import copy
+import json
+from collections import Counter
+from typing import List
+
+import tiktoken
+
+# Input context per model; unknown models get the gpt-4o size
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4o-mini': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1-mini': 1047576,
+    'gpt-4.1': 1047576,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 128000
+
+# Topic tokens per window. Completion time grows with the size of the thread,
+# so windows stay well below the context limit to keep latency bounded.
+DEFAULT_WINDOW_TOKENS = 6000
+COMPLETION_RESERVE_TOKENS = 4000
+OVERLAP_POSTS = 2
+
+PRIORITY_LEVELS = {'low': 0, 'medium': 1, 'high': 2}
+
+
+def get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+def context_tokens_for_model(model: str) -> int:
+    # Longest prefix wins so 'gpt-4o-mini-2024-07-18' maps to gpt-4o-mini, not gpt-4
+    for name in sorted(MODEL_CONTEXT_TOKENS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_CONTEXT_TOKENS[name]
+    return DEFAULT_CONTEXT_TOKENS
+
+
+class TopicWindowPlanner:
+    def __init__(self, model: str = "gpt-4o-mini", window_tokens: int = DEFAULT_WINDOW_TOKENS,
+                 overlap_posts: int = OVERLAP_POSTS):
+        self.model = model
+        self.encoding = get_encoding(model)
+        self.window_tokens = window_tokens
+        self.overlap_posts = overlap_posts
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def topic_budget(self, prompt_tokens: int) -> int:
+        """Tokens left for topic JSON in one request"""
+        available = context_tokens_for_model(self.model) - prompt_tokens - COMPLETION_RESERVE_TOKENS
+        return max(1000, min(self.window_tokens, available))
+
+    def truncate_post(self, post: dict, max_tokens: int) -> dict:
+        """Cut a single post that can't fit any window on its own"""
+        tokens = self.encoding.encode(post.get('content') or '', disallowed_special=())
+        truncated = dict(post)
+        truncated['content'] = self.encoding.decode(tokens[:max_tokens]) + ' [truncated]'
+        return truncated
+
+    def plan(self, cleaned_data: dict, prompt_tokens: int) -> List[dict]:
+        """
+        Split cleaned topic data into windows of whole posts.
+        Returns [cleaned_data] unchanged when the topic fits in one request.
+        Later windows repeat the last few posts of the previous one for context;
+        those post numbers are listed under window.context_only_post_numbers.
+        """
+        budget = self.topic_budget(prompt_tokens)
+        if self.count_tokens(json.dumps(cleaned_data, indent=2)) <= budget:
+            return [cleaned_data]
+
+        posts = cleaned_data.get('posts', [])
+        header_tokens = self.count_tokens(json.dumps({**cleaned_data, 'posts': []}, indent=2)) + 100
+        post_budget = max(200, budget - header_tokens)
+
+        # Tokenize every post once; window sizes are then simple sums
+        sized_posts = []
+        for post in posts:
+            tokens = self.count_tokens(json.dumps(post, indent=2))
+            if tokens > post_budget:
+                post = self.truncate_post(post, post_budget - 100)
+                tokens = self.count_tokens(json.dumps(post, indent=2))
+            sized_posts.append((post, tokens))
+
+        spans = []
+        start = 0
+        while start < len(sized_posts):
+            end = start
+            used = 0
+            while end < len(sized_posts) and (end == start or used + sized_posts[end][1] <= post_budget):
+                used += sized_posts[end][1]
+                end += 1
+            spans.append((start, end))
+            if end >= len(sized_posts):
+                break
+            # Step back for overlap only while the next new post still fits alongside it
+            next_start = end
+            overlap_used = 0
+            while (end - next_start < self.overlap_posts and next_start - 1 > start
+                   and overlap_used + sized_posts[next_start - 1][1] + sized_posts[end][1] <= post_budget):
+                next_start -= 1
+                overlap_used += sized_posts[next_start][1]
+            start = next_start
+
+        windows = []
+        previous_end = 0
+        for index, (start, end) in enumerate(spans):
+            window = copy.copy(cleaned_data)
+            window['posts'] = [post for post, _ in sized_posts[start:end]]
+            window['window'] = {
+                'part': index + 1,
+                'of': len(spans),
+                'context_only_post_numbers': [
+                    post.get('post_number') for post, _ in sized_posts[start:min(previous_end, end)]
+                ]
+            }
+            windows.append(window)
+            previous_end = end
+        return windows
+
+
+def window_instructions(window: dict) -> str:
+    """Extra prompt text telling the model which slice of the thread it sees"""
+    info = window['window']
+    text = (f"NOTE: This topic is too long for one request. You are seeing part {info['part']} "
+            f"of {info['of']} (posts {window['posts'][0].get('post_number')}-"
+            f"{window['posts'][-1].get('post_number')}). Analyze only this part; ")
+    if info['context_only_post_numbers']:
+        text += (f"posts {info['context_only_post_numbers']} were already covered by the previous part "
+                 f"and are included only for context - do not extract Q&A pairs whose question is in them; ")
+    return text + "topic_summary should still describe the whole topic.\n\n"
+
+
+def _unique(items):
+    seen = set()
+    result = []
+    for item in items:
+        key = json.dumps(item, sort_keys=True) if isinstance(item, (dict, list)) else str(item).strip().lower()
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+def _merge_list_fields(sections: List[dict]) -> dict:
+    """Union list fields across windows; keep the first non-empty scalar"""
+    merged = {}
+    for section in sections:
+        for key, value in (section or {}).items():
+            if isinstance(value, list):
+                merged[key] = _unique(merged.get(key, []) + value)
+            elif key not in merged or not merged[key]:
+                merged[key] = value
+    return merged
+
+
+def merge_window_analyses(topic_id: int, analyses: List[dict]) -> dict:
+    """Combine per-window analyses (in window order) into one topic analysis"""
+    if len(analyses) == 1:
+        # Stamped here too, so older cached analyses carrying the model's id get the real one
+        analysis = dict(analyses[0])
+        analysis['topic_summary'] = {**analysis.get('topic_summary', {}), 'topic_id': topic_id}
+        return analysis
+
+    summary = dict(analyses[0].get('topic_summary', {}))
+    summary['topic_id'] = topic_id
+    summary['total_posts'] = max((a.get('topic_summary', {}).get('total_posts') or 0) for a in analyses)
+    categories = Counter(a.get('topic_summary', {}).get('analysis_category') for a in analyses)
+    categories.pop(None, None)
+    if categories:
+        # Majority vote; ties go to the earliest window, which holds the opening question
+        first = analyses[0].get('topic_summary', {}).get('analysis_category')
+        best = max(categories.values())
+        summary['analysis_category'] = first if categories.get(first) == best else categories.most_common(1)[0][0]
+
+    qa_pairs = []
+    seen_questions = set()
+    for analysis in analyses:
+        for qa_pair in analysis.get('qa_pairs', []):
+            question = ' '.join(((qa_pair.get('question') or {}).get('content') or '').lower().split())
+            if question and question in seen_questions:
+                continue  # extracted twice from an overlapping post
+            seen_questions.add(question)
+            qa_pair = dict(qa_pair)
+            qa_pair['sequence'] = len(qa_pairs) + 1
+            qa_pairs.append(qa_pair)
+
+    priority = {}
+    for analysis in analyses:
+        for key, value in (analysis.get('priority_score') or {}).items():
+            if PRIORITY_LEVELS.get(value, -1) > PRIORITY_LEVELS.get(priority.get(key), -1):
+                priority[key] = value
+
+    return {
+        'topic_summary': summary,
+        'qa_pairs': qa_pairs,
+        'user_voice_patterns': _merge_list_fields([a.get('user_voice_patterns') for a in analyses]),
+        'platform_voice_patterns': _merge_list_fields([a.get('platform_voice_patterns') for a in analyses]),
+        'key_insights': _merge_list_fields([a.get('key_insights') for a in analyses]),
+        'priority_score': priority
+    }
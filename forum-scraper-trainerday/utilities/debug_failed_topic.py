@@ -49,7 +49,7 @@ def main():
             
             # Try to save it
             print("\nSaving analysis to database...")
-            analyzer.save_analysis_to_database(analysis)
+            analyzer.save_analysis_to_database(29, analysis)
             print("✅ Analysis saved successfully!")
             
         else:
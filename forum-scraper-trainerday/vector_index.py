@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+pgvector index management for embedding tables (content_embeddings by default).
+An IVFFlat index created on an empty table gets its lists from nothing and is
+never retrained, so recall degrades as rows are loaded. This builds HNSW (or
+IVFFlat with lists sized from the current row count) after bulk loads, applies
+ef_search / probes per query, and measures recall@k against exact search.
+
+Indexes are built with CREATE INDEX CONCURRENTLY, and the new index is in place
+before the old one is dropped, so searches and writes keep going during a build.
+
+Usage:
+    python vector_index.py --build hnsw --m 16 --ef-construction 64
+    python vector_index.py --build ivfflat
+    python vector_index.py --recall --k 10 --sample 50 --ef-search 40 100 200
+    python vector_index.py --recall --probes 1 10 30
+"""
+
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+# Repo root, for the shared database module
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import td_db
+
+load_dotenv()
+
+DEFAULT_TABLE = 'content_embeddings'
+DEFAULT_COLUMN = 'embedding'
+OPERATOR_CLASS = 'vector_cosine_ops'  # all searches here use <=> (cosine distance)
+
+# pgvector defaults
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 40
+IVFFLAT_PROBES = 1
+
+# An IVFFlat index is rebuilt once the table has grown this much since it was sized
+IVFFLAT_REBUILD_GROWTH = 2.0
+
+
+def ivfflat_lists_for_rows(row_count: int) -> int:
+    """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if row_count <= 1000000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def ivfflat_probes_for_lists(lists: int) -> int:
+    """A starting point for probes: sqrt(lists)"""
+    return max(1, int(math.sqrt(lists)))
+
+
+class VectorIndexManager:
+    def __init__(self, connection, table: str = DEFAULT_TABLE, column: str = DEFAULT_COLUMN,
+                 key_column: str = 'id'):
+        self.connection = connection
+        self.table = table
+        self.column = column
+        self.key_column = key_column
+        self.index_name = f"idx_{table}_{column}_ann"
+
+    def row_count(self) -> int:
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(self.table)))
+            return cursor.fetchone()[0]
+
+    def current_indexes(self) -> List[Dict]:
+        """ANN indexes on the table: [{'name', 'method', 'lists'}]"""
+        with self.connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT indexname, indexdef FROM pg_indexes
+                WHERE tablename = %s AND (indexdef ILIKE '%%USING hnsw%%' OR indexdef ILIKE '%%USING ivfflat%%')
+            """, (self.table,))
+            indexes = []
+            for name, definition in cursor.fetchall():
+                method = 'hnsw' if 'USING hnsw' in definition else 'ivfflat'
+                lists = None
+                if method == 'ivfflat' and 'lists=' in definition.replace(' ', ''):
+                    lists = int(definition.replace(' ', '').split('lists=')[1].split(')')[0].strip("'"))
+                indexes.append({'name': name, 'method': method, 'lists': lists})
+            return indexes
+
+    def build(self, method: str = 'hnsw', m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+              lists: Optional[int] = None, maintenance_work_mem: str = '512MB') -> Dict:
+        """Build one ANN index concurrently, then drop the existing ANN indexes it replaces"""
+        rows = self.row_count()
+        if method == 'hnsw':
+            options = sql.SQL("WITH (m = {}, ef_construction = {})").format(sql.Literal(m), sql.Literal(ef_construction))
+            detail = f"m={m}, ef_construction={ef_construction}"
+        elif method == 'ivfflat':
+            lists = lists or ivfflat_lists_for_rows(rows)
+            options = sql.SQL("WITH (lists = {})").format(sql.Literal(lists))
+            detail = f"lists={lists}, suggested probes={ivfflat_probes_for_lists(lists)}"
+        else:
+            raise ValueError(f"Unknown index method: {method}")
+
+        old_indexes = [index['name'] for index in self.current_indexes()]
+        # Built under a second name while the current index keeps serving searches
+        build_name = f"{self.index_name}_new" if self.index_name in old_indexes else self.index_name
+
+        print(f"🔨 Building {method} index on {self.table}.{self.column} ({rows:,} rows, {detail})")
+        start_time = time.time()
+        # CONCURRENTLY can't run inside a transaction block
+        self.connection.commit()
+        autocommit = self.connection.autocommit
+        self.connection.autocommit = True
+        try:
+            with self.connection.cursor() as cursor:
+                # Graph/cluster builds are much faster when they fit in memory
+                cursor.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+                # Connections from td_db may carry a statement timeout meant for ordinary queries
+                cursor.execute("SET statement_timeout = 0")
+                try:
+                    if build_name in old_indexes:
+                        # Left INVALID by an interrupted concurrent build
+                        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(build_name)))
+                    cursor.execute(sql.SQL("CREATE INDEX CONCURRENTLY {} ON {} USING {} ({} {}) {}").format(
+                        sql.Identifier(build_name), sql.Identifier(self.table), sql.SQL(method),
+                        sql.Identifier(self.column), sql.SQL(OPERATOR_CLASS), options
+                    ))
+                except Exception:
+                    # A failed concurrent build leaves an INVALID index behind
+                    cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(build_name)))
+                    raise
+                for name in old_indexes:
+                    if name != build_name:
+                        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+                if build_name != self.index_name:
+                    cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        sql.Identifier(build_name), sql.Identifier(self.index_name)
+                    ))
+                cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(self.table)))
+        finally:
+            if not self.connection.closed:
+                with self.connection.cursor() as cursor:
+                    cursor.execute("RESET maintenance_work_mem")
+                    cursor.execute("RESET statement_timeout")
+            self.connection.autocommit = autocommit
+
+        duration = time.time() - start_time
+        print(f"✓ Built {self.index_name} in {duration:.1f}s")
+        return {'method': method, 'rows': rows, 'lists': lists, 'duration': duration}
+
+    def ensure_index(self, method: str = 'hnsw') -> Optional[Dict]:
+        """
+        Call after bulk loads. Builds an index if there is none, and rebuilds an
+        IVFFlat index whose lists were sized for a much smaller table.
+        HNSW indexes stay valid as rows are added and are left alone.
+        """
+        indexes = self.current_indexes()
+        if not indexes:
+            return self.build(method)
+        for index in indexes:
+            if index['method'] != 'ivfflat':
+                continue
+            if not index['lists']:
+                # Created with the default lists, typically on an empty table
+                print(f"ℹ️  {index['name']} is an IVFFlat index with default lists, replacing it")
+                return self.build(method)
+            wanted = ivfflat_lists_for_rows(self.row_count())
+            if wanted >= index['lists'] * IVFFLAT_REBUILD_GROWTH:
+                print(f"ℹ️  {index['name']} has lists={index['lists']}, {wanted} suit the current row count")
+                return self.build('ivfflat', lists=wanted)
+        return None
+
+    @staticmethod
+    def apply_search_settings(cursor, ef_search: Optional[int] = None, probes: Optional[int] = None,
+                              exact: bool = False):
+        """Per-transaction search knobs; the caller's next query uses them"""
+        if ef_search:
+            cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+        if probes:
+            cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(probes),))
+        if exact:
+            # Sequential scan + sort: the ground truth for recall measurements
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+            cursor.execute("SELECT set_config('enable_bitmapscan', 'off', true)")
+
+    def search(self, query_embedding, limit: int = 10, ef_search: Optional[int] = None,
+               probes: Optional[int] = None, exact: bool = False) -> List[int]:
+        """Ids of the nearest rows by cosine distance"""
+        vector = '[' + ','.join(str(float(value)) for value in query_embedding) + ']'
+        try:
+            with self.connection.cursor() as cursor:
+                self.apply_search_settings(cursor, ef_search, probes, exact)
+                cursor.execute(sql.SQL("SELECT {} FROM {} ORDER BY {} <=> %s::vector LIMIT %s").format(
+                    sql.Identifier(self.key_column), sql.Identifier(self.table), sql.Identifier(self.column)
+                ), (vector, limit))
+                return [row[0] for row in cursor.fetchall()]
+        finally:
+            # Ends the transaction so the SET LOCAL-style settings don't leak
+            self.connection.rollback()
+
+    def sample_query_vectors(self, sample_size: int) -> List[str]:
+        """Stored embeddings used as realistic queries"""
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT {}::text FROM {} ORDER BY random() LIMIT %s").format(
+                sql.Identifier(self.column), sql.Identifier(self.table)
+            ), (sample_size,))
+            vectors = [row[0] for row in cursor.fetchall()]
+        self.connection.rollback()
+        return vectors
+
+    def recall_at_k(self, k: int = 10, sample_size: int = 50, ef_search: Optional[int] = None,
+                    probes: Optional[int] = None, queries: Optional[List[str]] = None) -> Dict:
+        """Mean recall@k and latency of index search against exact search"""
+        queries = queries or self.sample_query_vectors(sample_size)
+        recalls = []
+        index_time = exact_time = 0.0
+        for query in queries:
+            values = query.strip('[]').split(',')
+            start = time.perf_counter()
+            approximate = self.search(values, k, ef_search=ef_search, probes=probes)
+            index_time += time.perf_counter() - start
+            start = time.perf_counter()
+            exact = self.search(values, k, exact=True)
+            exact_time += time.perf_counter() - start
+            if exact:
+                recalls.append(len(set(approximate) & set(exact)) / len(exact))
+
+        return {
+            'k': k,
+            'queries': len(recalls),
+            'ef_search': ef_search,
+            'probes': probes,
+            'recall': sum(recalls) / len(recalls) if recalls else 0.0,
+            'index_ms': index_time / max(len(queries), 1) * 1000,
+            'exact_ms': exact_time / max(len(queries), 1) * 1000
+        }
+
+
+def get_db_config() -> Dict:
+    # Index builds run as long as they need, whatever DB_STATEMENT_TIMEOUT_MS says
+    return td_db.get_db_config(statement_timeout_ms=0, search_dirs=[Path(__file__).parent])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build pgvector indexes and measure search recall")
+    parser.add_argument("--table", default=DEFAULT_TABLE, help=f"Embedding table (default: {DEFAULT_TABLE})")
+    parser.add_argument("--column", default=DEFAULT_COLUMN, help=f"Vector column (default: {DEFAULT_COLUMN})")
+    parser.add_argument("--key-column", default='id', help="Row id column (default: id)")
+    parser.add_argument("--build", choices=['hnsw', 'ivfflat'], help="Drop and rebuild the ANN index")
+    parser.add_argument("--m", type=int, default=HNSW_M, help=f"HNSW m (default: {HNSW_M})")
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION,
+                        help=f"HNSW ef_construction (default: {HNSW_EF_CONSTRUCTION})")
+    parser.add_argument("--lists", type=int, help="IVFFlat lists (default: sized from row count)")
+    parser.add_argument("--recall", action="store_true", help="Report recall@k against exact search")
+    parser.add_argument("--k", type=int, default=10, help="k for recall@k (default: 10)")
+    parser.add_argument("--sample", type=int, default=50, help="Query vectors sampled from the table (default: 50)")
+    parser.add_argument("--ef-search", type=int, nargs='*', default=[], help="hnsw.ef_search values to compare")
+    parser.add_argument("--probes", type=int, nargs='*', default=[], help="ivfflat.probes values to compare")
+    args = parser.parse_args()
+
+    connection = td_db.connect(get_db_config())
+    try:
+        manager = VectorIndexManager(connection, args.table, args.column, args.key_column)
+
+        if args.build:
+            manager.build(args.build, m=args.m, ef_construction=args.ef_construction, lists=args.lists)
+
+        if args.recall:
+            indexes = manager.current_indexes()
+            index_names = ', '.join(f"{index['name']} ({index['method']})" for index in indexes)
+            print(f"📐 {args.table}: {manager.row_count():,} rows, indexes: {index_names or 'none'}")
+            queries = manager.sample_query_vectors(args.sample)
+            settings = ([{'ef_search': value} for value in args.ef_search]
+                        + [{'probes': value} for value in args.probes]) or [{}]
+
+            print(f"\n{'Setting':<20}{'Recall@' + str(args.k):>12}{'Index ms':>12}{'Exact ms':>12}")
+            for setting in settings:
+                result = manager.recall_at_k(args.k, queries=queries, **setting)
+                label = ', '.join(f"{key}={value}" for key, value in setting.items()) or 'defaults'
+                print(f"{label:<20}{result['recall']:>12.3f}{result['index_ms']:>12.1f}{result['exact_ms']:>12.1f}")
+
+        if not args.build and not args.recall:
+            parser.print_help()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
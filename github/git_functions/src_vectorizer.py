@@ -2,11 +2,19 @@
 """
 Source Code Vector Database using ChromaDB
 Indexes multiple GitHub repositories for semantic search
+
+Embeddings are cached in embedding_cache.sqlite3 next to the Chroma store
+(td_embeddings), so re-indexing unchanged code costs no API calls.
 """
 
 import os
+import sys
 import json
 import hashlib
+import zlib
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
@@ -20,8 +28,24 @@ import tiktoken
 from pathspec import PathSpec
 from dotenv import load_dotenv
 
+# Repo root, for the shared embedding client
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from td_embeddings import EmbeddingClient, SqliteEmbeddingCache
+
 load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Indexing pipeline sizes
+CHUNK_WORKERS = 8         # threads reading and chunking files
+EMBED_WORKERS = 4         # embedding requests in flight
+EMBED_GROUP_SIZE = 256    # chunks per embed_many() call, split further by the token budget
+ADD_BATCH_SIZE = 500      # chunks per collection.add()
+INDEX_BATCH_SIZE = 2000   # chunks collected before embedding and adding
+
+# Content-defined chunk boundaries (see is_cut_point)
+CUT_POINT_DIVISOR = 16
+
 @dataclass
 class CodeChunk:
     content: str
@@ -31,6 +55,12 @@ class CodeChunk:
     end_line: int
     language: str
     chunk_id: str
+    content_hash: str = ''
+
+def is_cut_point(line: str) -> bool:
+    """Whether a chunk may end after this line: blank lines, and ~1 in CUT_POINT_DIVISOR others by content"""
+    stripped = line.strip()
+    return not stripped or zlib.crc32(stripped.encode('utf-8', errors='ignore')) % CUT_POINT_DIVISOR == 0
 
 class SourceVectorizer:
     def __init__(self, db_path: str = "../chroma_db", openai_api_key: str = None):
@@ -40,14 +70,19 @@ class SourceVectorizer:
         if not self.openai_api_key:
             raise ValueError("OpenAI API key required. Set OPENAI_API_KEY environment variable.")
         
-        openai.api_key = self.openai_api_key
-        
         # Initialize ChromaDB
         self.client = chromadb.PersistentClient(
             path=db_path,
             settings=Settings(allow_reset=True)
         )
         
+        # Cached embeddings; the client backs off and retries on 429s itself
+        self.embedder = EmbeddingClient(
+            EMBEDDING_MODEL,
+            cache=SqliteEmbeddingCache(Path(db_path) / "embedding_cache.sqlite3"),
+            openai_client=openai.OpenAI(api_key=self.openai_api_key, max_retries=5)
+        )
+        
         # Get or create collection
         self.collection = self.client.get_or_create_collection(
             name="source_code",
@@ -55,7 +90,7 @@ class SourceVectorizer:
         )
         
         # Initialize tokenizer for chunking
-        self.tokenizer = tiktoken.encoding_for_model("text-embedding-3-small")
+        self.tokenizer = tiktoken.encoding_for_model(EMBEDDING_MODEL)
         
         # File extensions to process
         self.code_extensions = {
@@ -167,68 +202,159 @@ class SourceVectorizer:
             
         return True
 
-    def chunk_code(self, content: str, file_path: str, repo_name: str, language: str, max_tokens: int = 1000) -> List[CodeChunk]:
-        """Split code into chunks"""
-        lines = content.split('\n')
-        chunks = []
-        current_chunk = []
-        current_tokens = 0
-        start_line = 1
+    def line_token_counts(self, lines: List[str]) -> List[int]:
+        """Tokens per line, encoding each distinct line once (blank lines, braces and imports repeat a lot)"""
+        counts = {line: len(self.tokenizer.encode_ordinary(line)) for line in dict.fromkeys(lines)}
+        return [counts[line] for line in lines]
+
+    def chunk_spans(self, lines: List[str], max_tokens: int = 1000) -> List[Tuple[int, int]]:
+        """
+        (start_line, end_line) spans, 1-based and inclusive, of at most max_tokens each.
+        Once a chunk holds half of max_tokens it ends at the next cut point, so
+        boundaries follow the content rather than the position in the file.
+        Each boundary is found by bisecting cumulative token offsets, so the
+        per-line work is one pass of counting.
+        """
+        min_tokens = max_tokens // 2
+        # offsets[i]: tokens in lines 1..i
+        offsets = list(accumulate(self.line_token_counts(lines), initial=0))
+        cut_flags = {line: is_cut_point(line) for line in dict.fromkeys(lines)}
+        cut_lines = [i for i, line in enumerate(lines, 1) if cut_flags[line]]
         
-        for i, line in enumerate(lines, 1):
-            line_tokens = len(self.tokenizer.encode(line))
+        spans = []
+        start_line = 1
+        while start_line <= len(lines):
+            chunk_base = offsets[start_line - 1]
+            # First line that would take the chunk past max_tokens (a chunk always gets its first line)
+            overflow_line = bisect_right(offsets, chunk_base + max_tokens, start_line + 1)
+            # First cut point at or after the line where the chunk reaches min_tokens
+            min_line = bisect_left(offsets, chunk_base + min_tokens, start_line)
+            cut_index = bisect_left(cut_lines, min_line)
             
-            if current_tokens + line_tokens > max_tokens and current_chunk:
-                # Create chunk
-                chunk_content = '\n'.join(current_chunk)
-                chunk_id = hashlib.md5(f"{repo_name}:{file_path}:{start_line}:{i-1}".encode()).hexdigest()
-                
-                chunks.append(CodeChunk(
-                    content=chunk_content,
-                    file_path=file_path,
-                    repo_name=repo_name,
-                    start_line=start_line,
-                    end_line=i-1,
-                    language=language,
-                    chunk_id=chunk_id
-                ))
-                
-                current_chunk = [line]
-                current_tokens = line_tokens
-                start_line = i
+            if cut_index < len(cut_lines) and cut_lines[cut_index] < overflow_line:
+                end_line = cut_lines[cut_index]
             else:
-                current_chunk.append(line)
-                current_tokens += line_tokens
+                end_line = overflow_line - 1
+            
+            spans.append((start_line, end_line))
+            start_line = end_line + 1
+        
+        return spans
+
+    def chunk_code(self, content: str, file_path: str, repo_name: str, language: str, max_tokens: int = 1000) -> List[CodeChunk]:
+        """
+        Split code into chunks. A chunk's id comes from its repo, path and content,
+        so chunks an edit didn't touch keep their ids (and vectors) when line numbers shift.
+        """
+        lines = content.split('\n')
+        chunks = []
+        occurrences = {}
         
-        # Add final chunk
-        if current_chunk:
-            chunk_content = '\n'.join(current_chunk)
-            chunk_id = hashlib.md5(f"{repo_name}:{file_path}:{start_line}:{len(lines)}".encode()).hexdigest()
+        for start_line, end_line in self.chunk_spans(lines, max_tokens):
+            chunk_content = '\n'.join(lines[start_line - 1:end_line])
+            content_hash = hashlib.sha256(chunk_content.encode('utf-8', errors='ignore')).hexdigest()
+            # Repeated identical blocks in one file still need distinct ids
+            occurrence = occurrences.get(content_hash, 0)
+            occurrences[content_hash] = occurrence + 1
+            chunk_id = hashlib.md5(f"{repo_name}:{file_path}:{content_hash}:{occurrence}".encode()).hexdigest()
             
             chunks.append(CodeChunk(
                 content=chunk_content,
                 file_path=file_path,
                 repo_name=repo_name,
                 start_line=start_line,
-                end_line=len(lines),
+                end_line=end_line,
                 language=language,
-                chunk_id=chunk_id
+                chunk_id=chunk_id,
+                content_hash=content_hash
             ))
         
         return chunks
 
     def get_embedding(self, text: str) -> List[float]:
-        """Get OpenAI embedding for text"""
+        """Get OpenAI embedding for text (cached)"""
         try:
-            response = openai.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response.data[0].embedding
+            return self.embedder.embed(text)
         except Exception as e:
             print(f"Error getting embedding: {e}")
             return None
 
+    def read_file_chunks(self, file_path: Path, repo_path: str, repo_name: str) -> List[CodeChunk]:
+        """Read and chunk one file; an empty list for empty or unreadable files"""
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+        except Exception as e:
+            print(f"Error processing {file_path}: {e}")
+            return []
+            
+        if not content.strip():
+            return []
+            
+        language = self.code_extensions[file_path.suffix]
+        relative_path = str(file_path.relative_to(repo_path))
+        return self.chunk_code(content, relative_path, repo_name, language)
+
+    def embed_chunks(self, chunks: List[CodeChunk]) -> List[Optional[List[float]]]:
+        """
+        Embeddings for chunks, in order, EMBED_WORKERS requests at a time.
+        A group the API rejects (e.g. one oversized chunk) is retried chunk by
+        chunk so only the bad chunks come back as None.
+        """
+        groups = [chunks[i:i + EMBED_GROUP_SIZE] for i in range(0, len(chunks), EMBED_GROUP_SIZE)]
+        
+        def embed_group(group):
+            try:
+                return self.embedder.embed_many([chunk.content for chunk in group])
+            except Exception as e:
+                print(f"Error getting embeddings for {len(group)} chunks ({e}), retrying one by one")
+                return [self.get_embedding(chunk.content) for chunk in group]
+        
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+            return [embedding for group_embeddings in executor.map(embed_group, groups)
+                    for embedding in group_embeddings]
+
+    def chunk_metadata(self, chunk: CodeChunk, indexed_at: str) -> Dict:
+        return {
+            'file_path': chunk.file_path,
+            'repo_name': chunk.repo_name,
+            'start_line': chunk.start_line,
+            'end_line': chunk.end_line,
+            'language': chunk.language,
+            'content_hash': chunk.content_hash,
+            'indexed_at': indexed_at
+        }
+
+    def add_chunks(self, chunks: List[CodeChunk], embeddings: List[List[float]]):
+        """Add embedded chunks to the collection, ADD_BATCH_SIZE per call"""
+        indexed_at = datetime.now().isoformat()
+        for start in range(0, len(chunks), ADD_BATCH_SIZE):
+            batch = chunks[start:start + ADD_BATCH_SIZE]
+            self.collection.add(
+                ids=[chunk.chunk_id for chunk in batch],
+                embeddings=embeddings[start:start + ADD_BATCH_SIZE],
+                documents=[chunk.content for chunk in batch],
+                metadatas=[self.chunk_metadata(chunk, indexed_at) for chunk in batch]
+            )
+
+    def update_chunk_metadata(self, chunks: List[CodeChunk]):
+        """Refresh line numbers of chunks already stored, without re-embedding them"""
+        indexed_at = datetime.now().isoformat()
+        for start in range(0, len(chunks), ADD_BATCH_SIZE):
+            batch = chunks[start:start + ADD_BATCH_SIZE]
+            self.collection.update(
+                ids=[chunk.chunk_id for chunk in batch],
+                metadatas=[self.chunk_metadata(chunk, indexed_at) for chunk in batch]
+            )
+
+    def index_chunks(self, chunks: List[CodeChunk]) -> int:
+        """Embed and store chunks; returns how many were stored"""
+        embedded = [(chunk, embedding) for chunk, embedding in zip(chunks, self.embed_chunks(chunks))
+                    if embedding is not None]
+        if embedded:
+            self.add_chunks([chunk for chunk, _ in embedded], [embedding for _, embedding in embedded])
+        return len(embedded)
+
     def index_repository(self, repo_path: str, repo_name: str = None) -> int:
         """Index a repository"""
         if repo_name is None:
@@ -237,55 +363,27 @@ class SourceVectorizer:
         print(f"Indexing repository: {repo_name}")
         
         gitignore_spec = self.get_gitignore_spec(repo_path)
+        files = [file_path for file_path in Path(repo_path).rglob('*')
+                 if file_path.is_file() and self.should_process_file(file_path, gitignore_spec)]
+        print(f"Found {len(files)} files to index")
+        
         chunks_processed = 0
+        pending = []
         
-        for file_path in Path(repo_path).rglob('*'):
-            if not file_path.is_file():
-                continue
-                
-            if not self.should_process_file(file_path, gitignore_spec):
-                continue
-            
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    
-                if not content.strip():
-                    continue
-                    
-                language = self.code_extensions[file_path.suffix]
-                relative_path = str(file_path.relative_to(repo_path))
-                
-                chunks = self.chunk_code(content, relative_path, repo_name, language)
-                
-                for chunk in chunks:
-                    embedding = self.get_embedding(chunk.content)
-                    if embedding is None:
-                        continue
-                        
-                    self.collection.add(
-                        ids=[chunk.chunk_id],
-                        embeddings=[embedding],
-                        documents=[chunk.content],
-                        metadatas=[{
-                            'file_path': chunk.file_path,
-                            'repo_name': chunk.repo_name,
-                            'start_line': chunk.start_line,
-                            'end_line': chunk.end_line,
-                            'language': chunk.language,
-                            'indexed_at': datetime.now().isoformat()
-                        }]
-                    )
-                    chunks_processed += 1
-                    
-                    if chunks_processed % 10 == 0:
-                        print(f"Processed {chunks_processed} chunks...")
-                        
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-                continue
+        # Files are read and chunked on worker threads while earlier batches embed
+        with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+            for file_chunks in executor.map(lambda file_path: self.read_file_chunks(file_path, repo_path, repo_name), files):
+                pending.extend(file_chunks)
+                if len(pending) >= INDEX_BATCH_SIZE:
+                    chunks_processed += self.index_chunks(pending)
+                    pending = []
+                    print(f"Processed {chunks_processed} chunks...")
+        
+        if pending:
+            chunks_processed += self.index_chunks(pending)
         
         print(f"Finished indexing {repo_name}: {chunks_processed} chunks")
+        print(f"Embedding cache: {self.embedder.summary()}")
         return chunks_processed
 
     def search_code(self, query: str, n_results: int = 10, repo_filter: str = None) -> List[Dict]:
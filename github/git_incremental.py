@@ -9,12 +9,15 @@ import sys
 import json
 import hashlib
 from pathlib import Path
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 from datetime import datetime
 import argparse
 
 from git import Repo  # GitPython
-from git_functions.src_vectorizer import SourceVectorizer
+from git_functions.src_vectorizer import INDEX_BATCH_SIZE, SourceVectorizer
+
+# Files per filtered get/delete call
+DELETE_BATCH_SIZE = 500
 
 class IncrementalIndexer:
     def __init__(self, db_path: str = "./chroma_db", repos_dir: str = "./git_functions/repos"):
@@ -99,37 +102,124 @@ class IncrementalIndexer:
         if not last_commit or last_commit != current_commit:
             print(f"Commit changed from {last_commit[:8]} to {current_commit[:8]}")
             
-            # Check all code files for changes
-            gitignore_spec = self.vectorizer.get_gitignore_spec(str(repo_path))
-            
-            # Track current files
-            current_files = set()
+            diff_changes = self.get_diff_changes(repo_path, last_commit, current_commit, stored_file_hashes)
+            if diff_changes is not None:
+                changed_files, deleted_files = diff_changes
+            else:
+                changed_files, deleted_files = self.scan_changed_files(repo_path, stored_file_hashes)
             
-            for file_path in repo_path.rglob('*'):
-                if not file_path.is_file():
-                    continue
-                    
-                if not self.vectorizer.should_process_file(file_path, gitignore_spec):
-                    continue
-                
-                relative_path = str(file_path.relative_to(repo_path))
-                current_files.add(relative_path)
-                
-                # Check if file hash changed
-                current_hash = self.get_file_hash(file_path)
-                stored_hash = stored_file_hashes.get(relative_path)
+            for file_path in changed_files:
+                print(f"  Changed: {file_path.relative_to(repo_path)}")
+            for deleted_file in deleted_files:
+                print(f"  Deleted: {deleted_file}")
+        
+        return changed_files, deleted_files, current_commit
+
+    def get_diff_changes(self, repo_path: Path, last_commit: str, current_commit: str,
+                         stored_file_hashes: Dict) -> Optional[Tuple[List[Path], List[str]]]:
+        """
+        Changed and deleted files from `git diff --name-status last_commit..current_commit`,
+        reading only the files the commits touched.
+        Returns None when the diff can't be trusted (first run, uncommitted or untracked
+        changes, last commit no longer in history) and the tree has to be scanned instead.
+        """
+        if not last_commit or not stored_file_hashes:
+            return None
+        
+        try:
+            repo = Repo(repo_path)
+            if repo.is_dirty(untracked_files=True):
+                print("  Working tree has local changes, scanning all files")
+                return None
+            # -z: NUL-separated, so paths with spaces or quotes come through verbatim
+            output = repo.git.diff('--name-status', '-M', '-z', f"{last_commit}..{current_commit}")
+        except Exception:
+            print(f"  Can't diff from {last_commit[:8]} (history rewritten?), scanning all files")
+            return None
+        
+        candidates = set()
+        deleted = set()
+        fields = output.split('\0')
+        i = 0
+        while i < len(fields) and fields[i]:
+            status = fields[i]
+            if status[0] in 'RC':
+                # Renames/copies carry old and new path; a rename deletes the old one
+                old_path, new_path = fields[i + 1], fields[i + 2]
+                if status[0] == 'R':
+                    deleted.add(old_path)
+                candidates.add(new_path)
+                i += 3
+            else:
+                if status[0] == 'D':
+                    deleted.add(fields[i + 1])
+                else:
+                    candidates.add(fields[i + 1])
+                i += 2
+        
+        gitignore_spec = self.vectorizer.get_gitignore_spec(str(repo_path))
+        changed_files = []
+        for relative_path in sorted(candidates):
+            file_path = repo_path / relative_path
+            if file_path.is_file() and self.vectorizer.should_process_file(file_path, gitignore_spec):
+                changed_files.append(file_path)
+            elif relative_path in stored_file_hashes:
+                # Indexed before but no longer eligible (now ignored, too large, ...)
+                deleted.add(relative_path)
+        
+        deleted_files = sorted(path for path in deleted if path in stored_file_hashes)
+        return changed_files, deleted_files
+
+    def scan_changed_files(self, repo_path: Path, stored_file_hashes: Dict) -> Tuple[List[Path], List[str]]:
+        """Changed and deleted files by hashing every eligible file against the stored hashes"""
+        gitignore_spec = self.vectorizer.get_gitignore_spec(str(repo_path))
+        
+        changed_files = []
+        current_files = set()
+        
+        for file_path in repo_path.rglob('*'):
+            if not file_path.is_file():
+                continue
                 
-                if current_hash != stored_hash:
-                    changed_files.append(file_path)
-                    print(f"  Changed: {relative_path}")
+            if not self.vectorizer.should_process_file(file_path, gitignore_spec):
+                continue
+            
+            relative_path = str(file_path.relative_to(repo_path))
+            current_files.add(relative_path)
             
-            # Find deleted files
-            for stored_file in stored_file_hashes.keys():
-                if stored_file not in current_files:
-                    deleted_files.append(stored_file)
-                    print(f"  Deleted: {stored_file}")
+            # Check if file hash changed
+            if self.get_file_hash(file_path) != stored_file_hashes.get(relative_path):
+                changed_files.append(file_path)
         
-        return changed_files, deleted_files, current_commit
+        # Find deleted files
+        deleted_files = [stored_file for stored_file in stored_file_hashes if stored_file not in current_files]
+        
+        return changed_files, deleted_files
+
+    def delete_file_chunks(self, repo_name: str, file_paths: List[str]):
+        """Delete every chunk of the given files, filtered in Chroma rather than scanned here"""
+        file_paths = sorted(set(file_paths))
+        for start in range(0, len(file_paths), DELETE_BATCH_SIZE):
+            self.vectorizer.collection.delete(where={
+                "$and": [
+                    {"repo_name": repo_name},
+                    {"file_path": {"$in": file_paths[start:start + DELETE_BATCH_SIZE]}}
+                ]
+            })
+
+    def get_file_chunk_ids(self, repo_name: str, file_paths: List[str]) -> Set[str]:
+        """Ids of the stored chunks of the given files (ids only, no embeddings or documents)"""
+        file_paths = sorted(set(file_paths))
+        chunk_ids = set()
+        for start in range(0, len(file_paths), DELETE_BATCH_SIZE):
+            result = self.vectorizer.collection.get(where={
+                "$and": [
+                    {"repo_name": repo_name},
+                    {"file_path": {"$in": file_paths[start:start + DELETE_BATCH_SIZE]}}
+                ]
+            }, include=[])
+            chunk_ids.update(result['ids'])
+        return chunk_ids
 
     def remove_deleted_chunks(self, repo_name: str, deleted_files: List[str]):
         """Remove chunks for deleted files from the database"""
@@ -137,24 +227,12 @@ class IncrementalIndexer:
             return
             
         print(f"Removing chunks for {len(deleted_files)} deleted files...")
-        
-        # Get all chunk IDs for deleted files
-        all_metadata = self.vectorizer.collection.get()
-        chunk_ids_to_delete = []
-        
-        for i, metadata in enumerate(all_metadata['metadatas']):
-            if (metadata.get('repo_name') == repo_name and 
-                metadata.get('file_path') in deleted_files):
-                chunk_ids_to_delete.append(all_metadata['ids'][i])
-        
-        if chunk_ids_to_delete:
-            self.vectorizer.collection.delete(ids=chunk_ids_to_delete)
-            print(f"Removed {len(chunk_ids_to_delete)} chunks for deleted files")
+        self.delete_file_chunks(repo_name, deleted_files)
 
     def update_repository(self, repo_name: str, pull_latest: bool = True) -> int:
         """
         Update a specific repository with only changed files
-        Returns number of chunks processed
+        Returns number of chunks embedded
         """
         repo_path = self.repos_dir / repo_name
         
@@ -179,66 +257,55 @@ class IncrementalIndexer:
         # Remove chunks for deleted files
         self.remove_deleted_chunks(repo_name, deleted_files)
         
-        # Process changed files
-        chunks_processed = 0
+        # Chunk changed files
+        new_chunks = []
+        chunked_paths = []
         updated_file_hashes = self.repo_metadata.get(repo_name, {}).get('file_hashes', {})
         
         for file_path in changed_files:
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
+                # Read once: the same bytes give the content and the stored hash
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+                content = raw.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+                
+                relative_path = str(file_path.relative_to(repo_path))
+                chunked_paths.append(relative_path)
                     
                 if not content.strip():
                     continue
                     
                 language = self.vectorizer.code_extensions[file_path.suffix]
-                relative_path = str(file_path.relative_to(repo_path))
-                
-                # Remove old chunks for this file first
-                all_metadata = self.vectorizer.collection.get()
-                old_chunk_ids = []
-                
-                for i, metadata in enumerate(all_metadata['metadatas']):
-                    if (metadata.get('repo_name') == repo_name and 
-                        metadata.get('file_path') == relative_path):
-                        old_chunk_ids.append(all_metadata['ids'][i])
-                
-                if old_chunk_ids:
-                    self.vectorizer.collection.delete(ids=old_chunk_ids)
-                
-                # Create new chunks
-                chunks = self.vectorizer.chunk_code(content, relative_path, repo_name, language)
-                
-                for chunk in chunks:
-                    embedding = self.vectorizer.get_embedding(chunk.content)
-                    if embedding is None:
-                        continue
-                        
-                    self.vectorizer.collection.add(
-                        ids=[chunk.chunk_id],
-                        embeddings=[embedding],
-                        documents=[chunk.content],
-                        metadatas=[{
-                            'file_path': chunk.file_path,
-                            'repo_name': chunk.repo_name,
-                            'start_line': chunk.start_line,
-                            'end_line': chunk.end_line,
-                            'language': chunk.language,
-                            'indexed_at': datetime.now().isoformat()
-                        }]
-                    )
-                    chunks_processed += 1
+                new_chunks.extend(self.vectorizer.chunk_code(content, relative_path, repo_name, language))
                 
                 # Update file hash
-                updated_file_hashes[relative_path] = self.get_file_hash(file_path)
-                
-                if chunks_processed % 10 == 0 and chunks_processed > 0:
-                    print(f"Processed {chunks_processed} chunks...")
+                updated_file_hashes[relative_path] = hashlib.sha256(raw).hexdigest()
                     
             except Exception as e:
                 print(f"Error processing {file_path}: {e}")
                 continue
         
+        # Chunk ids come from content, so only chunks the edits produced need embeddings
+        existing_ids = self.get_file_chunk_ids(repo_name, chunked_paths)
+        new_ids = {chunk.chunk_id for chunk in new_chunks}
+        stale_ids = sorted(existing_ids - new_ids)
+        kept_chunks = [chunk for chunk in new_chunks if chunk.chunk_id in existing_ids]
+        fresh_chunks = [chunk for chunk in new_chunks if chunk.chunk_id not in existing_ids]
+        print(f"Chunks: {len(fresh_chunks)} new, {len(kept_chunks)} unchanged, {len(stale_ids)} removed")
+        
+        for start in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+            self.vectorizer.collection.delete(ids=stale_ids[start:start + DELETE_BATCH_SIZE])
+        
+        # Unchanged chunks keep their vectors; only their line numbers may have moved
+        if kept_chunks:
+            self.vectorizer.update_chunk_metadata(kept_chunks)
+        
+        # Embedded and added in batches across files
+        chunks_processed = 0
+        for start in range(0, len(fresh_chunks), INDEX_BATCH_SIZE):
+            chunks_processed += self.vectorizer.index_chunks(fresh_chunks[start:start + INDEX_BATCH_SIZE])
+            print(f"Processed {chunks_processed} chunks...")
+        
         # Update metadata
         if repo_name not in self.repo_metadata:
             self.repo_metadata[repo_name] = {}
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of SourceVectorizer's chunker over the cloned repositories.
+Times the previous chunker, which encoded every line with its own tokenizer
+call and walked the lines one by one, against chunk_spans(), which encodes
+each distinct line once and cuts chunks by bisecting cumulative token offsets.
+Both should produce the same spans; any file where they differ is reported.
+
+Usage:
+    python script-testing/benchmark_chunker.py --repos-dir git_functions/repos --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from git_functions.src_vectorizer import SourceVectorizer, is_cut_point
+
+
+def legacy_chunk_spans(tokenizer, lines, max_tokens=1000):
+    """chunk_spans() as it was before the one-pass chunker: one encode() per line"""
+    min_tokens = max_tokens // 2
+    spans = []
+    current_tokens = 0
+    start_line = 1
+
+    for i, line in enumerate(lines, 1):
+        # disallowed_special=() so files mentioning <|endoftext|> don't abort the run
+        line_tokens = len(tokenizer.encode(line, disallowed_special=()))
+
+        if current_tokens + line_tokens > max_tokens and i > start_line:
+            spans.append((start_line, i - 1))
+            current_tokens = 0
+            start_line = i
+
+        current_tokens += line_tokens
+
+        if current_tokens >= min_tokens and is_cut_point(line):
+            spans.append((start_line, i))
+            current_tokens = 0
+            start_line = i + 1
+
+    if start_line <= len(lines):
+        spans.append((start_line, len(lines)))
+
+    return spans
+
+
+def load_source_files(vectorizer, repos_dir, max_files):
+    files = []
+    for repo_path in sorted(Path(repos_dir).iterdir()):
+        if not repo_path.is_dir():
+            continue
+        gitignore_spec = vectorizer.get_gitignore_spec(str(repo_path))
+        for file_path in repo_path.rglob('*'):
+            if not file_path.is_file() or not vectorizer.should_process_file(file_path, gitignore_spec):
+                continue
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+            if content.strip():
+                files.append((file_path, vectorizer.code_extensions[file_path.suffix], content))
+            if max_files and len(files) >= max_files:
+                return files
+    return files
+
+
+def time_chunker(chunker, files, repeat):
+    """Best total time, per-language best times, and spans per file"""
+    best = None
+    by_language = defaultdict(lambda: None)
+    spans = []
+    for _ in range(repeat):
+        spans = []
+        language_times = defaultdict(float)
+        start = time.perf_counter()
+        for _, language, content in files:
+            file_start = time.perf_counter()
+            spans.append(chunker(content.split('\n')))
+            language_times[language] += time.perf_counter() - file_start
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        for language, seconds in language_times.items():
+            by_language[language] = seconds if by_language[language] is None else min(by_language[language], seconds)
+    return best, by_language, spans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the source chunker on the cloned repositories")
+    parser.add_argument("--repos-dir", default=str(Path(__file__).parent.parent / "git_functions" / "repos"),
+                        help="Directory of cloned repositories (default: git_functions/repos)")
+    parser.add_argument("--max-files", type=int, help="Stop after N files (default: all)")
+    parser.add_argument("--max-tokens", type=int, default=1000, help="Chunk size (default: 1000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per chunker; best time is reported (default: 3)")
+    parser.add_argument("--show-diffs", type=int, default=3, help="Mismatching files to print (default: 3)")
+    args = parser.parse_args()
+
+    # The API key is never used; chunking only needs the tokenizer
+    with tempfile.TemporaryDirectory() as db_path:
+        vectorizer = SourceVectorizer(db_path=db_path, openai_api_key=os.getenv("OPENAI_API_KEY", "unused"))
+
+        print(f"🔍 Loading source files from {args.repos_dir}...")
+        files = load_source_files(vectorizer, args.repos_dir, args.max_files)
+        input_mb = sum(len(content.encode('utf-8')) for _, _, content in files) / 1024 / 1024
+        print(f"   {len(files):,} files, {input_mb:.1f} MB\n")
+        if not files:
+            return
+
+        chunkers = [
+            ('legacy (encode per line)', lambda lines: legacy_chunk_spans(vectorizer.tokenizer, lines, args.max_tokens)),
+            ('chunk_spans (one pass)', lambda lines: vectorizer.chunk_spans(lines, args.max_tokens)),
+        ]
+
+        results = []
+        baseline = None
+        print(f"{'Chunker':<28}{'Best time':>12}{'MB/s':>10}{'Chunks':>10}{'Speedup':>10}")
+        for name, chunker in chunkers:
+            elapsed, by_language, spans = time_chunker(chunker, files, args.repeat)
+            results.append((name, by_language, spans))
+            baseline = baseline or elapsed
+            print(f"{name:<28}{elapsed:>11.3f}s{input_mb / elapsed:>10.2f}"
+                  f"{sum(map(len, spans)):>10,}{baseline / elapsed:>9.2f}x")
+
+    language_mb = defaultdict(float)
+    for _, language, content in files:
+        language_mb[language] += len(content.encode('utf-8')) / 1024 / 1024
+    print(f"\n{'Language':<14}{'MB':>8}" + ''.join(f"{name.split()[0] + ' MB/s':>18}" for name, _, _ in results))
+    for language, mb in sorted(language_mb.items(), key=lambda item: -item[1]):
+        print(f"{language:<14}{mb:>8.1f}" + ''.join(f"{mb / max(by_language[language], 1e-9):>18.2f}" for _, by_language, _ in results))
+
+    legacy_spans, new_spans = results[0][2], results[1][2]
+    mismatches = [(file_path, old, new) for (file_path, _, _), old, new in zip(files, legacy_spans, new_spans) if old != new]
+    print(f"\n🔎 Spans differ on {len(mismatches):,} of {len(files):,} files")
+    for file_path, old, new in mismatches[:args.show_diffs]:
+        print(f"\n   {file_path}")
+        print(f"   legacy: {old[:8]}")
+        print(f"   new:    {new[:8]}")
+
+if __name__ == "__main__":
+    main()
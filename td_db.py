@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Shared PostgreSQL access for the scripts in this repo.
+Every script used to build its own db_config from DB_* variables and open a
+fresh psycopg2 connection per task (per topic, per fact), each one a TLS
+handshake to the managed database.
+
+- get_db_config(): DB_* environment variables, with DB_SSLROOTCERT resolved
+  against the running script's directory and its parents, and an optional
+  statement timeout (DB_STATEMENT_TIMEOUT_MS)
+- get_connection() / connection(): connections from a process-wide
+  ThreadedConnectionPool per config; close() resets the session and hands the
+  connection back to the pool instead of disconnecting
+- add_query_hook(): called with (query, seconds, rowcount) after every
+  statement; DB_SLOW_QUERY_MS logs slow ones, query_stats() sums them up
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+REPO_ROOT = Path(__file__).resolve().parent
+
+DEFAULT_POOL_MAX = int(os.getenv('DB_POOL_MAX', 20))
+
+
+# --- configuration -----------------------------------------------------------
+
+def _cert_search_dirs(search_dirs: Iterable) -> list:
+    dirs = [Path(d) for d in search_dirs] + [Path.cwd()]
+    if sys.argv and sys.argv[0]:
+        script_dir = Path(sys.argv[0]).resolve().parent
+        # The running script's directory up to the repo root (e.g. scripts/ -> forum-scraper-trainerday/)
+        while True:
+            dirs.append(script_dir)
+            if script_dir == REPO_ROOT or REPO_ROOT not in script_dir.parents:
+                break
+            script_dir = script_dir.parent
+    dirs.append(REPO_ROOT)
+    return dirs
+
+
+def resolve_ssl_cert(filename: str, search_dirs: Iterable = ()) -> Optional[str]:
+    """Absolute path of a root certificate named relative to a script's project, or None"""
+    path = Path(filename).expanduser()
+    if path.is_absolute():
+        return str(path) if path.exists() else None
+    for directory in _cert_search_dirs(search_dirs):
+        candidate = directory / path
+        if candidate.exists():
+            return str(candidate.resolve())
+    return None
+
+
+def get_db_config(sslrootcert: Optional[str] = None, statement_timeout_ms: Optional[int] = None,
+                  search_dirs: Iterable = ()) -> Dict:
+    """
+    Connection settings from DB_HOST, DB_PORT, DB_DATABASE, DB_USERNAME,
+    DB_PASSWORD, DB_SSLMODE, DB_SSLROOTCERT and DB_STATEMENT_TIMEOUT_MS
+    (arguments override the last two).
+    """
+    db_config = {
+        'host': os.getenv('DB_HOST'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_DATABASE'),
+        'user': os.getenv('DB_USERNAME'),
+        'password': os.getenv('DB_PASSWORD'),
+        'sslmode': os.getenv('DB_SSLMODE', 'require')
+    }
+
+    cert = sslrootcert or os.getenv('DB_SSLROOTCERT')
+    if cert:
+        cert_path = resolve_ssl_cert(cert, search_dirs)
+        if cert_path:
+            db_config['sslrootcert'] = cert_path
+        else:
+            print(f"⚠️ SSL certificate file not found: {cert}")
+
+    if statement_timeout_ms is None:
+        statement_timeout_ms = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout_ms:
+        db_config['options'] = f"-c statement_timeout={statement_timeout_ms}"
+
+    return db_config
+
+
+def config_is_complete(db_config: Dict) -> bool:
+    return all(db_config.get(key) for key in ('host', 'database', 'user', 'password'))
+
+
+# --- query timing ------------------------------------------------------------
+
+_query_hooks = []
+_stats_lock = threading.Lock()
+_stats = {'queries': 0, 'seconds': 0.0}
+
+
+def add_query_hook(hook: Callable[[str, float, int], None]):
+    """Call hook(query, seconds, rowcount) after every statement on td_db connections"""
+    _query_hooks.append(hook)
+
+
+def remove_query_hook(hook: Callable[[str, float, int], None]):
+    _query_hooks.remove(hook)
+
+
+def query_stats() -> Dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def query_text(query) -> str:
+    text = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+    return ' '.join(text.split())
+
+
+def _record_query(query, seconds: float, rowcount: int):
+    with _stats_lock:
+        _stats['queries'] += 1
+        _stats['seconds'] += seconds
+    for hook in _query_hooks:
+        hook(query, seconds, rowcount)
+
+
+def _slow_query_logger(threshold_ms: int):
+    def log_slow_query(query, seconds, rowcount):
+        if seconds * 1000 >= threshold_ms:
+            print(f"🐢 Slow query ({seconds:.2f}s, {rowcount} rows): {query_text(query)[:200]}")
+    return log_slow_query
+
+
+if int(os.getenv('DB_SLOW_QUERY_MS', 0)):
+    add_query_hook(_slow_query_logger(int(os.getenv('DB_SLOW_QUERY_MS'))))
+
+
+class TimedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_query(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record_query(query, time.perf_counter() - start, self.rowcount)
+
+
+_timed_cursor_classes = {}
+
+
+def timed_cursor_class(cursor_class):
+    """cursor_class with execute/executemany timed (RealDictCursor stays a RealDictCursor)"""
+    if issubclass(cursor_class, TimedCursorMixin):
+        return cursor_class
+    if cursor_class not in _timed_cursor_classes:
+        _timed_cursor_classes[cursor_class] = type(f"Timed{cursor_class.__name__}",
+                                                   (TimedCursorMixin, cursor_class), {})
+    return _timed_cursor_classes[cursor_class]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+
+# --- connections -------------------------------------------------------------
+
+def connect(db_config: Optional[Dict] = None):
+    """A dedicated (unpooled) connection with timed cursors"""
+    return psycopg2.connect(**(db_config or get_db_config()), connection_factory=TimedConnection)
+
+
+_pools = {}
+# Pools replaced by a larger one; connections still out return to them
+_retired_pools = []
+_pools_lock = threading.Lock()
+
+
+def _pool_key(db_config: Dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in db_config.items()))
+
+
+def get_pool(db_config: Optional[Dict] = None, maxconn: int = DEFAULT_POOL_MAX) -> ThreadedConnectionPool:
+    """
+    The process-wide pool for db_config, created on first use with at least
+    DB_POOL_MAX connections. A caller needing more gets a new, larger pool;
+    the old one is never resized while its connections are in use.
+    """
+    db_config = db_config or get_db_config()
+    key = _pool_key(db_config)
+    with _pools_lock:
+        if key in _pools and _pools[key].maxconn < maxconn:
+            _retired_pools.append(_pools.pop(key))
+        if key not in _pools:
+            _pools[key] = ThreadedConnectionPool(1, max(maxconn, DEFAULT_POOL_MAX),
+                                                 connection_factory=TimedConnection, **db_config)
+        return _pools[key]
+
+
+def reset_session(connection) -> bool:
+    """
+    Roll back, then DISCARD ALL so the next borrower doesn't inherit SET
+    parameters, temp tables, prepared statements or autocommit.
+    Returns False if the connection is unusable.
+    """
+    if connection.closed:
+        return False
+    try:
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        # DISCARD ALL can't run inside a transaction block
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("DISCARD ALL")
+        connection.autocommit = False
+        return True
+    except psycopg2.Error:
+        return False
+
+
+class PooledConnection:
+    """
+    A psycopg2 connection borrowed from a pool. Everything is delegated to the
+    connection, except close(), which rolls back anything uncommitted, resets
+    the session and returns it to the pool.
+    """
+
+    def __init__(self, pool: ThreadedConnectionPool, connection):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_connection', connection)
+
+    def __getattr__(self, name):
+        connection = object.__getattribute__(self, '_connection')
+        if connection is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+    # `with connection:` commits or rolls back, like a plain psycopg2 connection
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._connection.__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def closed(self) -> int:
+        connection = object.__getattribute__(self, '_connection')
+        return 1 if connection is None else connection.closed
+
+    def close(self):
+        connection = object.__getattribute__(self, '_connection')
+        if connection is None:
+            return
+        object.__setattr__(self, '_connection', None)
+        self._pool.putconn(connection, close=not reset_session(connection))
+
+
+def get_connection(db_config: Optional[Dict] = None) -> PooledConnection:
+    """A pooled connection; close() returns it to the pool"""
+    pool = get_pool(db_config)
+    connection = pool.getconn()
+    # The server may have dropped an idle connection; replace it once
+    if connection.closed:
+        pool.putconn(connection, close=True)
+        connection = pool.getconn()
+    return PooledConnection(pool, connection)
+
+
+@contextmanager
+def connection(db_config: Optional[Dict] = None):
+    """Borrow a pooled connection for a block; uncommitted work is rolled back on return"""
+    pooled = get_connection(db_config)
+    try:
+        yield pooled
+    finally:
+        pooled.close()
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in list(_pools.values()) + _retired_pools:
+            pool.closeall()
+        _pools.clear()
+        _retired_pools.clear()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Shared OpenAI embedding client with a persistent dedup cache.
+Used by the forum Q&A embedder, the facts extractor, the LlamaIndex loaders and
+the source-code vectorizer, which used to call the embeddings API for every
+text on every run.
+
+Vectors are cached under (model, dimensions, sha256 of the normalized text);
+normalizing is NFC plus collapsed whitespace, so reformatted but otherwise
+identical text is a hit. embed_many() looks the whole batch up in one query,
+sends only the misses (each distinct text once) in multi-input requests and
+writes the new vectors back in one statement.
+
+Caches:
+- PostgresEmbeddingCache: embedding_cache table, for tools that already use Postgres
+- SqliteEmbeddingCache: a local file, for tools without a database (Chroma indexing)
+- MemoryEmbeddingCache: per-process only, the default
+"""
+
+import array
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import openai
+
+try:
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from llama_index.core.bridge.pydantic import PrivateAttr
+    HAS_LLAMA_INDEX = True
+except ImportError:
+    HAS_LLAMA_INDEX = False
+
+CACHE_TABLE = 'embedding_cache'
+
+# Per-request limits: the API takes up to 2048 inputs and 300k tokens per call
+DEFAULT_BATCH_SIZE = 256
+MAX_BATCH_TOKENS = 200000
+CHARS_PER_TOKEN = 4
+
+# Hashes per lookup statement (SQLite caps bound parameters per query)
+LOOKUP_CHUNK = 500
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def text_hash(text: str) -> str:
+    """Cache key for a text: sha256 of its normalized form"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def pack_vector(vector: Sequence[float]) -> bytes:
+    # float32 is what the API computes in; a quarter of the size of JSON floats
+    return array.array('f', vector).tobytes()
+
+
+def unpack_vector(data) -> List[float]:
+    vector = array.array('f')
+    vector.frombytes(bytes(data))
+    return vector.tolist()
+
+
+class MemoryEmbeddingCache:
+    def __init__(self):
+        self.vectors = {}
+
+    def get_many(self, model: str, dimensions: int, hashes: List[str]) -> Dict[str, List[float]]:
+        return {h: self.vectors[(model, dimensions, h)] for h in hashes if (model, dimensions, h) in self.vectors}
+
+    def put_many(self, model: str, dimensions: int, vectors: Dict[str, List[float]]):
+        for h, vector in vectors.items():
+            self.vectors[(model, dimensions, h)] = vector
+
+
+class PostgresEmbeddingCache:
+    """
+    Cache in the embedding_cache table. Give it a connection of its own: it
+    commits after every lookup and write, and serializes callers from worker threads.
+    """
+
+    SCHEMA_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+        model TEXT NOT NULL,
+        dimensions INTEGER NOT NULL,   -- 0 = the model's native size
+        text_hash TEXT NOT NULL,       -- sha256 of the normalized text
+        embedding BYTEA NOT NULL,      -- float32 array
+        created_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (model, dimensions, text_hash)
+    );
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+        with self.lock, self.connection, self.connection.cursor() as cursor:
+            cursor.execute(self.SCHEMA_SQL)
+
+    def get_many(self, model: str, dimensions: int, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.lock, self.connection, self.connection.cursor() as cursor:
+            for start in range(0, len(hashes), LOOKUP_CHUNK):
+                cursor.execute(f"""
+                    SELECT text_hash, embedding FROM {CACHE_TABLE}
+                    WHERE model = %s AND dimensions = %s AND text_hash = ANY(%s)
+                """, (model, dimensions, hashes[start:start + LOOKUP_CHUNK]))
+                found.update((h, unpack_vector(data)) for h, data in cursor.fetchall())
+        return found
+
+    def put_many(self, model: str, dimensions: int, vectors: Dict[str, List[float]]):
+        from psycopg2.extras import execute_values
+
+        if not vectors:
+            return
+        with self.lock, self.connection, self.connection.cursor() as cursor:
+            execute_values(cursor, f"""
+                INSERT INTO {CACHE_TABLE} (model, dimensions, text_hash, embedding)
+                VALUES %s
+                ON CONFLICT (model, dimensions, text_hash) DO NOTHING
+            """, [(model, dimensions, h, pack_vector(vector)) for h, vector in vectors.items()],
+                page_size=1000)
+
+
+class SqliteEmbeddingCache:
+    """Cache in a local SQLite file, same key and layout as the Postgres table"""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+                    model TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (model, dimensions, text_hash)
+                )
+            """)
+
+    def get_many(self, model: str, dimensions: int, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.lock:
+            for start in range(0, len(hashes), LOOKUP_CHUNK):
+                chunk = hashes[start:start + LOOKUP_CHUNK]
+                rows = self.connection.execute(f"""
+                    SELECT text_hash, embedding FROM {CACHE_TABLE}
+                    WHERE model = ? AND dimensions = ? AND text_hash IN ({', '.join('?' * len(chunk))})
+                """, (model, dimensions, *chunk))
+                found.update((h, unpack_vector(data)) for h, data in rows)
+        return found
+
+    def put_many(self, model: str, dimensions: int, vectors: Dict[str, List[float]]):
+        with self.lock, self.connection:
+            self.connection.executemany(f"""
+                INSERT OR IGNORE INTO {CACHE_TABLE} (model, dimensions, text_hash, embedding)
+                VALUES (?, ?, ?, ?)
+            """, [(model, dimensions, h, pack_vector(vector)) for h, vector in vectors.items()])
+
+
+class EmbeddingClient:
+    def __init__(self, model: str, dimensions: Optional[int] = None, cache=None,
+                 openai_client: Optional[openai.OpenAI] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_batch_tokens: int = MAX_BATCH_TOKENS):
+        self.model = model
+        self.dimensions = dimensions
+        self.cache = cache if cache is not None else MemoryEmbeddingCache()
+        # The client backs off and retries on 429s itself
+        self.openai_client = openai_client or openai.OpenAI(max_retries=5)
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'texts': 0,          # texts asked for
+            'cache_hits': 0,     # served from the cache
+            'duplicates': 0,     # repeats of another text in the same call
+            'embedded': 0,       # sent to the API
+            'api_calls': 0,
+            'tokens': 0
+        }
+
+    @property
+    def cache_dimensions(self) -> int:
+        return self.dimensions or 0
+
+    def _batches(self, items: Iterable[tuple]) -> Iterable[List[tuple]]:
+        batch = []
+        batch_tokens = 0
+        for item in items:
+            tokens = len(item[1]) // CHARS_PER_TOKEN + 1
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        kwargs = {'dimensions': self.dimensions} if self.dimensions else {}
+        response = self.openai_client.embeddings.create(model=self.model, input=texts, **kwargs)
+        with self.stats_lock:
+            self.stats['api_calls'] += 1
+            self.stats['embedded'] += len(texts)
+            if getattr(response, 'usage', None):
+                self.stats['tokens'] += response.usage.total_tokens
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_many(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embeddings for texts, in input order; only cache misses reach the API"""
+        hashes = [text_hash(text) for text in texts]
+        unique = {}
+        for h, text in zip(hashes, texts):
+            unique.setdefault(h, text)
+
+        vectors = self.cache.get_many(self.model, self.cache_dimensions, list(unique))
+        with self.stats_lock:
+            self.stats['texts'] += len(texts)
+            self.stats['duplicates'] += len(texts) - len(unique)
+            self.stats['cache_hits'] += sum(1 for h in hashes if h in vectors)
+
+        misses = [(h, text) for h, text in unique.items() if h not in vectors]
+        for batch in self._batches(misses):
+            embedded = dict(zip([h for h, _ in batch], self._request([text for _, text in batch])))
+            # Written per request, so an error later in the call keeps what was already paid for
+            self.cache.put_many(self.model, self.cache_dimensions, embedded)
+            vectors.update(embedded)
+
+        return [vectors[h] for h in hashes]
+
+    def embed(self, text: str) -> List[float]:
+        return self.embed_many([text])[0]
+
+    def hit_rate(self) -> float:
+        """Share of requested texts that didn't need an API call"""
+        texts = self.stats['texts']
+        return (texts - self.stats['embedded']) / texts if texts else 0.0
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"{s['texts']:,} texts: {s['cache_hits']:,} cached, {s['duplicates']:,} repeated, "
+                f"{s['embedded']:,} embedded in {s['api_calls']:,} API calls ({s['tokens']:,} tokens), "
+                f"{self.hit_rate():.1%} hit rate")
+
+
+if HAS_LLAMA_INDEX:
+    class CachedEmbedding(BaseEmbedding):
+        """LlamaIndex embed_model backed by an EmbeddingClient, for Settings.embed_model"""
+
+        _client: EmbeddingClient = PrivateAttr()
+
+        def __init__(self, client: EmbeddingClient, **kwargs):
+            super().__init__(model_name=client.model, embed_batch_size=min(client.batch_size, 2048), **kwargs)
+            self._client = client
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "CachedEmbedding"
+
+        @property
+        def client(self) -> EmbeddingClient:
+            return self._client
+
+        def _get_query_embedding(self, query: str) -> List[float]:
+            return self._client.embed(query)
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            return self._get_query_embedding(query)
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            return self._client.embed(text)
+
+        def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            return self._client.embed_many(texts)
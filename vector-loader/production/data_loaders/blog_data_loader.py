@@ -7,7 +7,6 @@ Loads blog articles with CRITICAL priority (0.3 threshold)
 import os
 import sys
 import json
-import time
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any, Optional
@@ -18,11 +17,17 @@ from dotenv import load_dotenv
 from llama_index.core import Document, VectorStoreIndex, Settings
 from llama_index.core.storage.storage_context import StorageContext
 from llama_index.vector_stores.postgres import PGVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 
+import psycopg2
 import sqlalchemy
 
+# Repo root, for the shared embedding client
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from td_embeddings import CachedEmbedding, EmbeddingClient, PostgresEmbeddingCache
+
+from knowledge_base_ingest import EMBED_WORKERS, bulk_ingest
+
 load_dotenv()
 
 # Setup logging
@@ -37,8 +42,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class BlogDataLoader:
-    def __init__(self):
+    def __init__(self, bulk: bool = True, embed_workers: int = EMBED_WORKERS):
         """Initialize blog data loader for unified knowledge base"""
+
+        # bulk: parse, embed and COPY all documents at once instead of index.insert() per document
+        self.bulk = bulk
+        self.embed_workers = embed_workers
         
         # Local PostgreSQL configuration
         self.local_db_config = {
@@ -50,10 +59,12 @@ class BlogDataLoader:
         }
         
         # LlamaIndex configuration
-        self.embedding_model = OpenAIEmbedding(
-            model="text-embedding-3-large",
-            dimensions=1536
-        )
+        # Embeddings are cached in embedding_cache, so unchanged content costs no API calls on re-runs
+        self.embedding_model = CachedEmbedding(EmbeddingClient(
+            "text-embedding-3-large",
+            dimensions=1536,
+            cache=PostgresEmbeddingCache(psycopg2.connect(**self.local_db_config))
+        ))
         
         Settings.embed_model = self.embedding_model
         Settings.llm = OpenAI(model="gpt-4")
@@ -184,6 +195,21 @@ class BlogDataLoader:
         self.progress['embedding_cost_estimate'] = cost_estimate
         logger.info(f"💰 Estimated embedding cost: ${cost_estimate:.4f}")
         
+        if self.bulk:
+            connection = psycopg2.connect(**self.local_db_config)
+            try:
+                nodes_written = bulk_ingest(connection, documents, self.embedding_model.client,
+                                            workers=self.embed_workers, progress=self.progress)
+                self.progress['blog_docs_processed'] += len(documents)
+                logger.info(f"📊 Progress: {len(documents)} blog articles added as {nodes_written} nodes")
+            except Exception as e:
+                error_msg = f"Error in bulk ingest: {e}"
+                logger.error(error_msg)
+                self.progress['errors'].append(error_msg)
+            finally:
+                connection.close()
+            return self.index
+        
         # Process in batches
         for i in range(0, len(documents), batch_size):
             batch = documents[i:i + batch_size]
@@ -202,9 +228,6 @@ class BlogDataLoader:
                 
                 logger.info(f"📊 Progress: {self.progress['blog_docs_processed']}/{self.progress['total_blog_docs']} blog articles processed")
                 
-                # Small delay to prevent overwhelming the API
-                time.sleep(1)
-                
             except Exception as e:
                 error_msg = f"Error processing batch {batch_num}: {e}"
                 logger.error(error_msg)
@@ -294,6 +317,7 @@ class BlogDataLoader:
             logger.info(f"📊 Blog articles added: {self.progress['blog_docs_processed']}")
             logger.info(f"💰 Embedding cost: ${self.progress['embedding_cost_estimate']:.4f}")
             logger.info(f"❌ Errors: {len(self.progress['errors'])}")
+            logger.info(f"🗃️  Embedding cache: {self.embedding_model.client.summary()}")
             
             logger.info(f"\n📊 UPDATED KNOWLEDGE BASE:")
             logger.info(f"  • Total documents: {after_stats.get('total', 0):,}")
@@ -327,11 +351,14 @@ def main():
     
     parser = argparse.ArgumentParser(description='Load blog data into unified knowledge base')
     parser.add_argument('--test', action='store_true', help='Run with small subset for testing')
+    parser.add_argument('--index-insert', action='store_true',
+                        help='Insert documents one at a time through the LlamaIndex index instead of bulk ingest')
+    parser.add_argument('--workers', type=int, default=EMBED_WORKERS, help='Concurrent embedding requests for bulk ingest')
     
     args = parser.parse_args()
     
     # Initialize and run loader
-    loader = BlogDataLoader()
+    loader = BlogDataLoader(bulk=not args.index_insert, embed_workers=args.workers)
     
     try:
         index = loader.run_blog_loading()
@@ -22,11 +22,15 @@ from enhanced_forum_loader import EnhancedForumLoader
 from llama_index.core import Document, VectorStoreIndex, Settings
 from llama_index.core.storage.storage_context import StorageContext
 from llama_index.vector_stores.postgres import PGVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 
+import psycopg2
 import sqlalchemy
 
+# Repo root, for the shared embedding client
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from td_embeddings import CachedEmbedding, EmbeddingClient, PostgresEmbeddingCache
+
 load_dotenv()
 
 # Setup logging with detailed output
@@ -54,10 +58,12 @@ class ForumDataLoaderStep1:
         }
         
         # LlamaIndex configuration
-        self.embedding_model = OpenAIEmbedding(
-            model="text-embedding-3-large",
-            dimensions=1536
-        )
+        # Embeddings are cached in embedding_cache, so unchanged content costs no API calls on re-runs
+        self.embedding_model = CachedEmbedding(EmbeddingClient(
+            "text-embedding-3-large",
+            dimensions=1536,
+            cache=PostgresEmbeddingCache(psycopg2.connect(**self.local_db_config))
+        ))
         
         # Configure LlamaIndex settings
         Settings.embed_model = self.embedding_model
@@ -254,6 +260,7 @@ class ForumDataLoaderStep1:
             logger.info(f"💬 Raw documents processed: {self.progress['raw_docs_processed']}")
             logger.info(f"💰 Total embedding cost: ${self.progress['embedding_cost_estimate']:.4f}")
             logger.info(f"❌ Errors: {len(self.progress['errors'])}")
+            logger.info(f"🗃️  Embedding cache: {self.embedding_model.client.summary()}")
             
             if self.progress['errors']:
                 logger.info("🚨 Error details:")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Bulk ingest into the unified llamaindex_knowledge_base table.
+The blog, YouTube and facts loaders used to call index.insert() once per
+document, so LlamaIndex parsed, embedded and wrote every document on its own
+(with a sleep per batch). This runs the node parser over all documents at once,
+embeds the nodes in large batches on several threads through the shared
+EmbeddingClient, and COPYs each batch into the table.
+
+Rows get the table's usual columns (node_id, text, metadata_, embedding), and
+metadata_ carries LlamaIndex's node payload next to the source/priority keys,
+exactly as an index.insert() row merged into the table would.
+"""
+
+import csv
+import io
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from llama_index.core import Settings
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_BASE_TABLE = "llamaindex_knowledge_base"
+
+# Nodes per embedding call; EmbeddingClient splits further on token limits
+EMBED_BATCH_SIZE = 500
+EMBED_WORKERS = 4
+
+SCHEMA_SQL = f"""
+CREATE EXTENSION IF NOT EXISTS vector;
+CREATE TABLE IF NOT EXISTS {KNOWLEDGE_BASE_TABLE} (
+    node_id VARCHAR PRIMARY KEY,
+    text TEXT NOT NULL,
+    metadata_ JSONB,
+    embedding VECTOR(1536)
+);
+"""
+
+
+def build_nodes(documents: Sequence[Document], node_parser=None) -> List[BaseNode]:
+    """Split documents into nodes with the same parser index.insert() uses"""
+    node_parser = node_parser or Settings.node_parser
+    return node_parser.get_nodes_from_documents(list(documents))
+
+
+def _copy_rows(cursor, nodes: Sequence[BaseNode], embeddings: Sequence[List[float]]):
+    # Staged and swapped in, so re-loading a node replaces its row instead of failing on the key
+    cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS kb_ingest_staging
+        (LIKE {KNOWLEDGE_BASE_TABLE} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+    """)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for node, embedding in zip(nodes, embeddings):
+        metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+        writer.writerow([
+            node.node_id,
+            node.get_content(metadata_mode=MetadataMode.NONE),
+            json.dumps(metadata, default=str),
+            '[' + ','.join(map(str, embedding)) + ']'
+        ])
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY kb_ingest_staging (node_id, text, metadata_, embedding) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+    cursor.execute(f"""
+        DELETE FROM {KNOWLEDGE_BASE_TABLE} kb USING kb_ingest_staging s WHERE kb.node_id = s.node_id
+    """)
+    cursor.execute(f"""
+        INSERT INTO {KNOWLEDGE_BASE_TABLE} (node_id, text, metadata_, embedding)
+        SELECT node_id, text, metadata_, embedding FROM kb_ingest_staging
+    """)
+
+
+def bulk_ingest(connection, documents: Sequence[Document], embed_client,
+                batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS,
+                node_parser=None, progress: Optional[Dict] = None) -> int:
+    """
+    Parse, embed and write documents into llamaindex_knowledge_base.
+    embed_client is a td_embeddings.EmbeddingClient. Each batch is committed as
+    soon as it's written, so a failure keeps the batches before it.
+    Returns the number of nodes written.
+    """
+    nodes = build_nodes(documents, node_parser)
+    logger.info(f"🧩 {len(documents)} documents -> {len(nodes)} nodes")
+    if not nodes:
+        return 0
+
+    with connection, connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL)
+
+    # Embedded with metadata, like index.insert() does
+    batches = [nodes[i:i + batch_size] for i in range(0, len(nodes), batch_size)]
+
+    def embed_batch(batch):
+        return embed_client.embed_many([node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch])
+
+    written = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_num in range(1, len(batches) + 1):
+            # Keep a couple of batches per worker in flight, write the oldest in order
+            while len(pending) < workers * 2 and batch_num + len(pending) <= len(batches):
+                batch = batches[batch_num + len(pending) - 1]
+                pending.append((batch, executor.submit(embed_batch, batch)))
+            batch, future = pending.popleft()
+            embeddings = future.result()
+
+            with connection, connection.cursor() as cursor:
+                _copy_rows(cursor, batch, embeddings)
+            written += len(batch)
+            if progress is not None:
+                progress['nodes_written'] = written
+            logger.info(f"📊 Batch {batch_num}/{len(batches)}: {written}/{len(nodes)} nodes written")
+
+    return written
@@ -5,19 +5,36 @@ Enhanced Fact Extraction Script with Database Storage
 Extracts factual statements from articles using Claude Sonnet 4,
 generates embeddings using OpenAI text-embedding-3-large,
 and stores them in PostgreSQL facts table.
+
+Embeddings go through the shared embedding_cache (td_embeddings), so facts that
+were extracted before with the same wording cost no API call on re-runs.
+
+Near-duplicate detection runs in process: existing fact embeddings are loaded
+once into a normalized NumPy matrix, and each article's facts are compared
+against it (and against each other) with one matrix multiply.
+
+Articles are pipelined: LLM extraction runs for several articles at once in
+worker threads while the main thread embeds, dedups and stores finished
+articles in order. Each article's facts go in with one INSERT, committed
+together with a checkpoint row (file name + content hash), so an interrupted
+run resumes where it stopped and unchanged articles are never re-extracted.
 """
 
 import os
 import sys
-import time
+import argparse
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 from anthropic import Anthropic
 import openai
 import frontmatter
+import numpy as np
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import json
 
 # Load environment variables
@@ -25,21 +42,38 @@ load_dotenv()
 
 # Add parent directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).resolve().parents[3]))
 from utils.db_connection import get_db_connection
+from td_embeddings import EmbeddingClient, PostgresEmbeddingCache
+
+SIMILARITY_THRESHOLD = 0.90
+
+# Articles in LLM extraction at once (more are read ahead, up to twice this)
+DEFAULT_EXTRACTION_WORKERS = 4
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Unit-length float32 rows, so a dot product is the cosine similarity"""
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
 
 class FactExtractorWithDatabase:
     def __init__(self):
         # Initialize API clients
         self.anthropic_client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
-        self.openai_client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        # The client backs off and retries on 429s itself
+        self.openai_client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=5)
         
         # Embedding configuration (matches vector-processor)
         self.embedding_model = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-large')
         self.embedding_dimensions = int(os.getenv('OPENAI_EMBEDDING_DIMENSIONS', '1536'))
+        self.embedder = None
         
-        # Rate limiting for API calls
-        self.last_api_call = 0
-        self.min_api_interval = 0.1  # 10 requests per second max
+        # Stored facts for duplicate checks: unit-length embeddings and their rows
+        self.fact_matrix = None
+        self.fact_rows = []
         
         self.stats = {
             'facts_extracted': 0,
@@ -71,6 +105,15 @@ class FactExtractorWithDatabase:
         -- Create index for source article lookups
         CREATE INDEX IF NOT EXISTS idx_facts_source_article 
         ON facts(source_article);
+        
+        -- One row per finished article, written in the same transaction as its facts
+        CREATE TABLE IF NOT EXISTS fact_extraction_checkpoints (
+            source_article VARCHAR(200) PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            facts_extracted INTEGER NOT NULL,
+            facts_stored INTEGER NOT NULL,
+            processed_at TIMESTAMP DEFAULT NOW()
+        );
         """
         
         try:
@@ -80,37 +123,35 @@ class FactExtractorWithDatabase:
                 conn.commit()
             conn.close()
             print("✅ Facts table and indexes ready")
+            
+            # Cached embeddings, on a connection of their own
+            self.embedder = EmbeddingClient(
+                self.embedding_model,
+                dimensions=self.embedding_dimensions,
+                cache=PostgresEmbeddingCache(get_db_connection()),
+                openai_client=self.openai_client
+            )
         except Exception as e:
             print(f"❌ Failed to create facts table: {e}")
             raise
 
-    def create_embedding(self, text: str):
-        """Create embedding using OpenAI API with rate limiting"""
-        # Rate limiting
-        current_time = time.time()
-        time_since_last_call = current_time - self.last_api_call
-        
-        if time_since_last_call < self.min_api_interval:
-            sleep_time = self.min_api_interval - time_since_last_call
-            time.sleep(sleep_time)
-
+    def create_embeddings(self, texts):
+        """Create embeddings for several texts; only texts missing from the cache reach the API"""
         try:
-            response = self.openai_client.embeddings.create(
-                model=self.embedding_model,
-                input=text,
-                dimensions=self.embedding_dimensions
-            )
-            
-            self.last_api_call = time.time()
-            self.stats['embeddings_created'] += 1
-            
-            return response.data[0].embedding
+            embeddings = self.embedder.embed_many(texts)
+            self.stats['embeddings_created'] += len(embeddings)
+            return embeddings
             
         except Exception as e:
-            print(f"❌ Error creating embedding: {e}")
+            print(f"❌ Error creating embeddings: {e}")
             self.stats['errors'] += 1
             return None
 
+    def create_embedding(self, text: str):
+        """Create embedding for a single text"""
+        embeddings = self.create_embeddings([text])
+        return embeddings[0] if embeddings else None
+
     def extract_facts_from_article(self, article_content, article_title):
         """Extract factual statements from article using Claude Sonnet 4 with OpenAI fallback"""
         
@@ -167,7 +208,6 @@ FACT: Workouts can be duplicated by holding ALT key and dragging
                 
             except Exception as e2:
                 print(f"❌ Both Claude and OpenAI failed. OpenAI: {e2}")
-                self.stats['errors'] += 1
                 return None
 
     def parse_facts_from_response(self, ai_response):
@@ -188,73 +228,133 @@ FACT: Workouts can be duplicated by holding ALT key and dragging
         
         return facts
 
-    def check_fact_similarity(self, fact_embedding, similarity_threshold=0.90):
-        """Check if similar fact already exists in database"""
+    def load_existing_facts(self):
+        """Load every stored fact embedding once for in-process duplicate checks"""
+        conn = get_db_connection()
         try:
-            conn = get_db_connection()
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                query = """
-                SELECT id, fact_text, source_article,
-                       (1 - (embedding <=> %s::vector)) as similarity_score
-                FROM facts
-                WHERE (1 - (embedding <=> %s::vector)) > %s
-                ORDER BY similarity_score DESC
-                LIMIT 1
-                """
-                
-                cursor.execute(query, [fact_embedding, fact_embedding, similarity_threshold])
-                result = cursor.fetchone()
-            
+                cursor.execute("""
+                    SELECT id, fact_text, source_article, embedding::real[] AS embedding
+                    FROM facts
+                    ORDER BY id
+                """)
+                rows = cursor.fetchall()
+        finally:
             conn.close()
-            return result
-            
-        except Exception as e:
-            print(f"❌ Error checking fact similarity: {e}")
-            self.stats['errors'] += 1
-            return None
+        
+        self.fact_rows = [{key: row[key] for key in ('id', 'fact_text', 'source_article')} for row in rows]
+        self.fact_matrix = normalize_rows([row['embedding'] for row in rows]) if rows else None
+        print(f"📚 Loaded {len(rows)} existing facts for duplicate checks")
 
-    def store_fact_in_database(self, fact_text, source_article, embedding):
-        """Store fact with embedding in database"""
-        try:
-            conn = get_db_connection()
-            with conn.cursor() as cursor:
-                # Create metadata
-                metadata = {
-                    'extraction_date': datetime.now().isoformat(),
-                    'embedding_model': self.embedding_model,
-                    'embedding_dimensions': self.embedding_dimensions
-                }
-                
-                query = """
-                INSERT INTO facts (fact_text, source_article, embedding, metadata)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id
-                """
-                
-                cursor.execute(query, [
-                    fact_text,
-                    source_article,
-                    embedding,
-                    json.dumps(metadata)
-                ])
-                
-                fact_id = cursor.fetchone()[0]
-                conn.commit()
-            
-            conn.close()
-            self.stats['facts_stored'] += 1
-            return fact_id
-            
-        except Exception as e:
-            print(f"❌ Error storing fact: {e}")
-            self.stats['errors'] += 1
-            return None
+    def add_known_facts(self, facts, embeddings):
+        """Make newly stored facts visible to duplicate checks for later articles"""
+        if not facts:
+            return
+        matrix = normalize_rows(embeddings)
+        self.fact_matrix = matrix if self.fact_matrix is None else np.vstack([self.fact_matrix, matrix])
+        self.fact_rows.extend(facts)
+
+    def find_duplicate_facts(self, fact_texts, embeddings, similarity_threshold=SIMILARITY_THRESHOLD):
+        """
+        Match a batch of new facts against stored facts and each other.
+        Returns one entry per fact: None when it is new, otherwise the fact it
+        duplicates ({'id', 'fact_text', 'source_article', 'similarity_score'};
+        id is None for an earlier fact of the same batch).
+        """
+        if not fact_texts:
+            return []
+        
+        batch = normalize_rows(embeddings)
+        duplicates = [None] * len(fact_texts)
+        
+        if self.fact_matrix is not None and len(self.fact_rows):
+            similarities = batch @ self.fact_matrix.T
+            best = similarities.argmax(axis=1)
+            best_scores = similarities[np.arange(len(fact_texts)), best]
+            for i in np.flatnonzero(best_scores > similarity_threshold):
+                duplicates[i] = {**self.fact_rows[best[i]], 'similarity_score': float(best_scores[i])}
+        
+        # Within the batch, the first of several near-identical facts is kept
+        batch_similarities = batch @ batch.T
+        kept = []
+        for i in range(len(fact_texts)):
+            if duplicates[i] is None and kept:
+                scores = batch_similarities[i, kept]
+                j = int(scores.argmax())
+                if scores[j] > similarity_threshold:
+                    duplicates[i] = {'id': None, 'fact_text': fact_texts[kept[j]], 'source_article': None,
+                                     'similarity_score': float(scores[j])}
+            if duplicates[i] is None:
+                kept.append(i)
+        
+        return duplicates
+
+    def check_fact_similarity(self, fact_embedding, similarity_threshold=SIMILARITY_THRESHOLD):
+        """Check if similar fact already exists in database"""
+        if self.fact_matrix is None:
+            self.load_existing_facts()
+        return self.find_duplicate_facts([''], [fact_embedding], similarity_threshold)[0]
+
+    def store_facts_in_database(self, cursor, source_article, fact_texts, embeddings):
+        """Store an article's facts with one multi-row insert (caller commits); returns their ids"""
+        if not fact_texts:
+            return []
+        
+        metadata = json.dumps({
+            'extraction_date': datetime.now().isoformat(),
+            'embedding_model': self.embedding_model,
+            'embedding_dimensions': self.embedding_dimensions
+        })
+        rows = execute_values(cursor, """
+            INSERT INTO facts (fact_text, source_article, embedding, metadata)
+            VALUES %s
+            RETURNING id
+        """, [(fact_text, source_article, str(list(embedding)), metadata)
+              for fact_text, embedding in zip(fact_texts, embeddings)],
+            template="(%s, %s, %s::vector, %s)", page_size=len(fact_texts), fetch=True)
+        return [row[0] for row in rows]
+
+    def load_checkpoints(self, conn):
+        """Content hash of every article already processed"""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT source_article, content_hash FROM fact_extraction_checkpoints")
+            return dict(cursor.fetchall())
+
+    def save_checkpoint(self, cursor, source_article, content_hash, facts_extracted, facts_stored):
+        cursor.execute("""
+            INSERT INTO fact_extraction_checkpoints
+                (source_article, content_hash, facts_extracted, facts_stored)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (source_article) DO UPDATE SET
+                content_hash = EXCLUDED.content_hash,
+                facts_extracted = EXCLUDED.facts_extracted,
+                facts_stored = EXCLUDED.facts_stored,
+                processed_at = NOW()
+        """, (source_article, content_hash, facts_extracted, facts_stored))
 
-    def process_all_articles(self):
+    def extract_article(self, article_file):
+        """
+        Read one article and extract its facts (runs in a worker thread).
+        Leaves self.stats alone; the main thread adds the returned error count.
+        """
+        with open(article_file, 'r', encoding='utf-8') as f:
+            post = frontmatter.load(f)
+        
+        article_title = post.metadata.get('title', article_file.stem)
+        ai_response = self.extract_facts_from_article(post.content, article_title)
+        return {
+            'title': article_title,
+            'content_length': len(post.content),
+            'facts': self.parse_facts_from_response(ai_response) if ai_response else None,
+            'errors': 0 if ai_response else 1
+        }
+
+    def process_all_articles(self, workers=DEFAULT_EXTRACTION_WORKERS, resume=True):
         """Process all articles and store facts in database"""
         
         # Setup database table
         self.setup_facts_table()
+        self.load_existing_facts()
         
         # Get the output path from environment
         content_output_path = os.getenv('CONTENT_OUTPUT_PATH', '.')
@@ -271,7 +371,18 @@ FACT: Workouts can be duplicated by holding ALT key and dragging
             print(f"❌ No articles found in {articles_dir}")
             return None
         
-        print(f"📄 Found {len(article_files)} articles to process")
+        # One connection for the whole run; each article commits once
+        conn = get_db_connection()
+        checkpoints = self.load_checkpoints(conn) if resume else {}
+        
+        todo = []
+        for article_file in article_files:
+            content_hash = hashlib.md5(article_file.read_bytes()).hexdigest()
+            if checkpoints.get(article_file.name) != content_hash:
+                todo.append((article_file, content_hash))
+        
+        print(f"📄 Found {len(article_files)} articles, {len(article_files) - len(todo)} unchanged since their checkpoint")
+        print(f"⚡ {len(todo)} to process with {workers} extraction workers")
         print()
         
         # Initialize totals
@@ -280,91 +391,113 @@ FACT: Workouts can be duplicated by holding ALT key and dragging
         total_facts_stored = 0
         all_processed_facts = []
         
-        # Process each article
-        for article_idx, article_file in enumerate(article_files, 1):
-            print(f"🔄 Processing article {article_idx}/{len(article_files)}: {article_file.name}")
-            
-            # Read and parse the article
-            try:
-                with open(article_file, 'r', encoding='utf-8') as f:
-                    post = frontmatter.load(f)
-                
-                article_title = post.metadata.get('title', article_file.stem)
-                article_content = post.content
-                
-                print(f"   📖 Title: {article_title}")
-                print(f"   📊 Content length: {len(article_content)} characters")
-                
-            except Exception as e:
-                print(f"   ❌ Error reading article: {e}")
-                self.stats['errors'] += 1
-                continue
-            
-            # Extract facts
-            print(f"   🤖 Extracting facts...")
-            ai_response = self.extract_facts_from_article(article_content, article_title)
-            
-            if not ai_response:
-                print(f"   ❌ Failed to extract facts")
-                continue
-            
-            facts = self.parse_facts_from_response(ai_response)
-            article_facts_extracted = len(facts)
-            total_facts_extracted += article_facts_extracted
-            
-            print(f"   ✅ Extracted {article_facts_extracted} facts")
-            
-            # Process each fact for this article
-            print(f"   🔄 Processing facts (embedding + database storage)...")
-            
-            article_facts_stored = 0
-            for i, fact_text in enumerate(facts, 1):
-                print(f"      Processing fact {i}/{len(facts)}: {fact_text[:40]}...")
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                queue = iter(todo)
+                in_flight = deque()
                 
-                # Create embedding
-                embedding = self.create_embedding(fact_text)
-                if not embedding:
-                    print(f"      ❌ Failed to create embedding for fact {i}")
-                    continue
+                def submit_next():
+                    for article_file, content_hash in queue:
+                        in_flight.append((article_file, content_hash, executor.submit(self.extract_article, article_file)))
+                        if len(in_flight) >= workers * 2:
+                            return
                 
-                # Check for similar facts
-                similar_fact = self.check_fact_similarity(embedding)
-                if similar_fact:
-                    print(f"      ⚠️  Similar fact exists (similarity: {similar_fact['similarity_score']:.3f})")
-                    print(f"          Existing: {similar_fact['fact_text'][:40]}...")
-                    print(f"          Skipping duplicate")
-                    continue
+                submit_next()
+                article_idx = 0
                 
-                # Store fact in database
-                fact_id = self.store_fact_in_database(fact_text, article_file.name, embedding)
-                if fact_id:
-                    print(f"      ✅ Stored fact #{fact_id}")
-                    article_facts_stored += 1
-                    all_processed_facts.append({
+                # Results are taken in file order so duplicate checks see articles in a stable order
+                while in_flight:
+                    article_file, content_hash, future = in_flight.popleft()
+                    submit_next()
+                    article_idx += 1
+                    print(f"🔄 Processing article {article_idx}/{len(todo)}: {article_file.name}")
+                    
+                    try:
+                        extracted = future.result()
+                    except Exception as e:
+                        print(f"   ❌ Error reading article: {e}")
+                        self.stats['errors'] += 1
+                        continue
+                    
+                    self.stats['errors'] += extracted['errors']
+                    print(f"   📖 Title: {extracted['title']}")
+                    print(f"   📊 Content length: {extracted['content_length']} characters")
+                    
+                    facts = extracted['facts']
+                    if facts is None:
+                        print(f"   ❌ Failed to extract facts")
+                        continue
+                    
+                    article_facts_extracted = len(facts)
+                    total_facts_extracted += article_facts_extracted
+                    print(f"   ✅ Extracted {article_facts_extracted} facts")
+                    
+                    # One cache lookup (and at most one API call) for the whole article
+                    embeddings = self.create_embeddings(facts) if facts else []
+                    if embeddings is None:
+                        print(f"   ❌ Failed to create embeddings")
+                        continue
+                    
+                    # Every fact of the article checked against stored facts and each other at once
+                    duplicates = self.find_duplicate_facts(facts, embeddings)
+                    for fact_text, similar_fact in zip(facts, duplicates):
+                        if similar_fact:
+                            print(f"      ⚠️  Duplicate (similarity: {similar_fact['similarity_score']:.3f}): {fact_text[:40]}...")
+                            print(f"          Existing: {similar_fact['fact_text'][:40]}...")
+                    
+                    new_facts = [(fact_text, embedding) for fact_text, embedding, similar_fact
+                                 in zip(facts, embeddings, duplicates) if not similar_fact]
+                    fact_texts = [fact_text for fact_text, _ in new_facts]
+                    fact_embeddings = [embedding for _, embedding in new_facts]
+                    
+                    try:
+                        with conn.cursor() as cursor:
+                            fact_ids = self.store_facts_in_database(cursor, article_file.name, fact_texts, fact_embeddings)
+                            self.save_checkpoint(cursor, article_file.name, content_hash,
+                                                 article_facts_extracted, len(fact_ids))
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        print(f"   ❌ Error storing facts: {e}")
+                        self.stats['errors'] += 1
+                        continue
+                    
+                    self.stats['facts_stored'] += len(fact_ids)
+                    self.add_known_facts(
+                        [{'id': fact_id, 'fact_text': fact_text, 'source_article': article_file.name}
+                         for fact_id, fact_text in zip(fact_ids, fact_texts)],
+                        fact_embeddings
+                    )
+                    all_processed_facts.extend({
                         'id': fact_id,
                         'text': fact_text,
                         'article': article_file.name,
                         'embedding_created': True
-                    })
-            
-            total_facts_stored += article_facts_stored
-            total_articles_processed += 1
-            
-            print(f"   📊 Article Summary: {article_facts_extracted} extracted, {article_facts_stored} stored")
-            print()
+                    } for fact_id, fact_text in zip(fact_ids, fact_texts))
+                    
+                    total_facts_stored += len(fact_ids)
+                    total_articles_processed += 1
+                    
+                    print(f"   📊 Article Summary: {article_facts_extracted} extracted, {len(fact_ids)} stored")
+                    print()
+        finally:
+            conn.close()
         
         print(f"🎉 FINAL PROCESSING SUMMARY:")
         print(f"=" * 40)
-        print(f"   - Articles processed: {total_articles_processed}/{len(article_files)}")
+        print(f"   - Articles processed: {total_articles_processed}/{len(todo)}")
+        print(f"   - Articles skipped (unchanged): {len(article_files) - len(todo)}")
         print(f"   - Total facts extracted: {total_facts_extracted}")
         print(f"   - Total facts stored: {total_facts_stored}")
         print(f"   - Total embeddings created: {self.stats['embeddings_created']}")
+        print(f"   - Embedding cache: {self.embedder.summary()}")
         print(f"   - Total errors: {self.stats['errors']}")
         print(f"   - Duplicate facts skipped: {total_facts_extracted - total_facts_stored}")
         
         return {
             'articles_processed': total_articles_processed,
             'total_articles': len(article_files),
+            'articles_skipped': len(article_files) - len(todo),
             'total_facts_extracted': total_facts_extracted,
             'total_facts_stored': total_facts_stored,
             'facts': all_processed_facts,
@@ -373,13 +506,20 @@ FACT: Workouts can be duplicated by holding ALT key and dragging
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Extract facts from articles-ai/ into the facts table")
+    parser.add_argument("--workers", type=int, default=DEFAULT_EXTRACTION_WORKERS,
+                        help=f"Articles in LLM extraction at once (default: {DEFAULT_EXTRACTION_WORKERS})")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignore checkpoints and re-extract every article")
+    args = parser.parse_args()
+    
     print("🎯 FACT EXTRACTION WITH DATABASE STORAGE")
     print("=" * 50)
     
     extractor = FactExtractorWithDatabase()
     
     try:
-        result = extractor.process_all_articles()
+        result = extractor.process_all_articles(workers=args.workers, resume=not args.no_resume)
         
         if result:
             print("\n✅ All articles processed successfully!")
@@ -394,4 +534,4 @@ def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Connections to the local knowledge-base database (trainerday_local) that holds
+the facts tables. Connections come from the shared td_db pool, so scripts that
+call get_db_connection() per query reuse one connection instead of reconnecting;
+close() hands it back to the pool.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# Repo root, for the shared database module
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+import td_db
+
+# Same local PostgreSQL configuration as the data loaders
+LOCAL_DB_CONFIG = {
+    'host': 'localhost',
+    'port': 5432,
+    'database': 'trainerday_local',
+    'user': os.getenv('USER', 'alex'),
+    'password': '',
+}
+
+
+def get_db_connection():
+    """A pooled connection to trainerday_local"""
+    return td_db.get_connection(LOCAL_DB_CONFIG)